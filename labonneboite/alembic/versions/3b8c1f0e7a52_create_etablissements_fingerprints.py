@@ -0,0 +1,35 @@
+"""
+Create etablissements_fingerprints table
+
+Revision ID: 3b8c1f0e7a52
+Revises: 66af73e521cb
+Create Date: 2026-10-18 10:12:41.512307
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# Revision identifiers, used by Alembic.
+revision = '3b8c1f0e7a52'
+down_revision = '66af73e521cb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'etablissements_fingerprints',
+        sa.Column('siret', mysql.VARCHAR(length=14), nullable=False),
+        sa.Column('departement', mysql.VARCHAR(length=8), nullable=False),
+        sa.Column('fingerprint', mysql.VARCHAR(length=40), nullable=False),
+        sa.PrimaryKeyConstraint('siret'),
+        mysql_collate='utf8mb4_unicode_ci',
+        mysql_default_charset='utf8mb4',
+        mysql_engine='InnoDB'
+    )
+    op.create_index('_fingerprint_departement', 'etablissements_fingerprints', ['departement'], unique=False)
+
+
+def downgrade():
+    op.drop_table('etablissements_fingerprints')
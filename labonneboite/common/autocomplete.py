@@ -3,6 +3,7 @@ from slugify import slugify
 import unidecode
 from labonneboite.common.es import Elasticsearch
 from labonneboite.common.conf import settings
+from labonneboite.common.job_label_index import JobLabelIndex
 
 MAX_JOBS = 10
 MAX_LOCATIONS = 10
@@ -111,10 +112,54 @@ def enrich_job_term_with_thesaurus(term):
     return term
 
 
+@lru_cache(maxsize=None)
+def get_job_label_index():
+    """
+    In-memory index of the same OGR documents as the ones of the `ogr` ES type.
+    """
+    # Imported here because load_data reads all its csv files at import time.
+    from labonneboite.common.load_data import load_ogr_labels, OGR_ROME_CODES
+    documents = [
+        {
+            'ogr_code': ogr,
+            'ogr_description': description,
+            'rome_code': OGR_ROME_CODES[ogr],
+            'rome_description': settings.ROME_DESCRIPTIONS[OGR_ROME_CODES[ogr]],
+        }
+        for ogr, description in load_ogr_labels().items() if ogr in OGR_ROME_CODES
+    ]
+    return JobLabelIndex(documents)
+
+
+def make_job_label_suggestion(source, score, highlight=None):
+    highlight = highlight or {}
+    try:
+        rome_description = highlight['rome_description.autocomplete'][0]
+    except KeyError:
+        rome_description = source['rome_description']
+    try:
+        ogr_description = highlight['ogr_description.autocomplete'][0]
+    except KeyError:
+        ogr_description = source['ogr_description']
+    label = "%s (%s, ...)" % (rome_description, ogr_description)
+    value = "%s (%s, ...)" % (source["rome_description"], source["ogr_description"])
+    return {
+        'id': source['rome_code'],
+        'label': label,
+        'value': value,
+        'occupation': slugify(source['rome_description'].lower()),
+        'score': round(score, 1),
+    }
+
+
 @lru_cache(maxsize=8 * 1024)
 def build_job_label_suggestions(term, size=MAX_JOBS):
     term = enrich_job_term_with_thesaurus(term)
 
+    if settings.AUTOCOMPLETE_JOB_LABELS_LOCAL_INDEX:
+        results = get_job_label_index().search_by_rome(unidecode.unidecode(term))
+        return [make_job_label_suggestion(source, score) for score, source in results[:size]]
+
     es = Elasticsearch()
 
     body = {
@@ -174,26 +219,7 @@ def build_job_label_suggestions(term, size=MAX_JOBS):
     for hit in results:
         if len(suggestions) < size:
             hit = hit['by_top_hit']['hits']['hits'][0]
-            source = hit['_source']
-            highlight = hit.get('highlight', {})
-            try:
-                rome_description = highlight['rome_description.autocomplete'][0]
-            except KeyError:
-                rome_description = source['rome_description']
-            try:
-                ogr_description = highlight['ogr_description.autocomplete'][0]
-            except KeyError:
-                ogr_description = source['ogr_description']
-            label = "%s (%s, ...)" % (rome_description, ogr_description)
-            value = "%s (%s, ...)" % (source["rome_description"], source["ogr_description"])
-            score = round(hit['_score'], 1)
-            suggestions.append({
-                'id': source['rome_code'],
-                'label': label,
-                'value': value,
-                'occupation': slugify(source['rome_description'].lower()),
-                'score': score,
-            })
+            suggestions.append(make_job_label_suggestion(hit['_source'], hit['_score'], hit.get('highlight')))
         else:
             break
 
@@ -50,6 +50,26 @@ NAF_CODES = load_naf_labels()
 
 SEARCHING_TIME = 10000
 
+# When True, HiddenMarketFetcher.get_offices() reads the total office count from
+# the hits of the search itself instead of running a separate ES count first.
+# Set it to False to get back the former count + search behavior.
+SEARCH_SINGLE_ROUND_TRIP = True
+# When True, the office counts of all alternative romes and distances suggested
+# for searches with few results are computed in a single ES _msearch request.
+SEARCH_SUGGESTIONS_MSEARCH = True
+# When True, the /api/v1/filter/ endpoint computes all its facets with a single
+# ES request made of filter aggregations, instead of one search per facet.
+API_FILTER_SINGLE_QUERY = True
+# When True, job label autocompletion is served by an in-memory index of the OGR
+# labels (see common/job_label_index.py) instead of an ES query per keystroke.
+AUTOCOMPLETE_JOB_LABELS_LOCAL_INDEX = True
+# When True, all database connections are closed at the end of each request
+# instead of being kept in the connection pool (see common/database.py).
+DB_DISPOSE_ENGINE_ON_TEARDOWN = False
+# When True, the ESD offers of searches with more than 3 romes are fetched
+# with concurrent calls instead of one call after the other.
+ESD_OFFERS_CONCURRENT_FETCH = True
+
 DISTANCE_FILTER_DEFAULT = 10
 
 ENABLE_TIMEIT_TIMERS = True
@@ -135,6 +155,10 @@ ES_INDEX = "labonneboite"
 # Set ES_TIMEOUT environment variable to 0 to remove ES timeouts entirely
 ES_TIMEOUT = int(os.environ.get("ES_TIMEOUT", 10)) or None
 ES_HOST = os.environ.get("ES_HOST", "localhost:9200")
+# How per-ROME office scores are indexed, see common/es.py: "object" (one mapped field
+# per ROME code) or "nested" (one nested document per ROME code with its score).
+# Indexes must be rebuilt (or migrated with scripts/migrate_scores_encoding.py) when it changes.
+ES_SCORES_ENCODING = os.environ.get("ES_SCORES_ENCODING", "object")
 DB_HOST = os.environ.get("DB_HOST", "localhost")
 DB_PORT = os.environ.get("DB_PORT", 3306)
 DB_NAME = os.environ.get("DB_NAME", "labonneboite")
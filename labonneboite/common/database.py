@@ -1,12 +1,15 @@
 # http://flask.pocoo.org/docs/0.12/patterns/sqlalchemy/#declarative
 # http://docs.sqlalchemy.org/en/rel_1_1/
 import os
+import threading
+import time
 import urllib.parse
 from typing import Optional, Dict, Union, TYPE_CHECKING
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from labonneboite.common.conf import settings
 from labonneboite.common.env import get_current_env, ENV_TEST
@@ -41,18 +44,84 @@ def get_db_string(db_params: Optional[Dict[str, Union[str, int, None]]] = None)
     return s
 
 
-pool_recycle = int(os.environ.get("DB_CONNECTION_TIMEOUT", "30"))
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool which counts connection checkouts, the time spent waiting for a connection
+    and the checkouts which needed an overflow connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        start = time.time()
+        overflow_before = self.overflow()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        wait_time = time.time() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            # Only count checkouts which opened an overflow connection, not those served by the base pool
+            # while overflow connections are open. The overflow is negative until the base pool is full.
+            if self.overflow() > max(0, overflow_before):
+                self.overflow_checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        return connection
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(0, self.overflow()),
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+        }
+
+
+# Connections are kept in the pool at most `pool_recycle` seconds. This must be lower than the MySQL `wait_timeout`.
+# DB_CONNECTION_TIMEOUT is the former name of DB_POOL_RECYCLE.
+pool_recycle = int(os.environ.get("DB_POOL_RECYCLE", os.environ.get("DB_CONNECTION_TIMEOUT", "3600")))
+pool_size = int(os.environ.get("DB_POOL_SIZE", "5"))
+max_overflow = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+# Number of seconds to wait for a connection when the pool and its overflow are exhausted.
+pool_timeout = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
 connect_timeout = int(os.environ.get("CONNECT_TIMEOUT", "5"))
 
 ENGINE_PARAMS = {
     "convert_unicode": True,
     "echo": False,
+    "poolclass": InstrumentedQueuePool,
+    "pool_size": pool_size,
+    "max_overflow": max_overflow,
+    "pool_timeout": pool_timeout,
     "pool_recycle": pool_recycle,
     "connect_args": {"connect_timeout": connect_timeout},
 }
 
 engine = create_engine(get_db_string(), **ENGINE_PARAMS)
 
+
+def get_pool_stats() -> Dict[str, Union[int, float]]:
+    """
+    Counters of the connection pool of the engine, since it was created or last disposed.
+    """
+    return engine.pool.get_stats()
+
 # Session
 # -----------------------------------------------------------------------------
 
@@ -11,6 +11,20 @@ OFFICE_TYPE = 'office'
 OGR_TYPE = 'ogr'
 LOCATION_TYPE = 'location'
 
+# Per-ROME scores are always stored as {rome_code: score} objects in the document source.
+# With the "object" encoding, each ROME code of these objects is a mapped field, i.e. hundreds of fields.
+# With the "nested" encoding, these objects are not indexed: scores are indexed as nested
+# {"rome": rome_code, "score": score} documents instead, which only need two mapped fields.
+SCORES_ENCODING_OBJECT = 'object'
+SCORES_ENCODING_NESTED = 'nested'
+SCORES_ENCODINGS = (SCORES_ENCODING_OBJECT, SCORES_ENCODING_NESTED)
+
+# Name of the nested field matching each per-ROME scores object.
+NESTED_SCORE_FIELD_NAMES = {
+    'scores_by_rome': 'rome_scores',
+    'scores_alternance_by_rome': 'rome_scores_alternance',
+}
+
 
 class ConnectionPool(object):
     ELASTICSEARCH_INSTANCE: Optional[elasticsearch.Elasticsearch] = None
@@ -76,7 +90,27 @@ def add_alias_to_index(index, name=settings.ES_INDEX):
     Elasticsearch().indices.put_alias(index=index, name=name)
 
 
-def create_index(index):
+def get_scores_encoding(scores_encoding=None):
+    scores_encoding = scores_encoding or settings.ES_SCORES_ENCODING
+    if scores_encoding not in SCORES_ENCODINGS:
+        raise ValueError("unknown scores encoding: %s" % scores_encoding)
+    return scores_encoding
+
+
+def encode_scores(field_name, scores_by_rome, scores_encoding=None):
+    """
+    Return the office document fields holding the given {rome_code: score} dict,
+    e.g. for a partial update of `field_name`. `scores_by_rome` may be None to reset these fields.
+    """
+    fields = {field_name: scores_by_rome}
+    if get_scores_encoding(scores_encoding) == SCORES_ENCODING_NESTED:
+        fields[NESTED_SCORE_FIELD_NAMES[field_name]] = None if scores_by_rome is None else [
+            {'rome': rome_code, 'score': score} for rome_code, score in sorted(scores_by_rome.items())
+        ]
+    return fields
+
+
+def create_index(index, scores_encoding=None):
     """
     Create index with the right settings.
     """
@@ -272,6 +306,26 @@ def create_index(index):
             },
         },
     }
+    if get_scores_encoding(scores_encoding) == SCORES_ENCODING_NESTED:
+        for field_name, nested_field_name in NESTED_SCORE_FIELD_NAMES.items():
+            # Kept in the source for the display of results, but not indexed.
+            mapping_office["properties"][field_name] = {
+                "type": "object",
+                "enabled": False,
+            }
+            mapping_office["properties"][nested_field_name] = {
+                "type": "nested",
+                "properties": {
+                    "rome": {
+                        "type": "string",
+                        "index": "not_analyzed",
+                    },
+                    "score": {
+                        "type": "integer",
+                    },
+                },
+            }
+
     create_body = {
         "settings": {
             "index": {
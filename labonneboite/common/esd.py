@@ -1,5 +1,6 @@
 import logging
 import datetime
+import threading
 import time
 import requests
 
@@ -15,6 +16,13 @@ ESD_TIMEOUT = 5
 ESD_OFFERS_MAX_ATTEMPTS = 3
 ESD_OFFERS_THROTTLE_IN_SECONDS = 1
 
+# Used when offers are fetched concurrently, see `offers.VisibleMarketFetcher`.
+ESD_OFFERS_MAX_WORKERS = 4
+# Maximum duration of a call to `get_response`, retries included.
+ESD_OFFERS_DEADLINE_IN_SECONDS = 10
+# Maximum number of calls per second to the ESD APIs, shared by all threads of the process.
+ESD_OFFERS_MAX_CALLS_PER_SECOND = 10
+
 
 class TokenFailure(Exception):
     pass
@@ -28,15 +36,65 @@ class RequestFailed(Exception):
     pass
 
 
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+    Thread-safe limiter spacing calls by at least 1 / `calls_per_second` seconds.
+    """
+
+    def __init__(self, calls_per_second):
+        self.interval = 1.0 / calls_per_second
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self, deadline=None):
+        """
+        Block until the next call slot. Raise DeadlineExceeded, without booking a slot,
+        if this slot comes after the given deadline (a `time.monotonic()` value).
+        """
+        with self.lock:
+            now = time.monotonic()
+            call_time = max(now, self.next_call)
+            if deadline is not None and call_time > deadline:
+                raise DeadlineExceeded
+            self.next_call = call_time + self.interval
+        time.sleep(call_time - now)
+
+
+RATE_LIMITER = RateLimiter(ESD_OFFERS_MAX_CALLS_PER_SECOND)
+
+
+def make_session(pool_size=ESD_OFFERS_MAX_WORKERS):
+    """
+    HTTP session keeping its connections alive, which can be shared by `pool_size` threads.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared by all threads and all searches of the process, so that connections to the ESD APIs are kept alive.
+# Sessions are safe to share between threads as long as they are only used to send GET requests.
+SESSION = make_session()
+
+
 class EsdToken(object):
     VALUE = None
     EXPIRATION_DATE = None
+    # Threads fetching offers concurrently must not all request a new token at the same time.
+    LOCK = threading.Lock()
 
     @classmethod
     def get_token(cls):
-        if not cls.is_token_valid():
-            cls.prepare_token()
-        return cls.VALUE
+        with cls.LOCK:
+            if not cls.is_token_valid():
+                cls.prepare_token()
+            return cls.VALUE
 
     @classmethod
     def is_token_valid(cls):
@@ -76,9 +134,14 @@ class EsdToken(object):
             raise TokenFailure
 
 
-def get_response(url, params):
+def get_response(url, params, session=None, deadline=None, rate_limiter=None):
     """
     Get a response for a request to one of the ESD APIs.
+
+    When fetching concurrently, `session` is a shared `requests.Session`, `deadline`
+    a `time.monotonic()` value after which no more attempt is made, and `rate_limiter`
+    a `RateLimiter` shared by all threads. With a deadline, a request which exceeds it,
+    times out or fails to connect returns no results instead of failing.
     """
     headers = {
         'Authorization': 'Bearer {}'.format(EsdToken.get_token()),
@@ -86,43 +149,64 @@ def get_response(url, params):
     }
     attempts = 1
 
-    response = {'results': []}
+    response = {'resultats': []}
     while attempts <= ESD_OFFERS_MAX_ATTEMPTS:
+        timeout = ESD_TIMEOUT
         try:
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise DeadlineExceeded
+            if rate_limiter is not None:
+                rate_limiter.wait(deadline)
             return _get_response(
                 url=url,
                 params=params,
                 headers=headers,
                 method='GET',
+                session=session,
+                timeout=timeout,
             )
         except TooManyRequests:
-            time.sleep(ESD_OFFERS_THROTTLE_IN_SECONDS)
+            throttle = ESD_OFFERS_THROTTLE_IN_SECONDS
+            if deadline is not None:
+                throttle = min(throttle, max(0, deadline - time.monotonic()))
+            time.sleep(throttle)
             attempts += 1
+        except DeadlineExceeded:
+            logger.warning("ESD request to %s exceeded its deadline after %s attempt(s)", url, attempts)
+            break
+        except (ConnectionError, ReadTimeout) as e:
+            if deadline is None:
+                raise
+            logger.warning("ESD request to %s failed after %s attempt(s): %s", url, attempts, e)
+            break
     return response
 
 
-def _get_response(url, headers, params=None, method='GET', data=None):
+def _get_response(url, headers, params=None, method='GET', data=None, session=None, timeout=ESD_TIMEOUT):
     """
     Generic method fetching the response for a GET/POST request to a given
     url with a given data object.
     """
+    http = session or requests
     try:
         if method == 'GET':
             if data:
                 raise ValueError("data should be None for a GET request")
-            response = requests.get(
+            response = http.get(
                 url=url,
                 params=params,
                 headers=headers,
-                timeout=ESD_TIMEOUT,
+                timeout=timeout,
             )
         elif method == 'POST':
-            response = requests.post(
+            response = http.post(
                 url=url,
                 params=params,
                 headers=headers,
                 data=data,
-                timeout=ESD_TIMEOUT,
+                timeout=timeout,
             )
         else:
             raise ValueError("unknown HTTP method")
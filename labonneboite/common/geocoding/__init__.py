@@ -2,13 +2,13 @@ from functools import wraps
 import collections
 import json
 import os
-import geopy.distance
 
 from slugify import slugify
 
 from labonneboite_common import departements
 
 from . import datagouv
+from . import spatial
 
 CACHE = {}
 
@@ -116,6 +116,16 @@ def load_cities_cache():
         key = city['zipcode']
         CACHE['cities_by_zipcode'][key].append(city)
 
+    # Create a dict where each departement is mapped to its cities. Departements are the first 2
+    # characters of the code commune, or the first 3 ones for overseas departements (e.g. 971).
+    CACHE['cities_by_departement'] = collections.defaultdict(list)
+    for commune_id, city in CACHE['cities_by_commune_id'].items():
+        CACHE['cities_by_departement'][commune_id[:2]].append(city)
+        CACHE['cities_by_departement'][commune_id[:3]].append(city)
+
+    # Spatial index used for nearest city and cities within radius lookups.
+    CACHE['cities_spatial_index'] = spatial.CitySpatialIndex(cities)
+
 
 def cities_cache_required(function):
     """
@@ -167,9 +177,25 @@ def get_all_cities_from_departement(departement):
     """
     Returns a list of all cities for the given departement.
     """
-    return [
-        city for commune_id, city in list(CACHE['cities_by_commune_id'].items()) if commune_id.startswith(departement)
-    ]
+    return list(CACHE['cities_by_departement'].get(departement, []))
+
+
+@cities_cache_required
+def get_nearest_city(latitude, longitude):
+    """
+    Returns the city closest to the given gps coordinates, or None if there is no city at all.
+    """
+    result = CACHE['cities_spatial_index'].nearest(latitude, longitude)
+    return result[1] if result else None
+
+
+@cities_cache_required
+def get_cities_within_radius(latitude, longitude, distance):
+    """
+    Returns a list of (distance, city) tuples, closest first, for all cities
+    at most `distance` km away from the given gps coordinates.
+    """
+    return CACHE['cities_spatial_index'].within_radius(latitude, longitude, distance)
 
 
 @cities_cache_required
@@ -178,9 +204,7 @@ def get_distance_between_commune_id_and_coordinates(commune_id, latitude, longit
     Return distance (float, kilometers) from commune_id to gps coordinates
     """
     city = get_city_by_commune_id(commune_id)
-    coords_1 = (city['coords']['lat'], city['coords']['lon'])
-    coords_2 = (latitude, longitude)
-    return geopy.distance.geodesic(coords_1, coords_2).km
+    return spatial.haversine_distance(city['coords']['lat'], city['coords']['lon'], latitude, longitude)
 
 
 @cities_cache_required
@@ -0,0 +1,117 @@
+"""
+In-memory spatial index of cities, so that geographic lookups do not have to
+scan the ~36k communes of the cities cache.
+
+Cities are put in buckets of a regular latitude/longitude grid. Distances are
+great-circle distances (haversine formula), which differ from the geodesic
+distances computed by geopy by less than 0.5%.
+"""
+import collections
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# About 11 km in latitude: a radius search of a few dozen km only looks at a handful of buckets.
+DEFAULT_CELL_SIZE = 0.1
+
+
+def haversine_distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance (float, kilometers) between two gps coordinates.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CitySpatialIndex(object):
+    """
+    Grid index of cities as returned by `geocoding.city_as_dict`.
+    """
+
+    def __init__(self, cities, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.buckets = collections.defaultdict(list)
+        max_abs_latitude = 0
+        for city in cities:
+            latitude, longitude = self._coordinates(city)
+            self.buckets[self._cell(latitude, longitude)].append((latitude, longitude, city))
+            max_abs_latitude = max(max_abs_latitude, abs(latitude))
+
+        # Smallest width of a cell (in km) among indexed cities: longitude degrees shrink towards the poles.
+        self._min_cell_width = cell_size * KM_PER_DEGREE * math.cos(math.radians(max_abs_latitude))
+
+        rows = [row for row, _ in self.buckets]
+        cols = [col for _, col in self.buckets]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols)) if self.buckets else None
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    @staticmethod
+    def _coordinates(city):
+        return float(city['coords']['lat']), float(city['coords']['lon'])
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+    def _ring(self, row, col, radius):
+        """
+        Cells at exactly `radius` cells (Chebyshev distance) from the (row, col) cell.
+        """
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def nearest(self, latitude, longitude):
+        """
+        Returns a (distance, city) tuple for the city closest to the given coordinates,
+        or None if the index is empty.
+        """
+        if not self._bounds:
+            return None
+        row, col = self._cell(latitude, longitude)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_radius = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        best = None
+        for radius in range(max_radius + 1):
+            # Any city in this ring or beyond is at least this far away.
+            if best and (radius - 1) * self._min_cell_width > best[0]:
+                break
+            for cell in self._ring(row, col, radius):
+                for city_latitude, city_longitude, city in self.buckets.get(cell, ()):
+                    distance = haversine_distance(latitude, longitude, city_latitude, city_longitude)
+                    if best is None or distance < best[0]:
+                        best = (distance, city)
+        return best
+
+    def within_radius(self, latitude, longitude, distance):
+        """
+        Returns a list of (distance, city) tuples for all cities at most `distance` km away
+        from the given coordinates, closest first.
+        """
+        latitude_delta = distance / KM_PER_DEGREE
+        # Longitude degrees are the narrowest at the latitude the farthest from the equator.
+        widest_latitude = min(89.9, abs(latitude) + latitude_delta)
+        longitude_delta = min(180.0, distance / (KM_PER_DEGREE * math.cos(math.radians(widest_latitude))))
+
+        min_row, min_col = self._cell(latitude - latitude_delta, longitude - longitude_delta)
+        max_row, max_col = self._cell(latitude + latitude_delta, longitude + longitude_delta)
+
+        results = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for city_latitude, city_longitude, city in self.buckets.get((row, col), ()):
+                    city_distance = haversine_distance(latitude, longitude, city_latitude, city_longitude)
+                    if city_distance <= distance:
+                        results.append((city_distance, city))
+        results.sort(key=lambda result: result[0])
+        return results
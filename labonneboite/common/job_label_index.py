@@ -0,0 +1,169 @@
+"""
+In-memory index of OGR job labels, used to suggest jobs without querying Elasticsearch.
+
+It mimics what Elasticsearch 1.7 does for `autocomplete.build_job_label_suggestions`
+on the `ogr` document type:
+
+- documents are indexed in the `_all` field with the `ngram_analyzer` of `es.py`
+  (standard tokenizer, asciifolding, lowercase, french stopwords, elision, ngrams of 2 to 20 chars),
+- queries are analyzed with the `standard` analyzer and matched term by term (OR),
+- documents are scored with the Lucene TF/IDF similarity: coord * queryNorm * sum(tf * idf^2 * fieldNorm).
+
+Instead of storing every ngram, we store the (much smaller) set of tokens: the ngrams of a token
+matching a query term are the occurrences of this term in the token.
+"""
+import collections
+import math
+import re
+
+import unidecode
+
+MIN_GRAM = 2
+MAX_GRAM = 20
+
+# Snowball french stop list, used by Elasticsearch for `_french_` stopwords.
+# The stop filter runs after asciifolding, so accented stopwords never match anything.
+FRENCH_STOPWORDS = frozenset("""
+    au aux avec ce ces dans de des du elle en et eux il ils je la le les leur lui ma mais me même mes moi mon ne nos
+    notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre vous c d j l à m
+    n s t y été étée étées étés étant étante étants étantes suis es est sommes êtes sont serai seras sera serons serez
+    seront serais serait serions seriez seraient étais était étions étiez étaient fus fut fûmes fûtes furent sois soit
+    soyons soyez soient fusse fusses fût fussions fussiez fussent ayant ayante ayantes ayants eu eue eues eus ai as
+    avons avez ont aurai auras aura aurons aurez auront aurais aurait aurions auriez auraient avais avait avions aviez
+    avaient eut eûmes eûtes eurent aie aies ait ayons ayez aient eusse eusses eût eussions eussiez eussent
+""".split())
+
+ELISION_ARTICLES = ("c", "l", "m", "t", "qu", "n", "s", "j", "d")
+
+# Words joined by apostrophes or dots are kept together by the standard tokenizer, e.g. "l'usine".
+TOKEN_REGEXP = re.compile(r"\w+(?:['’.]\w+)*")
+ELISION_REGEXP = re.compile(r"^(?:%s)['’]" % "|".join(ELISION_ARTICLES))
+
+
+def tokenize(text):
+    """
+    Standard tokenizer + lowercase: this is how query terms are analyzed.
+    """
+    return [token.lower() for token in TOKEN_REGEXP.findall(text)]
+
+
+def analyze(text):
+    """
+    Tokens of the `ngram_analyzer`, before the ngram filter is applied.
+    """
+    tokens = []
+    for token in TOKEN_REGEXP.findall(text):
+        token = unidecode.unidecode(token).lower()
+        if token in FRENCH_STOPWORDS:
+            continue
+        token = ELISION_REGEXP.sub('', token)
+        if len(token) >= MIN_GRAM:
+            tokens.append(token)
+    return tokens
+
+
+def count_occurrences(term, token):
+    """
+    Number of ngrams of `token` equal to `term`, i.e. number of (possibly overlapping) occurrences.
+    """
+    count = 0
+    start = token.find(term)
+    while start != -1:
+        count += 1
+        start = token.find(term, start + 1)
+    return count
+
+
+class JobLabelIndex(object):
+    """
+    Index of OGR documents, i.e. dicts with the `ogr_code`, `ogr_description`, `rome_code`
+    and `rome_description` keys, as indexed by `create_index.create_job_codes`.
+    """
+    FIELDS = ('ogr_code', 'ogr_description', 'rome_code', 'rome_description')
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        # token => {document position => number of occurrences of the token in the document}
+        self.postings = collections.defaultdict(collections.Counter)
+        # bigram => tokens containing it, so that a query term is only compared to a few tokens.
+        self.tokens_by_bigram = collections.defaultdict(set)
+        self.field_norms = []
+
+        for position, document in enumerate(self.documents):
+            tokens = analyze(' '.join(document[field] for field in self.FIELDS))
+            for token in tokens:
+                self.postings[token][position] += 1
+            # All ngrams of a token share the token position, so the field length is the number of tokens.
+            self.field_norms.append(1 / math.sqrt(len(tokens)) if tokens else 0)
+
+        for token in self.postings:
+            for start in range(len(token) - 1):
+                self.tokens_by_bigram[token[start:start + MIN_GRAM]].add(token)
+
+        self._term_frequencies = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def term_frequencies(self, term):
+        """
+        Returns a {document position: term frequency} dict for the given query term.
+        """
+        if term not in self._term_frequencies:
+            frequencies = collections.Counter()
+            if MIN_GRAM <= len(term) <= MAX_GRAM:
+                for token in self.tokens_by_bigram.get(term[:MIN_GRAM], ()):
+                    occurrences = count_occurrences(term, token)
+                    if occurrences:
+                        for position, count in self.postings[token].items():
+                            frequencies[position] += occurrences * count
+            self._term_frequencies[term] = frequencies
+        return self._term_frequencies[term]
+
+    def idf(self, term):
+        return 1 + math.log(len(self.documents) / (len(self.term_frequencies(term)) + 1))
+
+    def search(self, text):
+        """
+        Returns a list of (score, document) tuples for the documents matching at least one term
+        of the given text, best score first.
+        """
+        terms = tokenize(text)
+        if not terms or not self.documents:
+            return []
+
+        idfs = [self.idf(term) for term in terms]
+        query_norm = 1 / math.sqrt(sum(idf ** 2 for idf in idfs))
+
+        scores = collections.defaultdict(float)
+        matched_terms = collections.Counter()
+        for term, idf in zip(terms, idfs):
+            for position, frequency in self.term_frequencies(term).items():
+                scores[position] += math.sqrt(frequency) * idf ** 2 * self.field_norms[position]
+                matched_terms[position] += 1
+
+        results = [
+            (score * query_norm * matched_terms[position] / len(terms), position)
+            for position, score in scores.items()
+        ]
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return [(score, self.documents[position]) for score, position in results]
+
+    def search_by_rome(self, text):
+        """
+        Returns the best (score, document) tuple of each ROME code matching the given text, best score first.
+
+        This is the equivalent of the terms aggregation on `rome_code` with a single top hit per bucket:
+        buckets are sorted by decreasing document count before being sorted by score, so that ties are
+        ordered the same way.
+        """
+        best_by_rome = collections.OrderedDict()
+        count_by_rome = collections.Counter()
+        for score, document in self.search(text):
+            rome_code = document['rome_code']
+            best_by_rome.setdefault(rome_code, (score, document))
+            count_by_rome[rome_code] += 1
+
+        buckets = sorted(best_by_rome.items(), key=lambda item: (-count_by_rome[item[0]], item[0]))
+        buckets.sort(key=lambda item: item[1][0], reverse=True)
+        return [best for _, best in buckets]
@@ -29,6 +29,7 @@ from labonneboite.common.models.user_favorite_offices import UserFavoriteOffice
 from labonneboite.common.models.recruiter_message import NoOfficeFoundException, RecruiterMessageCommon, \
     OtherRecruiterMessage, RemoveRecruiterMessage, UpdateCoordinatesRecruiterMessage, UpdateJobsRecruiterMessage
 from labonneboite.common.models.history_blacklist import HistoryBlacklist
+from labonneboite.common.models.office_fingerprint import OfficeFingerprint
 
 # pylint: enable=wildcard-import
 
@@ -42,4 +43,5 @@ __all__ = [
     "NoOfficeFoundException", "RecruiterMessageCommon", "OtherRecruiterMessage", "RemoveRecruiterMessage",
     "UpdateCoordinatesRecruiterMessage", "UpdateJobsRecruiterMessage",
     "HistoryBlacklist",
+    "OfficeFingerprint",
 ]
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Index
+from sqlalchemy import String
+from labonneboite.common.database import Base
+from labonneboite.common.models.base import CRUDMixin
+
+
+class OfficeFingerprint(CRUDMixin, Base):
+    """
+    Hash of the ES document of an office, as indexed in the live ES index.
+    Used by the delta mode of `scripts/create_index.py` to index only the offices which changed.
+    """
+    __tablename__ = 'etablissements_fingerprints'
+    __table_args__ = (
+        Index('_fingerprint_departement', 'departement'),
+    )
+
+    siret = Column(String(14), primary_key=True)
+    departement = Column(String(8), nullable=False)
+    fingerprint = Column(String(40), nullable=False)
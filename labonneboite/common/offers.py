@@ -1,4 +1,6 @@
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Sequence, Tuple, List
 
 from labonneboite.common import esd, geocoding, hiring_type_util
@@ -105,22 +107,49 @@ class VisibleMarketFetcher(Fetcher):
 
         return office_results, None
 
-    def get_offers_for_romes(self, romes):
-        offers = []
+    def get_offers_for_romes(self, romes, concurrent=None):
+        """
+        Fetch offers of the given romes, OFFRES_ESD_MAXIMUM_ROMES romes per ESD call.
+
+        When `concurrent` is True (default: settings.ESD_OFFERS_CONCURRENT_FETCH), calls are made
+        in parallel by a few threads sharing the keep-alive session of the process. Offers are returned in the same
+        order in both modes.
+        """
+        if concurrent is None:
+            concurrent = settings.ESD_OFFERS_CONCURRENT_FETCH
+        romes_batches = list(chunks(romes, OFFRES_ESD_MAXIMUM_ROMES))
+
+        if not concurrent or len(romes_batches) <= 1:
+            responses = [esd.get_response(OFFRES_ESD_ENDPOINT_URL, self.get_params(batch)) for batch in romes_batches]
+        else:
+            deadline = time.monotonic() + esd.ESD_OFFERS_DEADLINE_IN_SECONDS
+            max_workers = min(esd.ESD_OFFERS_MAX_WORKERS, len(romes_batches))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                responses = list(executor.map(
+                    lambda batch: esd.get_response(
+                        OFFRES_ESD_ENDPOINT_URL,
+                        self.get_params(batch),
+                        session=esd.SESSION,
+                        deadline=deadline,
+                        rate_limiter=esd.RATE_LIMITER,
+                    ),
+                    romes_batches,
+                ))
 
-        for romes_batch in chunks(romes, OFFRES_ESD_MAXIMUM_ROMES):
-            url = OFFRES_ESD_ENDPOINT_URL
-            params = {
-                'range': "0-{}".format(OFFRES_ESD_MAXIMUM_PAGE_SIZE - 1),
-                'sort': 1,
-                'codeROME': ",".join(romes_batch),
-                'natureContrat': ",".join(self.get_contract_nature_codes()),
-                'commune': self.commune_id,
-                'distance': min(self.distance, OFFRES_ESD_MAXIMUM_DISTANCE),
-            }
-            response = esd.get_response(url, params)
+        offers = []
+        for response in responses:
             # Convenient reminder to dump json to file for test mockups.
             # json.dump(response, json_file, sort_keys=True, indent=4)
             offers += response['resultats']
 
         return offers
+
+    def get_params(self, romes_batch):
+        return {
+            'range': "0-{}".format(OFFRES_ESD_MAXIMUM_PAGE_SIZE - 1),
+            'sort': 1,
+            'codeROME': ",".join(romes_batch),
+            'natureContrat': ",".join(self.get_contract_nature_codes()),
+            'commune': self.commune_id,
+            'distance': min(self.distance, OFFRES_ESD_MAXIMUM_DISTANCE),
+        }
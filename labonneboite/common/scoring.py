@@ -1,8 +1,10 @@
 import math
 from functools import lru_cache
-from typing import Optional, Union
+from typing import Dict, Optional, Sequence, Tuple, Union
 from decimal import Decimal
 
+import numpy as np
+
 from labonneboite.common import mapping as mapping_util
 from labonneboite.common.conf import settings
 from labonneboite.common.load_data import load_metiers_tension
@@ -119,6 +121,52 @@ def get_score_from_hirings(hirings: Union[float, Hiring], skip_bucketing: bool =
     return _get_score_from_hirings(hirings)
 
 
+# Bucketed hirings <= 3 are rounded to 1 digit: 0.0, 0.1, ..., 3.0.
+MAX_BUCKETED_TENTHS = 30
+
+
+@lru_cache(maxsize=None)
+def get_scores_of_bucketed_hirings() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bucketed hirings (see get_score_from_hirings) are either tenths (hirings <= 3) or integers:
+    return the tables of their scores, computed once with `_get_score_from_hirings`.
+    Any number of hirings above SCORE_100_HIRINGS has a score of 100, i.e. the one of the last item.
+    """
+    scores_by_tenths = np.array(
+        [_get_score_from_hirings(tenths / 10) for tenths in range(MAX_BUCKETED_TENTHS + 1)], dtype=np.int64,
+    )
+    scores_by_hirings = np.array(
+        [_get_score_from_hirings(hirings) for hirings in range(int(math.ceil(settings.SCORE_100_HIRINGS)) + 1)],
+        dtype=np.int64,
+    )
+    return scores_by_tenths, scores_by_hirings
+
+
+def get_scores_from_hirings(hirings: Union[np.ndarray, Sequence[float]]) -> np.ndarray:
+    """
+    Vectorized version of `get_score_from_hirings`.
+    """
+    scores_by_tenths, scores_by_hirings = get_scores_of_bucketed_hirings()
+    hirings = np.asarray(hirings, dtype=np.float64)
+
+    # Bucketing of hirings <= 3: round(hirings, 1).
+    tenths = hirings * 10
+    rounded_tenths = np.rint(tenths)
+    # hirings * 10 is not exact: when it lands on a .5 tie, only Python's round knows which side to take.
+    ties = np.flatnonzero((hirings <= 3) & (np.abs(tenths - np.floor(tenths) - 0.5) < 1e-9))
+    for position in ties:
+        rounded_tenths[position] = round(round(float(hirings[position]), 1) * 10)
+    # Negative hirings (e.g. predicted by a regression) have a score of 0, i.e. the one of the first item.
+    small_scores = scores_by_tenths[np.clip(rounded_tenths, 0, MAX_BUCKETED_TENTHS).astype(np.int64)]
+
+    # Bucketing of hirings > 3: round_half_up(hirings), which always rounds .5 up for positive values.
+    floor = np.floor(hirings)
+    rounded_hirings = np.where(hirings - floor < 0.5, floor, np.ceil(hirings))
+    large_scores = scores_by_hirings[np.clip(rounded_hirings, 0, len(scores_by_hirings) - 1).astype(np.int64)]
+
+    return np.where(hirings <= 3, small_scores, large_scores)
+
+
 # very good hit/miss ratio observed while running create_index.py
 @lru_cache(maxsize=1024)
 def get_hirings_from_score(score: Score) -> Hiring:
@@ -171,6 +219,61 @@ def get_score_adjusted_to_rome_code_and_naf_code(*, rome_code: Rome, naf_code: N
     return get_score_from_hirings(office_hirings_for_current_rome)
 
 
+class RomeNafMatrix(object):
+    """
+    Dense ROME x NAF table of affinities, built once from `mapping_util.MANUAL_NAF_ROME_MAPPING`,
+    to compute the scores of an office for all the ROME codes of its NAF in a single call.
+
+    Scores are the same as the ones of `get_score_adjusted_to_rome_code_and_naf_code(hiring=...)`,
+    computed with `get_scores_from_hirings`.
+    """
+
+    def __init__(self, naf_rome_mapping=None):
+        naf_rome_mapping = mapping_util.MANUAL_NAF_ROME_MAPPING if naf_rome_mapping is None else naf_rome_mapping
+        self.naf_codes = sorted(naf_rome_mapping)
+        self.rome_codes = sorted({rome for romes in naf_rome_mapping.values() for rome in romes})
+        self.naf_positions = {naf: position for position, naf in enumerate(self.naf_codes)}
+        self.rome_positions = {rome: position for position, rome in enumerate(self.rome_codes)}
+
+        self.affinities = np.zeros((len(self.naf_codes), len(self.rome_codes)), dtype=np.float64)
+        for naf, romes in naf_rome_mapping.items():
+            total_naf_hirings = sum(romes.values())
+            for rome, rome_hirings in romes.items():
+                # Same operations as mapping_util.get_affinity_between_rome_and_naf, for the same floats.
+                self.affinities[self.naf_positions[naf], self.rome_positions[rome]] = \
+                    1.0 * rome_hirings / total_naf_hirings
+
+        # ROME codes (and their positions) of each NAF, so that we do not scan a whole row of the table.
+        self.romes_by_naf = {}
+        for naf in self.naf_codes:
+            positions = np.flatnonzero(self.affinities[self.naf_positions[naf]])
+            self.romes_by_naf[naf] = ([self.rome_codes[position] for position in positions], positions)
+
+    def get_affinity(self, rome_code: Rome, naf_code: Naf) -> float:
+        naf_position = self.naf_positions.get(naf_code)
+        rome_position = self.rome_positions.get(rome_code)
+        if naf_position is None or rome_position is None:
+            return 0.0
+        return float(self.affinities[naf_position, rome_position])
+
+    def get_scores_for_naf(self, naf_code: Naf, hiring: Hiring) -> Dict[Rome, Score]:
+        """
+        Scores of an office with the given NAF code and hiring, adjusted to each ROME code of this NAF.
+        Returns an empty dict for NAF codes without any ROME code.
+        """
+        if naf_code not in self.romes_by_naf:
+            return {}
+        rome_codes, positions = self.romes_by_naf[naf_code]
+        affinities = self.affinities[self.naf_positions[naf_code], positions]
+        scores = get_scores_from_hirings(hiring * affinities)
+        return dict(zip(rome_codes, scores.tolist()))
+
+
+@lru_cache(maxsize=None)
+def get_rome_naf_matrix() -> RomeNafMatrix:
+    return RomeNafMatrix()
+
+
 def get_stars_from_score(score: float) -> float:
     """
     Convert the score (integer theoretically between 0 and 100)
@@ -11,7 +11,7 @@ from slugify import slugify
 from labonneboite.common import mapping as mapping_util
 from labonneboite.common import hiring_type_util, sorting, util
 from labonneboite.common.conf import settings
-from labonneboite.common.es import Elasticsearch
+from labonneboite.common.es import NESTED_SCORE_FIELD_NAMES, SCORES_ENCODING_NESTED, Elasticsearch, get_scores_encoding
 from labonneboite.common.fetcher import Fetcher
 from labonneboite.common.models import Office, OfficeResult
 from labonneboite.common.pagination import OFFICES_PER_PAGE
@@ -82,6 +82,7 @@ class HiddenMarketFetcher(Fetcher):
             naf_codes=None,
             aggregate_by=None,
             flag_pmsmp=None,
+            scores_encoding=None,
     ):
         self.latitude = latitude
         self.longitude = longitude
@@ -122,6 +123,8 @@ class HiddenMarketFetcher(Fetcher):
         self.office_count = 0
         self.departments = departments
         self.flag_pmsmp = flag_pmsmp
+        # Must match the encoding of the index being searched, see es.create_index.
+        self.scores_encoding = get_scores_encoding(scores_encoding)
 
         self._distance_sort_index = None
 
@@ -142,6 +145,7 @@ class HiddenMarketFetcher(Fetcher):
         kwargs.setdefault('naf_codes', self.naf_codes)
         kwargs.setdefault('aggregate_by', self.aggregate_by)
         kwargs.setdefault('flag_pmsmp', self.flag_pmsmp)
+        kwargs.setdefault('scores_encoding', self.scores_encoding)
         clone = self.__class__(**kwargs)
         return clone
 
@@ -211,50 +215,160 @@ class HiddenMarketFetcher(Fetcher):
         _, aggregations = clone.get_offices()
         return aggregations['distance']
 
+    def get_filter_aggregations(self) -> AggregationsType:
+        """
+        Compute all the facets listed in `aggregate_by` with a single ES request.
+
+        Just like get_naf_aggregations(), get_headcount_aggregations(), get_distance_aggregations()
+        and get_contract_aggregations(), each facet ignores its own filter, so that the user can see
+        what selecting another value would give. Filters shared by all facets are applied to the
+        main query, the remaining ones go into one `filter` aggregation per facet.
+        """
+        aggregate_by = self.aggregate_by or []
+        variants: Dict[str, HiddenMarketFetcher] = {'base': self.clone(aggregate_by=None)}
+        if 'naf' in aggregate_by:
+            variants['naf'] = self.clone(naf_codes={}, aggregate_by=['naf'])
+        if 'headcount' in aggregate_by:
+            variants['headcount'] = self.clone(headcount=settings.HEADCOUNT_WHATEVER, aggregate_by=['headcount'])
+        if 'distance' in aggregate_by and self.gps_available:
+            variants['distance'] = self.clone(distance=DISTANCE_FILTER_MAX, aggregate_by=['distance'])
+        if 'hiring_type' in aggregate_by:
+            variants['dpae'] = self.clone(hiring_type=hiring_type_util.DPAE, aggregate_by=None)
+            variants['alternance'] = self.clone(hiring_type=hiring_type_util.ALTERNANCE, aggregate_by=None)
+
+        filters_by_variant = {name: variant._build_es_query_filters() for name, variant in variants.items()}
+        common_filters = [
+            es_filter for es_filter in filters_by_variant['base']
+            if all(es_filter in filters for filters in filters_by_variant.values())
+        ]
+
+        aggs: Dict[str, Dict] = {}
+        for name, variant in variants.items():
+            own_filters = [es_filter for es_filter in filters_by_variant[name] if es_filter not in common_filters]
+            aggs[name] = {'filter': {'bool': {'must': own_filters}} if own_filters else {'match_all': {}}}
+            if variant.aggregate_by:
+                aggs[name]['aggs'] = variant._add_aggretation({})['aggs']
+
+        query = {
+            "query": {"filtered": {"filter": {"bool": {"must": common_filters}}}},
+            "aggs": aggs,
+            "size": 0,
+        }
+        aggregations_raw = self._get_offices_from_es(query)['aggregations']
+
+        # Mimic get_offices(), which does not return any aggregation when no office matches: only
+        # facets of active filters and the contract facet were computed separately in that case.
+        facets: AggregationsType = {}
+        base_count = aggregations_raw['base']['doc_count']
+        if 'naf' in variants and (base_count or self.naf_codes):
+            facets['naf'] = self._aggregate_naf(aggregations_raw['naf'])
+        if 'headcount' in variants and (base_count or self.headcount != settings.HEADCOUNT_WHATEVER):
+            facets['headcount'] = self._aggregate_headcount(aggregations_raw['headcount'])
+        if 'distance' in aggregate_by and (base_count or self.distance != DISTANCE_FILTER_MAX):
+            # Distance is not an ES field: without gps, there is no distance to aggregate on.
+            facets['distance'] = self._aggregate_distance(aggregations_raw['distance']) if self.gps_available else {}
+        if 'hiring_type' in aggregate_by:
+            facets['contract'] = {
+                'alternance': aggregations_raw['alternance']['doc_count'],
+                'dpae': aggregations_raw['dpae']['doc_count'],
+            }
+        return facets
+
     def compute_office_count(self):
         self.office_count = self._get_office_count()
         logger.debug("set office_count to %s", self.office_count)
 
-    def get_offices(self, add_suggestions=False) -> Tuple[OfficesType, AggregationsType]:
-        self.compute_office_count()
-
-        current_page_size = self.to_number - self.from_number + 1
+    def get_offices(self, add_suggestions=False, single_round_trip=None) -> Tuple[OfficesType, AggregationsType]:
+        """
+        Fetch the current page of offices along with the requested aggregations.
 
-        # Needed in rare case when an old page is accessed (via user bookmark and/or crawling bot)
-        # which no longer exists due to newer office dataset having less result pages than before
-        # for this search.
-        if self.from_number > self.office_count:
-            self.from_number = 1
-            self.to_number = current_page_size
+        With `single_round_trip` (defaults to settings.SEARCH_SINGLE_ROUND_TRIP), the total office
+        count is read from the search response itself. Otherwise a separate ES count is run first.
+        """
+        if single_round_trip is None:
+            single_round_trip = settings.SEARCH_SINGLE_ROUND_TRIP
 
-        # Adjustement needed when the last page is requested and does not have exactly page_size items.
-        if self.to_number > self.office_count + 1:
-            self.to_number = self.office_count + 1
+        current_page_size = self.to_number - self.from_number + 1
 
         result: OfficesType = []
         aggregations: AggregationsType = {}
-        if self.office_count:
-            result, aggregations = self._fetch_offices()
+        if single_round_trip:
+            result, aggregations = self._fetch_offices_and_count(current_page_size)
+        else:
+            self.compute_office_count()
+            self._adjust_pagination(current_page_size)
+            if self.office_count:
+                result, aggregations = self._fetch_offices()
 
         if self.office_count <= current_page_size and add_suggestions:
-
-            # Suggest other jobs.
-            # Build a flat list of all the alternative romes of all searched romes.
-            alternative_rome_codes = [alt_rome for rome in self.romes for alt_rome in ROME_MOBILITIES[rome]]
-            for rome in set(alternative_rome_codes) - set(self.romes):
-                office_count = self.clone(romes=[rome])._get_office_count()
-                self.alternative_rome_codes[rome] = office_count
-
-            # Suggest other distances.
-            last_count = 0
-            for distance, distance_label in [(30, '30 km'), (50, '50 km'), (3000, 'France entière')]:
-                office_count = self.clone(distance=distance)._get_office_count()
-                if office_count > last_count:
-                    last_count = office_count
-                    self.alternative_distances[distance] = (distance_label, last_count)
+            self._compute_suggestions()
 
         return result, aggregations
 
+    def _compute_suggestions(self, batched=None):
+        """
+        Suggest other jobs and other distances, along with their office counts.
+
+        With `batched` (defaults to settings.SEARCH_SUGGESTIONS_MSEARCH), all candidate counts are
+        computed in a single ES _msearch request instead of one ES count per candidate.
+        """
+        if batched is None:
+            batched = settings.SEARCH_SUGGESTIONS_MSEARCH
+
+        # Build a flat list of all the alternative romes of all searched romes.
+        alternative_rome_codes = [alt_rome for rome in self.romes for alt_rome in ROME_MOBILITIES[rome]]
+        romes = list(set(alternative_rome_codes) - set(self.romes))
+        distances = [(30, '30 km'), (50, '50 km'), (3000, 'France entière')]
+
+        candidates = [self.clone(romes=[rome]) for rome in romes]
+        candidates += [self.clone(distance=distance) for distance, _ in distances]
+        if batched:
+            office_counts = self._get_office_counts(candidates)
+        else:
+            office_counts = [candidate._get_office_count() for candidate in candidates]
+        rome_office_counts, distance_office_counts = office_counts[:len(romes)], office_counts[len(romes):]
+
+        # Suggest other jobs.
+        for rome, office_count in zip(romes, rome_office_counts):
+            self.alternative_rome_codes[rome] = office_count
+
+        # Suggest other distances.
+        last_count = 0
+        for (distance, distance_label), office_count in zip(distances, distance_office_counts):
+            if office_count > last_count:
+                last_count = office_count
+                self.alternative_distances[distance] = (distance_label, last_count)
+
+    @classmethod
+    def _get_office_counts(cls, fetchers: Sequence['HiddenMarketFetcher']) -> List[int]:
+        """
+        Count the offices matching each fetcher, in a single ES round-trip.
+        """
+        if not fetchers:
+            return []
+
+        body: List[Dict] = []
+        for fetcher in fetchers:
+            query = fetcher._build_elastic_search_query(omit_sort=True, omit_aggretation=True, omit_pagination=True)
+            query['size'] = 0
+            body += [{'index': settings.ES_INDEX, 'type': 'office'}, query]
+
+        office_counts: List[int] = []
+        for fetcher, response in zip(fetchers, cls._msearch_offices_from_es(body)):
+            if 'error' in response:
+                # Do not lose the whole batch because of a single failing query.
+                logger.error("Elastic Search msearch error: %s", response['error'])
+                office_counts.append(fetcher._get_office_count())
+            else:
+                office_counts.append(response['hits']['total'])
+        return office_counts
+
+    @staticmethod
+    def _msearch_offices_from_es(body: Sequence[Dict]) -> Sequence[Dict]:
+        es = Elasticsearch()
+        res = es.msearch(body=body)
+        return res['responses']
+
     def get_alternative_rome_descriptions(self):
         alternative_rome_descriptions = []
         for alternative, count in self.alternative_rome_codes.items():
@@ -264,12 +378,50 @@ class HiddenMarketFetcher(Fetcher):
                 alternative_rome_descriptions.append([alternative, desc, slug, count])
         return alternative_rome_descriptions
 
+    def _adjust_pagination(self, current_page_size: int):
+        # Needed in rare case when an old page is accessed (via user bookmark and/or crawling bot)
+        # which no longer exists due to newer office dataset having less result pages than before
+        # for this search.
+        if self.from_number > self.office_count:
+            self.from_number = 1
+            self.to_number = current_page_size
+
+        # Adjustement needed when the last page is requested and does not have exactly page_size items.
+        if self.to_number > self.office_count + 1:
+            self.to_number = self.office_count + 1
+
     def _fetch_offices(self) -> Tuple[OfficesType, AggregationsType]:
         query = self._build_elastic_search_query()
 
         offices, aggregations_raw = self._get_offices_from_es_and_db(query)
 
-        # Extract aggregations
+        return offices, self._extract_aggregations(aggregations_raw)
+
+    def _fetch_offices_and_count(self, current_page_size: int) -> Tuple[OfficesType, AggregationsType]:
+        """
+        Same as compute_office_count() followed by _fetch_offices(), but with a single ES search:
+        the office count is the total number of hits of the search.
+        """
+        query = self._build_elastic_search_query()
+        es_res: Dict = self._get_offices_from_es(query)
+        self.office_count = es_res['hits']['total']
+        logger.debug("set office_count to %s", self.office_count)
+
+        from_number = self.from_number
+        self._adjust_pagination(current_page_size)
+        if not self.office_count:
+            return [], {}
+
+        if self.from_number != from_number:
+            # The requested page does not exist anymore: the first page has to be fetched instead.
+            query = self._build_elastic_search_query()
+            es_res = self._get_offices_from_es(query)
+
+        assert self._distance_sort_index is not None, 'did you remove it from the sorts ?'
+        offices: OfficesType = self._get_office_results_from_es_results(es_res)
+        return offices, self._extract_aggregations(es_res.get('aggregations', {}))
+
+    def _extract_aggregations(self, aggregations_raw) -> AggregationsType:
         aggregations: AggregationsType = {}
         if self.aggregate_by:
             if 'naf' in self.aggregate_by:
@@ -282,7 +434,7 @@ class HiddenMarketFetcher(Fetcher):
                 if self.distance == DISTANCE_FILTER_MAX:
                     aggregations['distance'] = self._aggregate_distance(aggregations_raw)
 
-        return offices, aggregations
+        return aggregations
 
     @property
     def gps_available(self):
@@ -371,6 +523,8 @@ class HiddenMarketFetcher(Fetcher):
         """
         Overload main_query to get maximum score amongst all rome_codes.
         """
+        if self.scores_encoding == SCORES_ENCODING_NESTED:
+            return self._use_max_nested_score_for_rome(main_query)
 
         query = {
             # https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-function-score-query.html
@@ -397,6 +551,45 @@ class HiddenMarketFetcher(Fetcher):
         }
         return query
 
+    def _use_max_nested_score_for_rome(self, main_query: Dict) -> Dict:
+        """
+        Same as _use_max_score_for_rome, for indexes where scores are nested documents.
+        """
+        nested_field_name = self._get_nested_score_field_name(self.hiring_type)
+        nested_query = {
+            # https://www.elastic.co/guide/en/elasticsearch/reference/1.7/query-dsl-nested-query.html
+            "nested": {
+                "path": nested_field_name,
+                # We keep the maximum score amongst scores of all requested rome_codes.
+                "score_mode": "max",
+                "query": {
+                    "function_score": {
+                        "filter": {
+                            "terms": {
+                                f"{nested_field_name}.rome": self.romes,
+                            },
+                        },
+                        "functions": [
+                            {
+                                "field_value_factor": {
+                                    "field": f"{nested_field_name}.score",
+                                    "modifier": "none",
+                                    "missing": 0,
+                                }
+                            },
+                        ],
+                        # The _score of each nested document is its score for its rome_code.
+                        "boost_mode": "replace",
+                    },
+                },
+            },
+        }
+
+        # The filters of the main query are kept as they are, only the scoring query is added.
+        filtered = dict(main_query['filtered'])
+        filtered['query'] = nested_query
+        return {'filtered': filtered}
+
     def _add_smart_randomization(self, main_query: Dict) -> Dict:
         """
         Overload main_query to add smart randomization aka weighted shuffling aka "Tri optimisé"
@@ -528,7 +721,7 @@ class HiddenMarketFetcher(Fetcher):
         self._add_filter_term('flag_handicap', to=filters, if_=self.flag_handicap == 1)
 
         # at least one of these fields should exist
-        self._unsure_rome_is_in_scores(self.romes, self.hiring_type, to=filters)
+        self._unsure_rome_is_in_scores(self.romes, self.hiring_type, to=filters, scores_encoding=self.scores_encoding)
 
         if self.gps_available:
             filters.append({
@@ -710,6 +903,10 @@ class HiddenMarketFetcher(Fetcher):
         field_name = cls._get_score_field_name(hiring_type)
         return f"{field_name}.{rome_code}"
 
+    @classmethod
+    def _get_nested_score_field_name(cls, hiring_type: str):
+        return NESTED_SCORE_FIELD_NAMES[cls._get_score_field_name(hiring_type)]
+
     @staticmethod
     def _get_boosted_rome_field_name(hiring_type, rome_code):
         hiring_type = hiring_type or hiring_type_util.DEFAULT
@@ -762,7 +959,22 @@ class HiddenMarketFetcher(Fetcher):
                               if_=headcount == settings.HEADCOUNT_BIG_ONLY)
 
     @classmethod
-    def _unsure_rome_is_in_scores(cls, rome_codes: Sequence[str], hiring_type: str, to: list):
+    def _unsure_rome_is_in_scores(cls, rome_codes: Sequence[str], hiring_type: str, to: list,
+                                  scores_encoding: Optional[str] = None):
+        if get_scores_encoding(scores_encoding) == SCORES_ENCODING_NESTED:
+            nested_field_name = cls._get_nested_score_field_name(hiring_type)
+            to.append({
+                "nested": {
+                    "path": nested_field_name,
+                    "filter": {
+                        "terms": {
+                            f"{nested_field_name}.rome": list(rome_codes),
+                        },
+                    },
+                }
+            })
+            return
+
         to.append({
             "bool": {
                 "should": [{
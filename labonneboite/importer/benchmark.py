@@ -0,0 +1,121 @@
+"""
+Micro-benchmarks of the importer computing steps, run on synthetic data so that
+neither MySQL nor a real extract is needed.
+
+Usage:
+
+    python -m labonneboite.importer.benchmark --offices 20000 --repeat 3
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from . import compute_score
+
+PREDICTION_BEGINNING_DATE = datetime(2022, 1, 1)
+MONTHS_PER_PERIOD = 6
+# Same number of periods as train() with training_periods=7 and a one period data gap.
+PERIODS = 7 + 2 * (12 // MONTHS_PER_PERIOD) + 1
+
+
+def make_synthetic_df_etab(office_count, prefixes=('dpae', 'alt'), seed=0):
+    """
+    Build a dataframe shaped like the output of get_df_etab_with_hiring_monthly_aggregates:
+    one row per siret and one float column per hiring_type and per month.
+    A few months are missing on purpose, as happens when nobody hired during a month.
+    """
+    random = np.random.RandomState(seed)
+    month_count = PERIODS * MONTHS_PER_PERIOD
+    data = {
+        'siret': ['%014d' % i for i in range(office_count)],
+        'effectif': random.choice([0, 1, 3, 10, 50, 250], size=office_count),
+    }
+    for prefix in prefixes:
+        for i in range(1, month_count + 1):
+            if i % 17 == 0:
+                continue
+            month = PREDICTION_BEGINNING_DATE + relativedelta(months=-i)
+            column = '%s-%s-%s' % (prefix, month.year, month.month)
+            data[column] = random.poisson(0.5, size=office_count).astype(float)
+    return pd.DataFrame(data)
+
+
+def benchmark_hiring_aggregates(office_count, repeat):
+    """
+    Compare the vectorized and the row-wise hiring aggregates, after checking they give the same columns.
+    Returns the best timing of each version, in seconds.
+    """
+    df_etab = make_synthetic_df_etab(office_count)
+
+    def compute(vectorized):
+        df = df_etab.copy()
+        for prefix in ['dpae', 'alt']:
+            compute_score.add_hiring_aggregate_columns(
+                df, PREDICTION_BEGINNING_DATE, PERIODS, prefix, MONTHS_PER_PERIOD, vectorized=vectorized,
+            )
+        return df
+
+    pd.testing.assert_frame_equal(compute(vectorized=False), compute(vectorized=True))
+
+    return {
+        'row-wise': min(timeit.repeat(lambda: compute(vectorized=False), number=1, repeat=repeat)),
+        'vectorized': min(timeit.repeat(lambda: compute(vectorized=True), number=1, repeat=repeat)),
+    }
+
+
+def benchmark_score_assignment(office_count, repeat, seed=0):
+    """
+    Compare the vectorized and the office by office computation of regression targets and of the
+    scores of predicted hirings, after checking they give the same results.
+    Returns the best timing of each version, in seconds.
+    """
+    df_etab = make_synthetic_df_etab(office_count, prefixes=('dpae',))
+    period_columns = compute_score.add_hiring_aggregate_columns(
+        df_etab, PREDICTION_BEGINNING_DATE, PERIODS, 'dpae', MONTHS_PER_PERIOD,
+    )
+    # Regression predictions are mostly small, sometimes negative and sometimes above SCORE_100_HIRINGS.
+    random = np.random.RandomState(seed)
+    predicted_hirings = random.lognormal(mean=0, sigma=1.5, size=office_count) - 0.5
+
+    def compute(vectorized):
+        targets = [
+            compute_score.get_hirings_of_period(df_etab, period, vectorized=vectorized)
+            for period in period_columns[-2:]
+        ]
+        scores = compute_score.get_scores_of_predictions(predicted_hirings, vectorized=vectorized)
+        return targets, scores
+
+    (legacy_targets, legacy_scores), (targets, scores) = compute(vectorized=False), compute(vectorized=True)
+    for legacy_target, target in zip(legacy_targets, targets):
+        np.testing.assert_array_equal(legacy_target.values, target.values)
+    np.testing.assert_array_equal(legacy_scores, scores)
+
+    return {
+        'row-wise': min(timeit.repeat(lambda: compute(vectorized=False), number=1, repeat=repeat)),
+        'vectorized': min(timeit.repeat(lambda: compute(vectorized=True), number=1, repeat=repeat)),
+    }
+
+
+def print_timings(title, office_count, timings):
+    print("%s (%s offices)" % (title, office_count))
+    reference = max(timings.values())
+    for name, duration in timings.items():
+        print("    %-12s %8.3fs  x%.1f" % (name, duration, reference / duration))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark importer computing steps on synthetic data.")
+    parser.add_argument('--offices', type=int, default=10000, help="Number of synthetic offices.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs, the best one is kept.")
+    args = parser.parse_args()
+
+    print_timings("hiring aggregates", args.offices, benchmark_hiring_aggregates(args.offices, args.repeat))
+    print_timings("score assignment", args.offices, benchmark_score_assignment(args.offices, args.repeat))
+
+
+if __name__ == '__main__':
+    run()
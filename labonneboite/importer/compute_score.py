@@ -21,12 +21,21 @@ the number of hirings.
 We use the scikit-learn library: more info at
 http://scikit-learn.org/stable/documentation.html
 """
+import argparse
 from calendar import monthrange
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import csv
 import math
+import json
 from operator import getitem
 import os
 import pickle
+import resource
 import sys
+import tempfile
+import time
+import traceback
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -37,12 +46,13 @@ from sklearn import linear_model
 from sklearn.metrics import mean_squared_error
 import sqlalchemy
 from sqlalchemy.pool import NullPool
+from labonneboite_common import departements as dpt
 
 from labonneboite.common.util import timeit
 from . import settings as importer_settings
 from .models.computing import DpaeStatistics, Hiring, RawOffice
 from labonneboite.common import scoring as scoring_util
-from labonneboite.common.database import get_db_string
+from labonneboite.common.database import db_session, engine as db_engine, get_db_string
 from labonneboite.common.env import get_current_env, ENV_DEVELOPMENT
 from .debug import listen
 from .jobs.common import logger
@@ -60,6 +70,32 @@ def get_engine():
 DEBUG_SIRETS = ["19240023200018", "33530956300047", "26760168000015"]
 # DEBUG_SIRETS = []
 
+# Number of rows converted at once by the compact loading of SQL data.
+SQL_CHUNK_SIZE = 100000
+
+# Compact dtypes of the columns loaded from the raw office table. Only codes which are never null
+# are made categorical, as fillna(0) on df_etab would fail on a categorical column.
+ETAB_COMPACT_DTYPES = {
+    'codenaf': 'category',
+    'codecommune': 'category',
+    'codepostal': 'category',
+    'departement': 'category',
+}
+
+# Compact dtypes of the columns loaded from the hiring table.
+HIRING_COMPACT_DTYPES = {
+    'siret': 'category',
+    'hiring_type': 'category',
+    'hiring_date': 'datetime64[ns]',
+}
+
+# Estimation of the memory used to compute the scores of a departement, used by run_departements
+# to run as many departements in parallel as the memory budget allows. Most of the memory is used
+# by hirings; actual peak memory usages are reported at the end of run_departements.
+DEPARTEMENT_BASE_MEMORY_IN_MB = 500
+MEMORY_PER_HIRING_IN_BYTES = 500
+COMPACT_MEMORY_PER_HIRING_IN_BYTES = 150
+
 # disable unnecessary pandas SettingWithCopyWarning
 # see http://stackoverflow.com/questions/20625582/how-to-deal-with-settingwithcopywarning-in-pandas
 # default value is 'warn'
@@ -182,12 +218,63 @@ def go_back_last_day_of_the_month(date):
     return first_day_of_the_month - timedelta(days=1)  # last day of previous month
 
 
+def get_memory_usage_in_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+def get_peak_rss_in_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def concat_compact_chunks(chunks, dtypes):
+    """
+    Concatenate dataframes converted to the same compact dtypes. Categories of each chunk are
+    unified beforehand, as pandas would otherwise turn categorical columns back into objects.
+    """
+    if not chunks:
+        return pd.DataFrame()
+    for column, dtype in dtypes.items():
+        if dtype == 'category' and column in chunks[0].columns:
+            categories = sorted(set().union(*[chunk[column].cat.categories for chunk in chunks]))
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_sql_query(query, description, compact=False, dtypes=None):
+    """
+    Load the result of an SQL query into a dataframe and log its memory usage.
+
+    In compact mode, rows are streamed from the DB server and converted to the given compact dtypes
+    in chunks of SQL_CHUNK_SIZE rows, so that the whole result never exists as python objects at once.
+    """
+    if not compact:
+        df = pd.read_sql_query(query, get_engine())
+    else:
+        dtypes = dtypes or {}
+        with get_engine().connect().execution_options(stream_results=True) as connection:
+            chunks = [
+                chunk.astype({column: dtype for column, dtype in dtypes.items() if column in chunk.columns})
+                for chunk in pd.read_sql_query(query, connection, chunksize=SQL_CHUNK_SIZE)
+            ]
+        df = concat_compact_chunks(chunks, dtypes)
+    logger.info("loaded %s %s rows (compact: %s): dataframe %.1fMB, peak RSS %.1fMB",
+                len(df), description, compact, get_memory_usage_in_mb(df), get_peak_rss_in_mb())
+    return df
+
+
 @timeit
-def get_df_etab(departement):
+def get_df_etab(departement, compact=False):
     logger.debug("reading etablissements data (%s)", departement)
-    df_etab = pd.read_sql_query("""
+    df_etab = read_sql_query(
+        """
         select * from %s where departement = %s and siret != ''
-        """ % (RawOffice.__tablename__, departement), get_engine())
+        """ % (RawOffice.__tablename__, departement),
+        "etablissements",
+        compact=compact,
+        dtypes=ETAB_COMPACT_DTYPES,
+    )
     debug_df(df_etab, "after loading from raw office table")
     if df_etab.empty:
         logger.warning("dataframe empty for departement %s", departement)
@@ -196,15 +283,17 @@ def get_df_etab(departement):
 
     logger.debug("adding effectif (%s)...", departement)
     df_etab['effectif'] = df_etab['trancheeffectif'].map(tranche_to_effectif)
+    if compact:
+        df_etab['effectif'] = df_etab['effectif'].astype(np.int32)
     logger.debug("effectif done (%s)!", departement)
 
     return df_etab
 
 
 @timeit
-def get_df_hiring(departement, prediction_beginning_date):
+def get_df_hiring(departement, prediction_beginning_date, compact=False):
     logger.debug("reading hiring data...")
-    df_hiring = pd.read_sql_query("""
+    df_hiring = read_sql_query("""
         select
             siret,
             hiring_date,
@@ -225,7 +314,9 @@ def get_df_hiring(departement, prediction_beginning_date):
         ', '.join([str(c_t) for c_t in Hiring.CONTRACT_TYPES_ALL]),
         str(prediction_beginning_date.isoformat()),
     ),
-        get_engine(),
+        "hirings",
+        compact=compact,
+        dtypes=HIRING_COMPACT_DTYPES,
     )
     debug_df(df_hiring, "after loading from hiring table")
     if df_hiring.empty:
@@ -234,45 +325,141 @@ def get_df_hiring(departement, prediction_beginning_date):
 
     df_hiring["hiring_date_month"] = pd.DatetimeIndex(df_hiring["hiring_date"]).month
     df_hiring["hiring_date_year"] = pd.DatetimeIndex(df_hiring["hiring_date"]).year
+    if compact:
+        df_hiring = df_hiring.astype({"hiring_date_month": np.int8, "hiring_date_year": np.int16})
 
     return df_hiring
 
 
+class ExtractCache(object):
+    """
+    Local Parquet files of the dataframes loaded from the DB, for a departement and a prediction
+    beginning date, so that reruns on the same extract do not query MySQL again. Cached dataframes
+    are invalidated when the source tables of the departement change (see get_source_signature).
+    Reading and writing Parquet files requires pyarrow.
+    """
+    ACTIVATED = False
+    FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'extract_cache')
+
+    def __init__(self, departement, prediction_beginning_date, compact=False):
+        self.departement = departement
+        # Dtypes of compact dataframes differ, so that they are cached separately.
+        self.folder = os.path.join(
+            self.FOLDER,
+            "dpt%s" % departement,
+            "%s%s" % (prediction_beginning_date.strftime("%Y-%m-%d"), "-compact" if compact else ""),
+        )
+        self._source_signature = None
+
+    @property
+    def source_signature(self):
+        if self._source_signature is None:
+            self._source_signature = get_source_signature(self.departement)
+        return self._source_signature
+
+    def read(self, name):
+        """
+        Return the cached dataframe, or None if it is missing or outdated.
+        """
+        path = os.path.join(self.folder, "%s.parquet" % name)
+        metadata_path = os.path.join(self.folder, "%s.json" % name)
+        if not os.path.exists(path) or not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as f:
+            if json.load(f)['source_signature'] != self.source_signature:
+                logger.info("cached %s dataframe of departement %s is outdated", name, self.departement)
+                return None
+        df = pd.read_parquet(path)
+        logger.info("read %s dataframe of departement %s from %s", name, self.departement, path)
+        return df
+
+    def write(self, name, df):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        path = os.path.join(self.folder, "%s.parquet" % name)
+        # Write to temporary files first, so that an interrupted run never leaves a truncated file.
+        df.to_parquet(path + ".tmp")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump({'source_signature': self.source_signature}, f)
+        os.replace(path + ".tmp", path)
+        os.replace(path + ".json.tmp", os.path.join(self.folder, "%s.json" % name))
+
+    def get(self, name, load):
+        """
+        Return the cached dataframe, or load it with the `load` function and cache it.
+        """
+        df = self.read(name)
+        if df is None:
+            df = load()
+            if df is not None:
+                self.write(name, df)
+        return df
+
+
+def get_source_signature(departement):
+    """
+    Row count and checksum of the rows of the source tables for a departement.
+
+    The last update time of the tables in information_schema is not reliable with InnoDB (it can be NULL,
+    and is lost on restart), so the checksum is computed from the rows themselves: it catches in-place
+    UPDATEs too. This costs a scan of the rows of the departement, which is still much cheaper than
+    loading them into dataframes.
+    """
+    signature = {}
+    with get_engine().connect() as connection:
+        for table in [RawOffice.__tablename__, Hiring.__tablename__]:
+            columns = connection.execute(
+                sqlalchemy.text(
+                    "select column_name from information_schema.columns"
+                    " where table_schema = database() and table_name = :table order by ordinal_position"
+                ),
+                table=table,
+            ).scalars().all()
+            # NULL values are replaced so that they are told apart from empty strings and not skipped.
+            row = ", ".join("ifnull(`%s`, '\\\\N')" % column for column in columns)
+            count, checksum = connection.execute(
+                sqlalchemy.text(
+                    "select count(*), bit_xor(crc32(concat_ws('|', %s))) from %s where departement = :departement"
+                    % (row, table)
+                ),
+                departement=departement,
+            ).one()
+            signature[table] = {'count': count, 'checksum': str(checksum)}
+    return signature
+
+
+def load_with_cache(cache, name, load):
+    if cache is None:
+        return load()
+    return cache.get(name, load)
+
+
 @timeit
-def get_df_etab_with_hiring_monthly_aggregates(departement, prediction_beginning_date):
+def get_df_etab_with_hiring_monthly_aggregates(departement, prediction_beginning_date, compact=False):
     """
     Returns a df_etab dataframe
     with one row per siret and one column per month (hirings total for given month)
     for all (past) months before (now) prediction_beginning_date.
-    """
-    df_etab = get_df_etab(departement)  # has one row per siret
 
-    df_dpae = get_df_hiring(departement, prediction_beginning_date)  # has one row per hiring
+    In compact mode, data is loaded in chunks with compact dtypes (see read_sql_query) and monthly
+    hiring totals are stored as float32, which is exact for such counts.
 
-    if df_etab is None or df_dpae is None:
-        return None
-
-    df_dpae = df_dpae.groupby(["siret", "hiring_type", "hiring_date_year", "hiring_date_month"]).count().reset_index()
-    debug_df(df_dpae, "after group by")
-    logger.debug("pivoting table dpae (%s)...", departement)
-    # FIXME understand why `values="hiring_date"` is needed at all
-    df_dpae = pd.pivot_table(df_dpae, values="hiring_date", index="siret",
-                             columns=["hiring_type", "hiring_date_year", "hiring_date_month"])
-    debug_df(df_dpae, "after pivot")
-    logger.debug("pivoting table (%s) ok!", departement)
+    When ExtractCache is activated, the dataframes loaded from the DB and the monthly hiring
+    aggregates are read from the cache, or cached once computed.
+    """
+    cache = ExtractCache(departement, prediction_beginning_date, compact) if ExtractCache.ACTIVATED else None
 
-    # after this pivoting,
-    # df_dpae has one row per siret and one column per month (hirings total for given month)
-    # and per hiring_type
+    # has one row per siret
+    df_etab = load_with_cache(cache, 'etab', lambda: get_df_etab(departement, compact=compact))
 
-    df_dpae["siret"] = df_dpae.index
-    df_dpae = df_dpae.fillna(0)
+    df_dpae = load_with_cache(
+        cache,
+        'hiring_monthly_aggregates',
+        lambda: get_df_hiring_monthly_aggregates(departement, prediction_beginning_date, compact=compact, cache=cache),
+    )
 
-    df_dpae.columns = ['-'.join([str(c) for c in col]) for col in df_dpae.columns.values]
-    siret_raw_column_name = 'siret--'
-    df_dpae['siret'] = df_dpae[siret_raw_column_name]
-    del df_dpae[siret_raw_column_name]
-    debug_df(df_dpae, "after transform")
+    if df_etab is None or df_dpae is None:
+        return None
 
     # joining hiring and etab
 
@@ -295,10 +482,64 @@ def get_df_etab_with_hiring_monthly_aggregates(departement, prediction_beginning
         raise Exception("missing website column")
 
     df_etab = df_etab.fillna(0)
+    logger.info("df_etab with hiring monthly aggregates (%s): dataframe %.1fMB, peak RSS %.1fMB",
+                departement, get_memory_usage_in_mb(df_etab), get_peak_rss_in_mb())
 
     return df_etab
 
 
+@timeit
+def get_df_hiring_monthly_aggregates(departement, prediction_beginning_date, compact=False, cache=None):
+    """
+    Returns a df_dpae dataframe with one row per siret and one column per month and per hiring_type
+    (hirings total for given month), or None if there is no hiring data.
+    """
+    # has one row per hiring
+    df_dpae = load_with_cache(
+        cache,
+        'hiring',
+        lambda: get_df_hiring(departement, prediction_beginning_date, compact=compact),
+    )
+
+    if df_dpae is None:
+        return None
+
+    # observed=True avoids computing all combinations of categories in compact mode.
+    df_dpae = df_dpae.groupby(
+        ["siret", "hiring_type", "hiring_date_year", "hiring_date_month"], observed=True,
+    ).count().reset_index()
+    if compact:
+        # Aggregated data is much smaller, and the rest of the computation expects plain strings.
+        df_dpae = df_dpae.astype({"siret": object, "hiring_type": object})
+    debug_df(df_dpae, "after group by")
+    logger.debug("pivoting table dpae (%s)...", departement)
+    # FIXME understand why `values="hiring_date"` is needed at all
+    df_dpae = pd.pivot_table(df_dpae, values="hiring_date", index="siret",
+                             columns=["hiring_type", "hiring_date_year", "hiring_date_month"])
+    debug_df(df_dpae, "after pivot")
+    logger.debug("pivoting table (%s) ok!", departement)
+
+    # after this pivoting,
+    # df_dpae has one row per siret and one column per month (hirings total for given month)
+    # and per hiring_type
+
+    df_dpae = df_dpae.fillna(0)
+    if compact:
+        df_dpae = df_dpae.astype(np.float32)
+    df_dpae["siret"] = df_dpae.index
+
+    df_dpae.columns = ['-'.join([str(c) for c in col]) for col in df_dpae.columns.values]
+    siret_raw_column_name = 'siret--'
+    df_dpae['siret'] = df_dpae[siret_raw_column_name]
+    del df_dpae[siret_raw_column_name]
+    # The siret index is not used by the merge with df_etab, and could not be stored along
+    # with the siret column by ExtractCache.
+    df_dpae = df_dpae.reset_index(drop=True)
+    debug_df(df_dpae, "after transform")
+
+    return df_dpae
+
+
 def compute_prediction_beginning_date():
     """
     We predict hirings starting from the 1st of the current month.
@@ -349,9 +590,9 @@ def get_features_for_lag(df_etab, prefix, training_periods, data_gap_in_periods,
     return X, features
 
 
-def get_hirings_over_period_for_office(office, prediction_beginning_date, months_per_period, minus, prefix):
+def get_hiring_columns_of_period(prediction_beginning_date, months_per_period, minus, prefix):
     """
-    office : one row of df_etab.
+    Names of the monthly hiring columns of df_etab making up the given period.
     minus : how many periods to go back in time.
     """
     start_date = prediction_beginning_date + relativedelta(months=-(months_per_period * minus))
@@ -360,6 +601,15 @@ def get_hirings_over_period_for_office(office, prediction_beginning_date, months
     for i in range(0, months_per_period):  # [0, 1, 2, ..., months_per_period - 1]
         current_date = start_date + relativedelta(months=i)
         columns_of_period.append('%s-%s-%s' % (prefix, current_date.year, current_date.month))
+    return columns_of_period
+
+
+def get_hirings_over_period_for_office(office, prediction_beginning_date, months_per_period, minus, prefix):
+    """
+    office : one row of df_etab.
+    minus : how many periods to go back in time.
+    """
+    columns_of_period = get_hiring_columns_of_period(prediction_beginning_date, months_per_period, minus, prefix)
 
     hirings_over_period = 0
     for column in columns_of_period:
@@ -371,8 +621,64 @@ def get_hirings_over_period_for_office(office, prediction_beginning_date, months
     return hirings_over_period
 
 
+def add_hiring_aggregate_columns(df_etab, prediction_beginning_date, periods, prefix, months_per_period,
+                                 vectorized=True):
+    """
+    Edits in place df_etab.
+    Adds one column per period containing hiring total for this hiring_type, and returns their names.
+
+    The vectorized version sums the existing monthly columns of each period for all offices at once,
+    whereas the legacy version applies get_hirings_over_period_for_office row by row.
+    Both versions give the same columns.
+    """
+    period_count_columns = []
+    for i in range(1, periods + 1):  # [1, 2, ..., periods]
+        column = '%s-period-%s' % (prefix, i)
+        if vectorized:
+            # Months without any hiring in the whole departement have no column at all.
+            columns_of_period = [
+                month_column
+                for month_column in get_hiring_columns_of_period(prediction_beginning_date, months_per_period, i,
+                                                                 prefix)
+                if month_column in df_etab.columns
+            ]
+            df_etab[column] = df_etab[columns_of_period].sum(axis=1) if columns_of_period else 0
+        else:
+            # pylint: disable=cell-var-from-loop
+            df_etab[column] = df_etab.apply(
+                lambda office: get_hirings_over_period_for_office(
+                    office, prediction_beginning_date, months_per_period, minus=i, prefix=prefix,
+                ),
+                axis=1,
+            )
+        period_count_columns.append(column)
+    return period_count_columns
+
+
+def get_hirings_of_period(df_etab, period, vectorized=True):
+    """
+    Hiring total of each office for the given period column, e.g. the target of the regression.
+    The legacy version applies total_hired_period row by row.
+    """
+    if vectorized:
+        return df_etab[period]
+    return df_etab.apply(total_hired_period(period), axis=1)
+
+
+def get_scores_of_predictions(predicted_hirings, vectorized=True):
+    """
+    Scores of the hirings predicted by the regression, which may be negative or above SCORE_100_HIRINGS.
+
+    The vectorized version maps all predictions to scores at once with numpy, whereas the legacy version
+    calls scoring_util.get_score_from_hirings for each office. Both versions give the same scores.
+    """
+    if vectorized:
+        return scoring_util.get_scores_from_hirings(predicted_hirings)
+    return np.array([scoring_util.get_score_from_hirings(h) for h in predicted_hirings], dtype=np.int64)
+
+
 def compute_hiring_aggregates(
-        df_etab, departement, prediction_beginning_date, periods, prefix, months_per_period):
+        df_etab, departement, prediction_beginning_date, periods, prefix, months_per_period, vectorized=True):
     """
     Edits in place df_etab.
     Adds one column per period containing hiring total for this hiring_type.
@@ -380,17 +686,9 @@ def compute_hiring_aggregates(
     logger.debug("computing %s hiring aggregates (%s)...", prefix, departement)
 
     # df_etab has one row per siret and one column per hiring month-aggregate and per hiring_type
-    period_count_columns = []
-    for i in range(1, periods + 1):  # [1, 2, ..., periods]
-        column = '%s-period-%s' % (prefix, i)
-        # pylint: disable=cell-var-from-loop
-        df_etab[column] = df_etab.apply(
-            lambda office: get_hirings_over_period_for_office(
-                office, prediction_beginning_date, months_per_period, minus=i, prefix=prefix,
-            ),
-            axis=1,
-        )
-        period_count_columns.append(column)
+    period_count_columns = add_hiring_aggregate_columns(
+        df_etab, prediction_beginning_date, periods, prefix, months_per_period, vectorized=vectorized,
+    )
     logger.debug("finished calculating %s temporal features (%s)!", prefix, departement)
 
     check_coefficient_of_variation(df_etab, departement, period_count_columns, prefix)
@@ -400,7 +698,7 @@ def compute_hiring_aggregates(
 
 @timeit
 def train(df_etab, departement, prediction_beginning_date, last_historical_data_date,
-          months_per_period, training_periods, prefix_for_fields, score_field_name, is_lbb=True):
+          months_per_period, training_periods, prefix_for_fields, score_field_name, is_lbb=True, vectorized=True):
     """
     Edits in place df_etab by adding final score columns
     (e.g. score and score_regr for DPAE/LBB, or score_alternance and score_alternance_regr for LBA).
@@ -415,6 +713,9 @@ def train(df_etab, departement, prediction_beginning_date, last_historical_data_
 
     At the end of this method df_etab has one row per siret and one column per hiring_type and
     per period (hirings total for given period).
+
+    With vectorized=False, regression targets and scores are computed office by office
+    (legacy version, see get_scores_of_predictions).
     """
     check_prediction_beginning_date(prediction_beginning_date)
     check_last_historical_data_date(last_historical_data_date)
@@ -455,7 +756,7 @@ def train(df_etab, departement, prediction_beginning_date, last_historical_data_
     regr = linear_model.LinearRegression()
 
     y_train_period = '%s-period-%s' % (prefix_for_fields, 2 * periods_per_year + data_gap_in_periods)
-    y_train_regr = df_etab.apply(total_hired_period(y_train_period), axis=1)
+    y_train_regr = get_hirings_of_period(df_etab, y_train_period, vectorized=vectorized)
 
     X_train, X_train_feature_names = get_features_for_lag(
         df_etab,
@@ -505,7 +806,7 @@ def train(df_etab, departement, prediction_beginning_date, last_historical_data_
     # --- compute regression metrics
     y_train_regr_pred = regr.predict(X_train)
     y_test_period = '%s-period-%s' % (prefix_for_fields, periods_per_year + data_gap_in_periods)
-    y_test_regr = df_etab.apply(total_hired_period(y_test_period), axis=1)
+    y_test_regr = get_hirings_of_period(df_etab, y_test_period, vectorized=vectorized)
     y_test_regr_pred = regr.predict(X_test)
     rmse_train = mean_squared_error(y_train_regr, y_train_regr_pred)
     rmse_test = mean_squared_error(y_test_regr, y_test_regr_pred)
@@ -543,7 +844,7 @@ def train(df_etab, departement, prediction_beginning_date, last_historical_data_
     score_regr_field_name = "%s_regr" % score_field_name
 
     df_etab[score_regr_field_name] = regr.predict(X_live)
-    df_etab[score_field_name] = [scoring_util.get_score_from_hirings(h) for h in df_etab[score_regr_field_name]]
+    df_etab[score_field_name] = get_scores_of_predictions(df_etab[score_regr_field_name].values, vectorized=vectorized)
 
     ranges = [0, 20, 40, 60, 80, 100]
     logger.info('(%s %s) score distribution : %s', departement, prefix_for_fields,
@@ -553,23 +854,89 @@ def train(df_etab, departement, prediction_beginning_date, last_historical_data_
 
 
 @timeit
-def export_df_etab_to_db(df_etab, departement):
+def export_df_etab_to_db(df_etab, departement, fast=False):
+    """
+    Write df_etab to the etablissements_<departement> table, with DataFrame.to_sql or,
+    in fast mode, with load_df_into_table.
+    """
     logger.debug("writing sql (%s)...", departement)
 
-    def departement_to_str(x):
-        return "{:02d}".format(int(x["departement"]))
+    df_etab['departement'] = df_etab['departement'].astype(int).astype(str).str.zfill(2)
 
-    df_etab['departement'] = df_etab.apply(departement_to_str, axis=1)
-
-    # FIXME control more precisely the schema (indexes!) of temporary tables created by to_sql,
-    # current version adds an 'index' column (which is the panda dataframe index column itself,
-    # nothing to do with our app) and makes it a primary key.
-    # see https://pandas.pydata.org/pandas-docs/stable/generated/pandas.DataFrame.to_sql.html
-    # Maybe using no index at all (no primary key) would be faster.
-    df_etab.to_sql("etablissements_%s" % departement, get_engine(), if_exists='replace', chunksize=10000)
+    table = "etablissements_%s" % departement
+    if fast:
+        load_df_into_table(df_etab, table)
+    else:
+        # FIXME control more precisely the schema (indexes!) of temporary tables created by to_sql,
+        # current version adds an 'index' column (which is the panda dataframe index column itself,
+        # nothing to do with our app) and makes it a primary key.
+        # see https://pandas.pydata.org/pandas-docs/stable/generated/pandas.DataFrame.to_sql.html
+        # Maybe using no index at all (no primary key) would be faster.
+        df_etab.to_sql(table, get_engine(), if_exists='replace', chunksize=10000)
     logger.debug("sql done (%s)!", departement)
 
 
+def load_df_into_table(df, table):
+    """
+    Replace the table by the content of the dataframe, through a TSV file loaded with
+    `LOAD DATA LOCAL INFILE` (which requires the ENABLE_DB_INFILE environment variable, see get_db_string).
+
+    The table gets the same columns as with DataFrame.to_sql, including the `index` column. Data is loaded
+    into a new table, which then replaces the existing one in a single RENAME TABLE: readers never see a
+    partially loaded table.
+    """
+    frame = df.reset_index()
+    new_table = "%s_new" % table
+    old_table = "%s_old" % table
+    columns = ", ".join("`%s`" % column for column in frame.columns)
+
+    start = time.time()
+    fd, path = tempfile.mkstemp(prefix="%s_" % table, suffix=".tsv")
+    os.close(fd)
+    try:
+        # Special characters are preceded by a backslash, as expected by default by LOAD DATA.
+        # df_etab has no null value left (see get_df_etab_with_hiring_monthly_aggregates),
+        # so that \N never needs to be written.
+        frame.to_csv(path, sep='\t', header=False, index=False, quoting=csv.QUOTE_NONE, escapechar='\\',
+                     lineterminator='\n')
+        write_duration = time.time() - start
+
+        with get_engine().begin() as connection:
+            connection.execute(sqlalchemy.text("DROP TABLE IF EXISTS `%s`" % new_table))
+            connection.execute(sqlalchemy.text(pd.io.sql.get_schema(frame, new_table, con=connection)))
+            connection.execute(sqlalchemy.text(
+                "LOAD DATA LOCAL INFILE '%s' INTO TABLE `%s` CHARACTER SET utf8mb4"
+                " FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (%s)"
+                % (path, new_table, columns)
+            ))
+            # Same index as the one created by to_sql.
+            connection.execute(sqlalchemy.text("CREATE INDEX `ix_%s_index` ON `%s` (`index`)" % (table, new_table)))
+            load_duration = time.time() - start - write_duration
+
+            if sqlalchemy.inspect(connection).has_table(table):
+                connection.execute(sqlalchemy.text("DROP TABLE IF EXISTS `%s`" % old_table))
+                connection.execute(sqlalchemy.text(
+                    "RENAME TABLE `%s` TO `%s`, `%s` TO `%s`" % (table, old_table, new_table, table)
+                ))
+                connection.execute(sqlalchemy.text("DROP TABLE `%s`" % old_table))
+            else:
+                connection.execute(sqlalchemy.text("RENAME TABLE `%s` TO `%s`" % (new_table, table)))
+    finally:
+        os.remove(path)
+
+    duration = time.time() - start
+    logger.info(
+        "loaded %s rows into %s in %.1fs (%.0f rows/s): TSV written in %.1fs (%.0f rows/s), loaded in %.1fs",
+        len(frame),
+        table,
+        duration,
+        len(frame) / max(duration, 1e-6),
+        write_duration,
+        len(frame) / max(write_duration, 1e-6),
+        load_duration,
+    )
+
+
 @timeit
 def compare_new_scores_to_old_ones(departement, df_etab):
     logger.debug("fetching existing scores for %s", departement)
@@ -615,6 +982,8 @@ def run(
     departement,
     prediction_beginning_date=None,
     return_df_etab_if_successful=False,
+    compact=False,
+    fast_export=False,
 ):
     """
     Returns True if computation successful and False otherwise.
@@ -624,7 +993,7 @@ def run(
     check_prediction_beginning_date(prediction_beginning_date)
     # get df_etab with monthly hirings for each hiring_type
     # hirings are not yet grouped by period (i.e. 6 months for DPAE / 6 months for Alternance)
-    df_etab = get_df_etab_with_hiring_monthly_aggregates(departement, prediction_beginning_date)
+    df_etab = get_df_etab_with_hiring_monthly_aggregates(departement, prediction_beginning_date, compact=compact)
     logger.debug("df_etab_with_hiring_monthly_aggregates loaded for departement %s", departement)
 
     if df_etab is None:
@@ -663,15 +1032,201 @@ def run(
 
     # Final data export.
 
-    export_df_etab_to_db(df_etab, departement)
+    export_df_etab_to_db(df_etab, departement, fast=fast_export)
     if return_df_etab_if_successful:
         return df_etab  # only used in test_compute_score.py for inspection
     return True  # successful computation
 
 
+def run_departement(departement, prediction_beginning_date, compact=False, cache=False, fast_export=False):
+    """
+    Run the score computation of a departement in a worker process of run_departements.
+    Errors are returned rather than raised, as exceptions are not always picklable.
+    """
+    ExtractCache.ACTIVATED = cache
+    start = time.time()
+    result = {'departement': departement}
+    try:
+        df_etab = run(
+            departement,
+            prediction_beginning_date=prediction_beginning_date,
+            return_df_etab_if_successful=True,
+            compact=compact,
+            fast_export=fast_export,
+        )
+    except Exception:  # pylint: disable=broad-except
+        result.update(status='failed', offices=0, error=traceback.format_exc())
+    else:
+        if df_etab is False:
+            result.update(status='no data', offices=0)
+        else:
+            result.update(status='done', offices=len(df_etab))
+    result.update(duration=time.time() - start, peak_rss_mb=get_peak_rss_in_mb())
+    return result
+
+
+def get_hiring_counts(departements):
+    counts = {}
+    with get_engine().connect() as connection:
+        for departement in departements:
+            counts[departement] = connection.execute(
+                sqlalchemy.text("select count(*) from %s where departement = %s" % (Hiring.__tablename__, departement))
+            ).scalar()
+    return counts
+
+
+def estimate_memory_in_mb(hiring_count, compact=False):
+    memory_per_hiring = COMPACT_MEMORY_PER_HIRING_IN_BYTES if compact else MEMORY_PER_HIRING_IN_BYTES
+    return DEPARTEMENT_BASE_MEMORY_IN_MB + hiring_count * memory_per_hiring / 1024 / 1024
+
+
+def get_default_memory_budget_in_mb():
+    # Keep a quarter of the physical memory for MySQL and the system.
+    return 0.75 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 / 1024
+
+
+@timeit
+def run_departements(departements, processes=None, memory_budget_mb=None, retries=1, compact=False, cache=False,
+                     fast_export=False):
+    """
+    Compute the scores of several departements in parallel, and return the result of each of them
+    (see run_departement).
+
+    Departements are started largest first (in number of hirings), as long as fewer than `processes`
+    are running and their estimated memory usage fits in the memory budget (see estimate_memory_in_mb).
+    A departement which does not fit only starts once no other departement is running.
+
+    Each departement runs in its own process, so that memory is freed up after each of them and that
+    a crash (e.g. a process killed for lack of memory) only fails this departement. Failed departements
+    are retried `retries` times.
+    """
+    processes = processes or os.cpu_count()
+    memory_budget_mb = memory_budget_mb or get_default_memory_budget_in_mb()
+    prediction_beginning_date = compute_prediction_beginning_date()
+    hiring_counts = get_hiring_counts(departements)
+    # Worker processes are forked: they must not share the DB connections of this process.
+    db_session.remove()
+    db_engine.dispose()
+    memory_estimates = {
+        departement: estimate_memory_in_mb(hiring_counts[departement], compact=compact)
+        for departement in departements
+    }
+    pending = sorted(departements, key=lambda departement: hiring_counts[departement], reverse=True)
+    attempts = {departement: 0 for departement in departements}
+    running = {}  # future: (departement, executor)
+    results = {}
+    logger.info("computing scores of %s departements with %s processes and a memory budget of %.0fMB",
+                len(departements), processes, memory_budget_mb)
+
+    while pending or running:
+        for departement in list(pending):
+            if len(running) >= processes:
+                break
+            used_memory_mb = sum(memory_estimates[d] for d, _ in running.values())
+            if running and used_memory_mb + memory_estimates[departement] > memory_budget_mb:
+                continue
+            pending.remove(departement)
+            attempts[departement] += 1
+            logger.info("starting departement %s (attempt %s, %s hirings, estimated memory %.0fMB)",
+                        departement, attempts[departement], hiring_counts[departement],
+                        memory_estimates[departement])
+            executor = ProcessPoolExecutor(max_workers=1)
+            future = executor.submit(
+                run_departement, departement, prediction_beginning_date, compact, cache, fast_export,
+            )
+            running[future] = (departement, executor)
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            departement, executor = running.pop(future)
+            executor.shutdown()
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                result = {
+                    'departement': departement,
+                    'status': 'failed',
+                    'offices': 0,
+                    'error': "process died (killed for lack of memory?)",
+                    'duration': None,
+                    'peak_rss_mb': None,
+                }
+            result['attempts'] = attempts[departement]
+            results[departement] = result
+            if result['status'] == 'failed':
+                logger.error("departement %s failed: %s", departement, result['error'])
+                if attempts[departement] <= retries:
+                    pending.append(departement)
+            else:
+                logger.info("departement %s: %s in %.0fs", departement, result['status'], result['duration'])
+
+    log_run_departements_summary([results[departement] for departement in departements], hiring_counts)
+    return results
+
+
+def log_run_departements_summary(results, hiring_counts):
+    logger.info("%-12s %-8s %8s %10s %12s %10s %14s",
+                "departement", "status", "attempts", "duration", "hirings", "offices", "peak RSS (MB)")
+    for result in sorted(results, key=lambda result: result['duration'] or 0, reverse=True):
+        logger.info(
+            "%-12s %-8s %8s %10s %12s %10s %14s",
+            result['departement'],
+            result['status'],
+            result['attempts'],
+            "%.0fs" % result['duration'] if result['duration'] is not None else "-",
+            hiring_counts[result['departement']],
+            result['offices'],
+            "%.0f" % result['peak_rss_mb'] if result['peak_rss_mb'] is not None else "-",
+        )
+    failed = [result['departement'] for result in results if result['status'] == 'failed']
+    if failed:
+        logger.error("%s departements failed: %s", len(failed), ", ".join(failed))
+
+
 @timeit
 def run_main():
-    run(departement=sys.argv[1])
+    parser = argparse.ArgumentParser(description="Compute the scores of the offices of departements.")
+    parser.add_argument('departements', nargs='*',
+                        help="Departements to compute, in parallel when there are several of them.")
+    parser.add_argument('--all-departements', action='store_true', help="Compute all departements in parallel.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Load data in chunks with compact dtypes, to bound memory usage.")
+    parser.add_argument('--cache', action='store_true',
+                        help=("Read DB data from the local extract cache, or cache it (requires pyarrow). Cached data"
+                              " is checked against a checksum of the source rows of each departement."))
+    parser.add_argument('--fast-export', action='store_true',
+                        help="Export scores with LOAD DATA LOCAL INFILE (requires ENABLE_DB_INFILE=1).")
+    parser.add_argument('--processes', type=int, help="Maximum number of departements computed in parallel.")
+    parser.add_argument('--memory-budget', type=int,
+                        help="Memory budget of departements computed in parallel, in MB (default: 75%% of RAM).")
+    parser.add_argument('--retries', type=int, default=1, help="Number of retries of a failed departement.")
+    args = parser.parse_args()
+
+    departements = dpt.DEPARTEMENTS if args.all_departements else args.departements
+    if not departements:
+        parser.error("no departement given")
+    if args.cache:
+        # Fail before loading any data rather than when the first dataframe is cached.
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--cache requires pyarrow, which is not installed (pip install pyarrow)")
+
+    if len(departements) == 1:
+        ExtractCache.ACTIVATED = args.cache
+        run(departement=departements[0], compact=args.compact, fast_export=args.fast_export)
+    else:
+        results = run_departements(
+            departements,
+            processes=args.processes,
+            memory_budget_mb=args.memory_budget,
+            retries=args.retries,
+            compact=args.compact,
+            cache=args.cache,
+            fast_export=args.fast_export,
+        )
+        if any(result['status'] == 'failed' for result in results.values()):
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+"""
+Offline benchmark of the Python side of office searches.
+
+Elasticsearch is replaced by a stub returning responses shaped like the ones of ES 1.7
+(hits with sort values, aggregations, msearch counts) and the offices are kept in memory
+instead of MySQL, so that timings only measure our own code:
+
+- query building (`HiddenMarketFetcher._build_elastic_search_query`),
+- offices formatting (`_format_offices_in_office_results`, `OfficeResult`),
+- aggregations and suggestions processing,
+- API serialization (`web.api.views.build_result`, `Office.as_json`).
+
+For each scenario and each stage, the best time over all runs and the peak of memory
+allocated during the stage (tracemalloc) are reported.
+
+Usage:
+
+    python -m labonneboite.scripts.benchmark_search --offices 100 --repeat 20
+"""
+import argparse
+import collections
+import contextlib
+import random
+import time
+import tracemalloc
+from unittest import mock
+
+from labonneboite.common import hiring_type_util, search
+from labonneboite.common.models import Office
+from labonneboite.common.search import HiddenMarketFetcher
+from labonneboite.conf import settings
+from labonneboite.web.api import views as api_views
+from labonneboite.web.app import app
+
+# Metz
+LATITUDE = 49.1044
+LONGITUDE = 6.17952
+COMMUNE_ID = '57463'
+NAF = '4711D'
+
+SCENARIOS = collections.OrderedDict([
+    ('single rome', {'romes': ['D1106']}),
+    ('multi rome', {'romes': ['D1106', 'D1101', 'D1102', 'D1103', 'D1104']}),
+    ('aggregations', {'romes': ['D1106'], 'aggregate_by': ['naf', 'headcount', 'distance'], 'distance': 3000}),
+    ('suggestions', {'romes': ['D1106'], 'add_suggestions': True}),
+])
+
+# Fetcher methods timed as stages, in the order they are called.
+STAGES = [
+    '_build_elastic_search_query',
+    '_get_offices_from_db',
+    '_format_offices_in_office_results',
+    '_extract_aggregations',
+    '_compute_suggestions',
+]
+
+
+def make_offices(count, seed=0):
+    random_generator = random.Random(seed)
+    return [
+        Office(
+            siret='%014d' % i,
+            company_name='COMPANY %s' % i,
+            office_name='OFFICE %s' % i,
+            naf=NAF,
+            street_number=str(i % 100),
+            street_name='RUE DE LA GARE',
+            city_code=COMMUNE_ID,
+            zipcode='57000',
+            email='office%s@example.com' % i,
+            tel='0387787878',
+            website='https://example.com',
+            flag_alternance=0,
+            flag_junior=0,
+            flag_senior=0,
+            flag_handicap=0,
+            has_multi_geolocations=False,
+            departement='57',
+            headcount=random_generator.choice(['01', '03', '12', '22', '41']),
+            hiring=random_generator.randint(0, 300),
+            score_alternance=random_generator.randint(0, 100),
+            x=LONGITUDE + random_generator.uniform(-0.2, 0.2),
+            y=LATITUDE + random_generator.uniform(-0.2, 0.2),
+        ) for i in range(count)
+    ]
+
+
+class StubElasticsearch(object):
+    """
+    Answers `search`, `count` and `msearch` calls with the given offices as hits.
+    The time spent here is reported as the `es stub` stage.
+    """
+
+    def __init__(self, offices, seed=0):
+        self.offices = offices
+        self.random = random.Random(seed)
+        self.scores = {
+            office.siret: {rome: self.random.randint(0, 100) for rome in settings.ROME_DESCRIPTIONS}
+            for office in offices
+        }
+        self.duration = 0
+
+    def _hit(self, office, body):
+        sort = []
+        for sort_field in body.get('sort', []):
+            if isinstance(sort_field, dict) and '_geo_distance' in sort_field:
+                sort.append(self.random.uniform(0, 30))
+            else:
+                sort.append(self.random.uniform(0, 100))
+        scores = self.scores[office.siret]
+        return {
+            '_id': office.siret,
+            '_score': None,
+            'sort': sort,
+            '_source': {
+                'siret': office.siret,
+                search.DPAE_SCORE_FIELD_NAME: scores,
+                search.ALTERNANCE_SCORE_FIELD_NAME: scores,
+                'boosted_romes': [],
+            },
+        }
+
+    @staticmethod
+    def _aggregations(body):
+        aggregations = {}
+        for name in body.get('aggs', {}):
+            if name == 'distance':
+                buckets = [{'key': key, 'doc_count': 10 * i} for i, key in enumerate(search.KEY_TO_LABEL_DISTANCES, 1)]
+            elif name == 'headcount':
+                buckets = [{'key': key, 'doc_count': key} for key in range(1, 53)]
+            else:
+                buckets = [{'key': NAF, 'doc_count': 42}]
+            aggregations[name] = {'buckets': buckets}
+        return aggregations
+
+    def search(self, index=None, doc_type=None, body=None):
+        start = time.perf_counter()
+        body = body or {}
+        first = body.get('from', 0)
+        size = body.get('size', 10)
+        response = {
+            'hits': {
+                'total': len(self.offices),
+                'hits': [self._hit(office, body) for office in self.offices[first:first + size]],
+            },
+            'aggregations': self._aggregations(body),
+        }
+        self.duration += time.perf_counter() - start
+        return response
+
+    def count(self, index=None, doc_type=None, body=None):
+        return {'count': len(self.offices)}
+
+    def msearch(self, body=None):
+        start = time.perf_counter()
+        response = {'responses': [{'hits': {'total': len(self.offices), 'hits': []}} for _ in body[1::2]]}
+        self.duration += time.perf_counter() - start
+        return response
+
+
+class StageRecorder(object):
+    """
+    Wraps fetcher methods to measure the time and the memory allocated in each of them.
+    """
+
+    def __init__(self):
+        self.durations = collections.defaultdict(list)
+        self.allocations = collections.defaultdict(int)
+
+    def wrap(self, name, method):
+        def wrapper(*args, **kwargs):
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.durations[name].append(time.perf_counter() - start)
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                self.allocations[name] = max(self.allocations[name], peak - before)
+            return result
+        return wrapper
+
+    @contextlib.contextmanager
+    def record(self, stage, measure_allocations=True):
+        # The peak of an enclosing stage is reset by its nested stages: its allocations cannot be measured.
+        tracing = measure_allocations and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        yield
+        self.durations[stage].append(time.perf_counter() - start)
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            self.allocations[stage] = max(self.allocations[stage], peak - before)
+
+
+def run_scenario(offices, scenario, repeat, page_size):
+    scenario = dict(scenario)
+    add_suggestions = scenario.pop('add_suggestions', False)
+    distance = scenario.pop('distance', 10)
+    offices_by_siret = {office.siret: office for office in offices}
+    es = StubElasticsearch(offices)
+    recorder = StageRecorder()
+
+    def get_offices_from_db(_fetcher, es_offices_by_siret):
+        # Same as the real method, with offices kept in memory instead of MySQL.
+        return [offices_by_siret[siret] for siret in es_offices_by_siret if siret in offices_by_siret]
+
+    patches = [mock.patch.object(search, 'Elasticsearch', return_value=es)]
+    patches += [
+        mock.patch.object(
+            HiddenMarketFetcher, stage,
+            recorder.wrap(stage, get_offices_from_db if stage == '_get_offices_from_db'
+                          else getattr(HiddenMarketFetcher, stage)),
+        ) for stage in STAGES
+    ]
+
+    query_string = 'user=labonneboite&commune_id=%s' % COMMUNE_ID
+    with contextlib.ExitStack() as stack, app.test_request_context('/api/v1/company/?%s' % query_string):
+        for patch in patches:
+            stack.enter_context(patch)
+
+        for run in range(repeat + 1):
+            # The last run only measures allocations, as tracing slows everything down.
+            if run == repeat:
+                tracemalloc.start()
+            fetcher = HiddenMarketFetcher(
+                longitude=LONGITUDE,
+                latitude=LATITUDE,
+                distance=distance,
+                hiring_type=hiring_type_util.DPAE,
+                from_number=1,
+                to_number=page_size,
+                **scenario,
+            )
+            es.duration = 0
+            with recorder.record('total', measure_allocations=False):
+                with recorder.record('get_offices', measure_allocations=False):
+                    results, _ = fetcher.get_offices(add_suggestions=add_suggestions)
+                with recorder.record('build_result'):
+                    api_views.build_result(fetcher, results, COMMUNE_ID, None, None)
+            if run < repeat:
+                recorder.durations['es stub'].append(es.duration)
+            else:
+                tracemalloc.stop()
+    return recorder
+
+
+def print_scenario(name, recorder):
+    print(name)
+    stages = STAGES + ['es stub', 'get_offices', 'build_result', 'total']
+    for stage in stages:
+        if stage not in recorder.durations:
+            continue
+        allocations = recorder.allocations.get(stage)
+        print("    %-36s %9.3fms  %12s" % (
+            stage,
+            1000 * min(recorder.durations[stage]),
+            '-' if allocations is None else '%.1fKiB' % (allocations / 1024),
+        ))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the Python side of office searches, without ES nor MySQL.")
+    parser.add_argument('--offices', type=int, default=100, help="Number of offices returned by the ES stub.")
+    parser.add_argument('--page-size', type=int, default=100, help="Number of offices per page.")
+    parser.add_argument('--repeat', type=int, default=20, help="Number of runs, the best one is kept.")
+    parser.add_argument('--scenario', choices=list(SCENARIOS), action='append', help="Scenarios to run (default: all).")
+    args = parser.parse_args()
+
+    offices = make_offices(args.offices)
+    for name in args.scenario or SCENARIOS:
+        print_scenario(name, run_scenario(offices, SCENARIOS[name], args.repeat, args.page_size))
+
+
+if __name__ == '__main__':
+    run()
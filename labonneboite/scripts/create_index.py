@@ -3,16 +3,23 @@ import bz2
 import contextlib
 import datetime
 import glob
+import hashlib
+import json
 import logging
 import multiprocessing as mp
 import os
+import resource
+import shutil
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from cProfile import Profile
-from typing import Any, Dict, Generator, List, Optional, Tuple, Type, Union
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple, Type, Union
 
 import sqlalchemy as sa
 from elasticsearch.exceptions import NotFoundError, TransportError
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import BulkIndexError, bulk, expand_action
 from labonneboite_common import departements as dpt
 from labonneboite_common import encoding as encoding_util
 from labonneboite_common.models.office_mixin import OfficeMixin
@@ -28,7 +35,7 @@ from labonneboite.common.chunks import chunks
 from labonneboite.common.database import db_session
 from labonneboite.common.load_data import load_ogr_labels, load_siret_to_remove, OGR_ROME_CODES
 from labonneboite.common.models import HistoryBlacklist, Office, OfficeAdminAdd, OfficeAdminExtraGeoLocation, \
-    OfficeAdminRemove, OfficeAdminUpdate, OfficeThirdPartyUpdate
+    OfficeAdminRemove, OfficeAdminUpdate, OfficeFingerprint, OfficeThirdPartyUpdate
 from labonneboite.common.search import HiddenMarketFetcher
 from labonneboite.common.util import timeit
 
@@ -41,6 +48,21 @@ VERBOSE_LOGGER_NAMES = ['elasticsearch', 'sqlalchemy.engine.base.Engine', 'main'
 
 ES_BULK_CHUNK_SIZE = 10000  # default value is 500
 
+OFFICE_WINDOW_SIZE = 5000
+
+# Maximum number of sirets in the IN clause of a query.
+OFFICE_SIRET_CHUNK_SIZE = 1000
+
+ES_BULK_THREAD_COUNT = 4
+ES_BULK_MAX_CHUNK_BYTES = 20 * 1024 * 1024
+ES_BULK_MAX_RETRIES = 5
+ES_BULK_RETRY_DELAY_IN_SECONDS = 1
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Maximum number of ROME codes counted by a single aggregation of the sanity check.
+SANITY_CHECK_ROME_CHUNK_SIZE = 200
+SANITY_CHECK_MINIMUM_OFFICE_COUNT = 5
+
 PSE_STUDY_IS_ENABLED = False
 
 
@@ -48,8 +70,65 @@ class Profiling(object):
     ACTIVATED = False
 
 
+class Streaming(object):
+    """
+    When activated, offices of a departement are read from the DB by windows of WINDOW_SIZE offices
+    and fed as a stream of actions to the ES bulk helper, so that memory usage of a job does not
+    depend on the size of its departement.
+    """
+    ACTIVATED = False
+    WINDOW_SIZE = OFFICE_WINDOW_SIZE
+
+
+class ParallelBulk(object):
+    """
+    When activated, bulk actions are sent to ES by THREAD_COUNT threads, in chunks of at most
+    CHUNK_SIZE actions and MAX_CHUNK_BYTES bytes. At most MAX_PENDING_CHUNKS chunks are built
+    but not sent yet, so that reading actions never gets far ahead of ES.
+    """
+    ACTIVATED = False
+    THREAD_COUNT = ES_BULK_THREAD_COUNT
+    CHUNK_SIZE = ES_BULK_CHUNK_SIZE
+    MAX_CHUNK_BYTES = ES_BULK_MAX_CHUNK_BYTES
+    MAX_PENDING_CHUNKS = 2 * ES_BULK_THREAD_COUNT
+
+
+class Workers(object):
+    """
+    Pool of processes running departement jobs in parallel. By default each process runs a single job
+    (MAX_TASKS_PER_CHILD = 1), so that memory is freed up after every departement. Once memory is known
+    to stay bounded, processes can be reused for several jobs (None: for all of them) to avoid forking
+    a new process and reloading reference data for each departement.
+    """
+    PROCESSES: Optional[int] = None  # default: 1.25 x the number of CPUs
+    MAX_TASKS_PER_CHILD: Optional[int] = 1
+
+
+class Fingerprints(object):
+    """
+    When activated, full and partial indexings save the fingerprint of each indexed office, which a later
+    delta indexing (-d) compares with the current documents. This is not free: each departement job keeps
+    a siret -> fingerprint dict of its offices in memory, even when streaming, and then deletes and
+    inserts one row per office in the fingerprints table.
+    """
+    ACTIVATED = False
+
+
+class Checkpoints(object):
+    """
+    When activated, each departement job of a full indexing records its completion and its number of
+    indexed offices in FOLDER, for the index being built. An interrupted full indexing keeps its new index
+    and can then be resumed: departements already indexed, with the expected number of documents, are skipped.
+    """
+    ACTIVATED = False
+    FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'checkpoints')
+    # Name of the file holding the name of the index being built.
+    CURRENT_INDEX_FILENAME = 'current_index'
+
+
 @contextlib.contextmanager
-def switch_es_index() -> Generator[None, None, None]:
+def switch_es_index(new_index_name: Optional[str] = None, create: bool = True,
+                    keep_on_error: bool = False) -> Generator[None, None, None]:
     """
     Context manager that will ensure that some code will operate on a new ES
     index. This new index will then be associated to the reference alias and
@@ -63,6 +142,10 @@ def switch_es_index() -> Generator[None, None, None]:
 
         # Here, the old indexes no longer exist and the reference alias points
         # to the new index
+
+    `new_index_name` is generated when not given. With `create=False`, the new index must already exist
+    (e.g. to resume an interrupted indexing). With `keep_on_error=True`, the new index is not dropped
+    when the code fails.
     """
     # Find current index names (there may be one, zero or more)
     alias_name = settings.ES_INDEX
@@ -72,17 +155,21 @@ def switch_es_index() -> Generator[None, None, None]:
         old_index_names = []
 
     # Activate new index
-    new_index_name = es.get_new_index_name()
+    new_index_name = new_index_name or es.get_new_index_name()
     settings.ES_INDEX = new_index_name
 
     # Create new index
-    es.create_index(new_index_name)
+    if create:
+        es.create_index(new_index_name)
 
     try:
         yield
     except Exception:
-        # Delete newly created index
-        es.drop_index(new_index_name)
+        if keep_on_error:
+            logger.warning("keeping index %s, which can be resumed", new_index_name)
+        else:
+            # Delete newly created index
+            es.drop_index(new_index_name)
         raise
     finally:
         # Set back alias name
@@ -143,6 +230,130 @@ class Counter(object):
 completed_jobs_counter = Counter()
 
 
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS of the current process, which is only possible on Linux >= 4.0.
+    Returns False if it could not be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss_in_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux, and can never be reset.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class JobTelemetry(object):
+    """
+    Duration of each phase of a departement job, with its number of indexed documents
+    and the peak memory (RSS) of the process which ran it.
+
+    The peak RSS is the one of the job when it can be reset at the beginning of the job (see reset_peak_rss).
+    Otherwise it is the peak RSS of the process since it started, which may come from a previous job
+    when processes are reused (--worker-max-tasks other than 1, or no parallel computing).
+    """
+    PHASES = ('db read', 'doc build', 'bulk send')
+
+    def __init__(self, departement: str) -> None:
+        self.departement = departement
+        self.pid = os.getpid()
+        self.doc_count = 0
+        self.duration = 0.0
+        self.durations = dict.fromkeys(self.PHASES, 0.0)
+        self.peak_rss_mb = 0.0
+        self.peak_rss_is_per_job = reset_peak_rss()
+        self._start = time.time()
+        # Time spent in each timed iterable, including time spent in the iterables it consumes.
+        self._inclusive_durations = dict.fromkeys(self.PHASES, 0.0)
+
+    def timed(self, iterable: Iterable[Any], phase: str) -> Generator[Any, None, None]:
+        """
+        Yield the items of `iterable`, measuring the time spent to get them.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._inclusive_durations[phase] += time.time() - start
+            yield item
+
+    def stop(self, doc_count: int, nested_reads: bool = False) -> None:
+        """
+        `nested_reads` tells whether offices are read from the DB while documents are built (streaming),
+        i.e. whether the timed doc build includes the timed db read.
+        """
+        self.doc_count = doc_count
+        self.duration = time.time() - self._start
+        db_read = self._inclusive_durations['db read']
+        doc_build = self._inclusive_durations['doc build']
+        self.durations['db read'] = db_read
+        if nested_reads:
+            # Documents are built from the offices read from the DB, and sent while they are built.
+            self.durations['doc build'] = doc_build - db_read
+            self.durations['bulk send'] = self.duration - doc_build
+        else:
+            self.durations['doc build'] = doc_build
+            self.durations['bulk send'] = self.duration - doc_build - db_read
+        self.peak_rss_mb = get_peak_rss_in_mb()
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.doc_count / max(self.duration, 1e-6)
+
+    def log(self) -> None:
+        logger.info(
+            "[DPT%s] %s docs in %.1fs (%.0f docs/s): %s, peak RSS %.0fMB%s (pid %s)",
+            self.departement,
+            self.doc_count,
+            self.duration,
+            self.docs_per_second,
+            ", ".join("%s %.1fs" % (phase, duration) for phase, duration in self.durations.items()),
+            self.peak_rss_mb,
+            "" if self.peak_rss_is_per_job else " since process start",
+            self.pid,
+        )
+
+
+def log_telemetry_summary(telemetries: List[JobTelemetry], duration: float) -> None:
+    if not telemetries:
+        return
+    doc_count = sum(telemetry.doc_count for telemetry in telemetries)
+    logger.info(
+        "indexed %s docs of %s departements in %.1fs (%.0f docs/s) with %s processes",
+        doc_count,
+        len(telemetries),
+        duration,
+        doc_count / max(duration, 1e-6),
+        len({telemetry.pid for telemetry in telemetries}),
+    )
+    logger.info(
+        "time spent by all jobs: %s",
+        ", ".join("%s %.1fs" % (phase, sum(telemetry.durations[phase] for telemetry in telemetries))
+                  for phase in JobTelemetry.PHASES),
+    )
+    largest = max(telemetries, key=lambda telemetry: telemetry.peak_rss_mb)
+    logger.info("largest peak RSS: %.0fMB (departement %s)", largest.peak_rss_mb, largest.departement)
+    for telemetry in sorted(telemetries, key=lambda telemetry: telemetry.duration, reverse=True)[:5]:
+        logger.info("slowest departements: %s in %.1fs (%s docs, %.0f docs/s)", telemetry.departement,
+                    telemetry.duration, telemetry.doc_count, telemetry.docs_per_second)
+
+
 class StatTracker:
 
     def __init__(self) -> None:
@@ -167,19 +378,160 @@ class StatTracker:
 st = StatTracker()
 
 
-def bulk_actions(actions: List[Dict[str, Any]]) -> None:
+def bulk_actions(actions: Iterable[Dict[str, Any]]) -> None:
+    """
+    `actions` may be a generator: the bulk helper then only holds one chunk of actions in memory at a time.
+    """
+    if ParallelBulk.ACTIVATED:
+        parallel_bulk_actions(actions)
+        return
     # unfortunately parallel_bulk is not available in the current elasticsearch version
     # http://elasticsearch-py.readthedocs.io/en/master/helpers.html
-    logger.info("started bulk of %s actions...", len(actions))
+    if isinstance(actions, list):
+        logger.info("started bulk of %s actions...", len(actions))
+    else:
+        logger.info("started bulk of streamed actions...")
+    # each parallel job needs to use its own ES connection for maximum performance
+    success_count, _ = bulk(es.new_elasticsearch_instance(), actions, chunk_size=ES_BULK_CHUNK_SIZE)
+    logger.info("completed bulk of %s actions!", success_count)
+
+
+def chunk_bulk_actions(actions: Iterable[Dict[str, Any]], serializer: Any, chunk_size: int,
+                       max_chunk_bytes: int) -> Generator[List[Tuple[str, Optional[str]]], None, None]:
+    """
+    Serialize actions as (action line, data line) tuples and group them in chunks
+    of at most `chunk_size` actions and `max_chunk_bytes` bytes.
+    """
+    chunk: List[Tuple[str, Optional[str]]] = []
+    chunk_bytes = 0
+    for action in actions:
+        action_line, data = expand_action(action)
+        action_line = serializer.dumps(action_line)
+        data_line = serializer.dumps(data) if data is not None else None
+        action_bytes = len(action_line) + 1 + (len(data_line) + 1 if data_line is not None else 0)
+        if chunk and (len(chunk) == chunk_size or chunk_bytes + action_bytes > max_chunk_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append((action_line, data_line))
+        chunk_bytes += action_bytes
+    if chunk:
+        yield chunk
+
+
+def is_rejected_bulk_item(item: Dict[str, Any]) -> bool:
+    """
+    True if ES refused to process this bulk item because its queues were full: it may be retried.
+    """
+    return item.get('status') == HTTP_TOO_MANY_REQUESTS or 'EsRejectedExecutionException' in str(item.get('error', ''))
+
+
+def send_bulk_chunk(client: Any, chunk: List[Tuple[str, Optional[str]]],
+                    max_retries: int = ES_BULK_MAX_RETRIES) -> Tuple[int, List[Dict[str, Any]], int]:
+    """
+    Send a chunk of serialized actions, retrying the actions rejected by ES with an exponential backoff.
+    Returns a (success count, failed items, bytes sent) tuple.
+    """
+    success_count = bytes_sent = 0
+    errors: List[Dict[str, Any]] = []
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(ES_BULK_RETRY_DELAY_IN_SECONDS * 2**(attempt - 1))
+        body = '\n'.join(line for lines in chunk for line in lines if line is not None) + '\n'
+        try:
+            response = client.bulk(body=body)
+        except TransportError as e:
+            if e.status_code == HTTP_TOO_MANY_REQUESTS and attempt < max_retries:
+                logger.warning("bulk chunk of %s actions rejected by ES, retrying...", len(chunk))
+                continue
+            raise
+        bytes_sent += len(body)
+
+        rejected = []
+        for lines, result in zip(chunk, response['items']):
+            _, item = result.popitem()
+            if 200 <= item.get('status', 500) < 300:
+                success_count += 1
+            elif is_rejected_bulk_item(item) and attempt < max_retries:
+                rejected.append(lines)
+            else:
+                errors.append(item)
+                logger.error("bulk action failed: %s", item)
+        if not rejected:
+            break
+        logger.warning("%s bulk actions rejected by ES, retrying...", len(rejected))
+        chunk = rejected
+    return success_count, errors, bytes_sent
+
+
+def parallel_bulk_actions(actions: Iterable[Dict[str, Any]],
+                          thread_count: Optional[int] = None,
+                          chunk_size: Optional[int] = None,
+                          max_chunk_bytes: Optional[int] = None,
+                          max_pending_chunks: Optional[int] = None) -> int:
+    """
+    Same as the sequential bulk of `bulk_actions`, with chunks sent by a pool of threads.
+    Parameters default to the ParallelBulk settings. Returns the number of successful actions.
+
+    Like the bulk helper, raise a BulkIndexError once all chunks are sent if some actions failed,
+    so that an incomplete index is never switched to.
+    """
+    thread_count = thread_count or ParallelBulk.THREAD_COUNT
+    chunk_size = chunk_size or ParallelBulk.CHUNK_SIZE
+    max_chunk_bytes = max_chunk_bytes or ParallelBulk.MAX_CHUNK_BYTES
+    max_pending_chunks = max_pending_chunks or ParallelBulk.MAX_PENDING_CHUNKS
+
+    logger.info("started parallel bulk with %s threads...", thread_count)
+    start = time.time()
     # each parallel job needs to use its own ES connection for maximum performance
-    bulk(es.new_elasticsearch_instance(), actions, chunk_size=ES_BULK_CHUNK_SIZE)
-    logger.info("completed bulk of %s actions!", len(actions))
+    client = es.new_elasticsearch_instance()
+    # Chunks being sent or waiting for a thread.
+    in_flight = threading.BoundedSemaphore(thread_count + max_pending_chunks)
+    success_count = bytes_sent = 0
+    errors: List[Dict[str, Any]] = []
+
+    def send(chunk):
+        try:
+            return send_bulk_chunk(client, chunk)
+        finally:
+            in_flight.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for chunk in chunk_bulk_actions(actions, client.transport.serializer, chunk_size, max_chunk_bytes):
+            in_flight.acquire()
+            futures.append(executor.submit(send, chunk))
+            # Collect the results of the chunks already sent, so that they can be garbage collected.
+            while futures and futures[0].done():
+                chunk_success, chunk_errors, chunk_bytes = futures.pop(0).result()
+                success_count += chunk_success
+                errors.extend(chunk_errors)
+                bytes_sent += chunk_bytes
+        for future in futures:
+            chunk_success, chunk_errors, chunk_bytes = future.result()
+            success_count += chunk_success
+            errors.extend(chunk_errors)
+            bytes_sent += chunk_bytes
+
+    duration = max(time.time() - start, 1e-6)
+    logger.info(
+        "completed parallel bulk of %s actions (%s errors) in %.1fs: %.0f docs/s, %.2f MB/s",
+        success_count,
+        len(errors),
+        duration,
+        success_count / duration,
+        bytes_sent / duration / 1024 / 1024,
+    )
+    if errors:
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+    return success_count
 
 
 @timeit
 def create_job_codes() -> None:
     """
     Create the `ogr` type in ElasticSearch.
+    Documents are identified by their OGR code, so that running it again on the same index, e.g. when
+    a full indexing is resumed, overwrites them instead of adding duplicates.
     """
     logger.info("create job codes...")
     # libelles des appelations pour les codes ROME
@@ -198,7 +550,13 @@ def create_job_codes() -> None:
                 'rome_code': rome_code,
                 'rome_description': rome_description
             }
-            action = {'_op_type': 'index', '_index': settings.ES_INDEX, '_type': es.OGR_TYPE, '_source': doc}
+            action = {
+                '_op_type': 'index',
+                '_index': settings.ES_INDEX,
+                '_type': es.OGR_TYPE,
+                '_id': ogr,
+                '_source': doc,
+            }
             actions.append(action)
     bulk_actions(actions)
 
@@ -207,6 +565,7 @@ def create_job_codes() -> None:
 def create_locations() -> None:
     """
     Create the `location` type in ElasticSearch.
+    Documents are identified by their commune id, so that running it again on the same index overwrites them.
     """
     actions = []
     for city in geocoding.get_cities():
@@ -220,7 +579,13 @@ def create_locations() -> None:
             'slug': city['slug'],
             'zipcode': city['zipcode'],
         }
-        action = {'_op_type': 'index', '_index': settings.ES_INDEX, '_type': es.LOCATION_TYPE, '_source': doc}
+        action = {
+            '_op_type': 'index',
+            '_index': settings.ES_INDEX,
+            '_type': es.LOCATION_TYPE,
+            '_id': city['commune_id'],
+            '_source': doc,
+        }
         actions.append(action)
 
     bulk_actions(actions)
@@ -279,7 +644,7 @@ def get_office_as_es_doc(
 
     scores_by_rome, boosted_romes = get_scores_by_rome_and_boosted_romes(office)
     if scores_by_rome:
-        doc['scores_by_rome'] = scores_by_rome
+        doc.update(es.encode_scores('scores_by_rome', scores_by_rome))
         doc['boosted_romes'] = boosted_romes
 
     return doc
@@ -308,12 +673,15 @@ def get_scores_by_rome_and_boosted_romes(
     else:
         office_to_remove_pse = False
 
+    rome_naf_matrix = scoring_util.get_rome_naf_matrix()
+
     for naf in office_nafs:
-        try:
-            naf_rome_codes = mapping_util.get_romes_for_naf(naf)
-        except KeyError:
+        # scores adjusted to all the ROME codes of this NAF at once
+        naf_scores_by_rome = rome_naf_matrix.get_scores_for_naf(naf, office.hiring)
+        if not naf_scores_by_rome:
             # unfortunately some NAF codes have no matching ROME at all
             continue
+        naf_rome_codes = list(naf_scores_by_rome)
 
         # 1- DPAE
 
@@ -337,9 +705,13 @@ def get_scores_by_rome_and_boosted_romes(
                     boosted_romes[rome_code] = True
 
             # Scoring part
-            score_dpae = scoring_util.get_score_adjusted_to_rome_code_and_naf_code(hiring=office.hiring,
-                                                                                   rome_code=rome_code,
-                                                                                   naf_code=naf)
+            if rome_code in naf_scores_by_rome:
+                score_dpae = naf_scores_by_rome[rome_code]
+            else:
+                # boosted ROME unrelated to this NAF: fallback to the main score
+                score_dpae = scoring_util.get_score_adjusted_to_rome_code_and_naf_code(hiring=office.hiring,
+                                                                                       rome_code=rome_code,
+                                                                                       naf_code=naf)
 
             # Get the score minimum for a rome code with metiers en tension
             score_minimum_for_rome = scoring_util.get_score_minimum_for_rome(rome_code)
@@ -372,60 +744,225 @@ def create_offices(disable_parallel_computing: bool = False) -> None:
     else:
         func = create_offices_for_departement
 
+    departements = dpt.DEPARTEMENTS
+    if Checkpoints.ACTIVATED:
+        departements = get_departements_to_index(settings.ES_INDEX)
+
+    start = time.time()
     if disable_parallel_computing:
-        for departement in dpt.DEPARTEMENTS:
-            func(departement)
+        telemetries = [func(departement) for departement in departements]
     else:
         # Use parallel computing on all available CPU cores.
         # Use even slightly more than avaible CPUs because in practise a job does not always
         # use 100% of a cpu.
         # maxtasksperchild default is infinite, which means memory is never freed up, and grows indefinitely :-/
         # maxtasksperchild=1 ensures memory is freed up after every departement computation.
-        pool = mp.Pool(processes=int(1.25 * mp.cpu_count()), maxtasksperchild=1)
-        pool.map(func, dpt.DEPARTEMENTS)
+        pool = mp.Pool(processes=Workers.PROCESSES or int(1.25 * mp.cpu_count()),
+                       maxtasksperchild=Workers.MAX_TASKS_PER_CHILD)
+        telemetries = pool.map(func, departements)
         pool.close()
         pool.join()
 
+    # Profiled jobs do not return their telemetry.
+    log_telemetry_summary([telemetry for telemetry in telemetries if telemetry], time.time() - start)
 
-@timeit
-def create_offices_for_departement(departement: str) -> None:
+
+def get_checkpoints_folder(index_name: str) -> str:
+    return os.path.join(Checkpoints.FOLDER, index_name)
+
+
+def write_checkpoint_file(path: str, content: str) -> None:
     """
-    Populate the `office` type in ElasticSearch with offices having given departement.
+    Write the file atomically, so that a crash never leaves a truncated checkpoint.
     """
-    actions = []
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def start_checkpoints(index_name: str) -> None:
+    """
+    Record that the given index is being built, so that it can be resumed.
+    """
+    write_checkpoint_file(os.path.join(Checkpoints.FOLDER, Checkpoints.CURRENT_INDEX_FILENAME), index_name)
+
+
+def save_checkpoint(index_name: str, departement: str, doc_count: int) -> None:
+    checkpoint = {
+        'departement': departement,
+        'doc_count': doc_count,
+        'completed_at': datetime.datetime.now().isoformat(),
+    }
+    write_checkpoint_file(os.path.join(get_checkpoints_folder(index_name), '%s.json' % departement),
+                          json.dumps(checkpoint))
+
+
+def load_checkpoints(index_name: str) -> Dict[str, int]:
+    """
+    Return the number of indexed offices of each completed departement of the given index.
+    """
+    doc_counts: Dict[str, int] = {}
+    for path in glob.glob(os.path.join(get_checkpoints_folder(index_name), '*.json')):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        doc_counts[checkpoint['departement']] = checkpoint['doc_count']
+    return doc_counts
+
+
+def get_resumable_index_name() -> Optional[str]:
+    """
+    Return the name of the index of an interrupted full indexing, if it still exists.
+    """
+    path = os.path.join(Checkpoints.FOLDER, Checkpoints.CURRENT_INDEX_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index_name = f.read().strip()
+    if not index_name or not es.Elasticsearch().indices.exists(index=index_name):
+        logger.warning("index %s of the interrupted indexing does not exist anymore", index_name)
+        return None
+    return index_name
+
+
+def clear_checkpoints(index_name: str) -> None:
+    shutil.rmtree(get_checkpoints_folder(index_name), ignore_errors=True)
+    path = os.path.join(Checkpoints.FOLDER, Checkpoints.CURRENT_INDEX_FILENAME)
+    if os.path.exists(path):
+        os.remove(path)
 
-    logger.info("STARTED indexing offices for departement=%s ...", departement)
 
+def get_departements_to_index(index_name: str) -> List[str]:
+    """
+    Return the departements which are not completed yet in the given index. The offices of a completed
+    departement are counted in the index: it is indexed again if this count does not match its checkpoint.
+    """
+    doc_counts = load_checkpoints(index_name)
+    if doc_counts:
+        es.Elasticsearch().indices.refresh(index=index_name)
+
+    departements = []
+    for departement in dpt.DEPARTEMENTS:
+        if departement not in doc_counts:
+            departements.append(departement)
+            continue
+        indexed_count = es.Elasticsearch().count(
+            index=index_name,
+            doc_type=es.OFFICE_TYPE,
+            body={'query': {'term': {'department': departement}}},
+        )['count']
+        if indexed_count == doc_counts[departement]:
+            logger.info("[DPT%s] skipped: %s offices already indexed", departement, indexed_count)
+        else:
+            logger.warning("[DPT%s] %s offices indexed instead of %s: indexing it again", departement,
+                           indexed_count, doc_counts[departement])
+            departements.append(departement)
+    return departements
+
+
+def iter_offices_by_window(query: 'sa.orm.query.Query[Office]',
+                           window_size: int = OFFICE_WINDOW_SIZE) -> Generator[Office, None, None]:
+    """
+    Iterate over the offices of `query` by windows of `window_size` offices, using the siret
+    (primary key) as a keyset: unlike LIMIT/OFFSET, each window query costs the same.
+    Offices of a window are detached from the session once the next window is requested,
+    so that they can be garbage collected.
+    """
+    last_siret = None
+    while True:
+        window_query = query if last_siret is None else query.filter(Office.siret > last_siret)
+        offices = window_query.order_by(Office.siret).limit(window_size).all()
+        if not offices:
+            break
+        last_siret = offices[-1].siret
+        yield from offices
+        for office in offices:
+            db_session.expunge(office)
+
+
+def get_es_doc_fingerprint(doc: Dict[str, Any]) -> str:
+    """
+    Hash of an ES document: offices having the same fingerprint have the same ES document.
+    """
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def is_es_doc_reachable(es_doc: Dict[str, Any]) -> bool:
+    """
+    Offices are only indexed when they can be found by a search, i.e. when they have scores for some ROME.
+    """
+    return ('scores_by_rome' in es_doc) or ('scores_alternance_by_rome' in es_doc)
+
+
+def get_office_actions(offices: Iterable[Office],
+                       fingerprints: Optional[Dict[str, str]] = None) -> Generator[Dict[str, Any], None, None]:
+    """
+    Generate the ES bulk actions indexing the reachable offices among `offices`.
+    If given, `fingerprints` is filled with the fingerprint of the document of each reachable office.
+    """
+    for office in offices:
+        st.increment_office_count()
+
+        es_doc = get_office_as_es_doc(office)
+
+        if is_es_doc_reachable(es_doc):
+            st.increment_indexed_office_count()
+            if fingerprints is not None:
+                fingerprints[office.siret] = get_es_doc_fingerprint(es_doc)
+            yield {
+                '_op_type': 'index',
+                '_index': settings.ES_INDEX,
+                '_type': es.OFFICE_TYPE,
+                '_id': office.siret,
+                '_source': es_doc,
+            }
+
+
+def get_offices_to_index_query(departement: str) -> 'sa.orm.query.Query[Office]':
     # For LBB we apply two thresholds to show an office:
     # 1) its global all-rome-included score should be at least SCORE_REDUCING_MINIMUM_THRESHOLD
     # 2) its score adapted to requested rome should be at least SCORE_FOR_ROME_MINIMUM
     # For LBA we only apply the second threshold (SCORE_ALTERNANCE_FOR_ROME_MINIMUM)
     # and no longer apply the all-rome-included score threshold, in order to include
     # more relevant smaller companies.
-    all_offices = db_session.query(Office).filter(
+    return db_session.query(Office).filter(
         and_(
             Office.departement == departement,
             Office.hiring >= scoring_util.get_hirings_from_score(settings.SCORE_REDUCING_MINIMUM_THRESHOLD),
-        )).all()
-    logger.info(f"[DPT{departement}] FOUND {len(all_offices)} offices! ")
-    for office in all_offices:
-        st.increment_office_count()
+        ))
 
-        es_doc = get_office_as_es_doc(office)
 
-        office_is_reachable = ('scores_by_rome' in es_doc) or ('scores_alternance_by_rome' in es_doc)
+@timeit
+def create_offices_for_departement(departement: str) -> JobTelemetry:
+    """
+    Populate the `office` type in ElasticSearch with offices having given departement.
+    """
+    logger.info("STARTED indexing offices for departement=%s ...", departement)
+
+    telemetry = JobTelemetry(departement)
+    query = get_offices_to_index_query(departement)
+    fingerprints: Optional[Dict[str, str]] = {} if Fingerprints.ACTIVATED else None
+    indexed_office_count_before = st.indexed_office_count
 
-        if office_is_reachable:
-            st.increment_indexed_office_count()
-            actions.append({
-                '_op_type': 'index',
-                '_index': settings.ES_INDEX,
-                '_type': es.OFFICE_TYPE,
-                '_id': office.siret,
-                '_source': es_doc,
-            })
+    if Streaming.ACTIVATED:
+        office_count_before = st.office_count
+        offices = telemetry.timed(iter_offices_by_window(query, Streaming.WINDOW_SIZE), 'db read')
+        bulk_actions(telemetry.timed(get_office_actions(offices, fingerprints), 'doc build'))
+        logger.info(f"[DPT{departement}] FOUND {st.office_count - office_count_before} offices! ")
+    else:
+        all_offices = list(telemetry.timed(query, 'db read'))
+        logger.info(f"[DPT{departement}] FOUND {len(all_offices)} offices! ")
+        bulk_actions(list(telemetry.timed(get_office_actions(all_offices, fingerprints), 'doc build')))
 
-    bulk_actions(actions)
+    doc_count = st.indexed_office_count - indexed_office_count_before
+    telemetry.stop(doc_count, nested_reads=Streaming.ACTIVATED)
+
+    if fingerprints is not None:
+        save_fingerprints(departement, fingerprints)
+
+    if Checkpoints.ACTIVATED:
+        save_checkpoint(settings.ES_INDEX, departement, doc_count)
 
     completed_jobs_counter.increment()
 
@@ -437,6 +974,145 @@ def create_offices_for_departement(departement: str) -> None:
     )
 
     display_performance_stats(departement)
+    telemetry.log()
+
+    return telemetry
+
+
+def reset_fingerprints() -> None:
+    """
+    Forget all office fingerprints: they must describe the live index, and this index is about to be replaced.
+    """
+    OfficeFingerprint.query.delete()
+    db_session.commit()
+
+
+def save_fingerprints(departement: str, fingerprints: Dict[str, str], removed_sirets: Iterable[str] = ()) -> None:
+    """
+    Save the fingerprints of the given offices of a departement, and delete those of `removed_sirets`.
+    """
+    sirets = list(fingerprints.keys()) + list(removed_sirets)
+    # Offices may have moved from another departement: their previous fingerprint is stored with it.
+    for sirets_chunk in chunks(sirets, OFFICE_SIRET_CHUNK_SIZE):
+        OfficeFingerprint.query.filter(OfficeFingerprint.siret.in_(sirets_chunk)).delete(synchronize_session=False)
+    db_session.bulk_insert_mappings(OfficeFingerprint, [
+        {'siret': siret, 'departement': departement, 'fingerprint': fingerprint}
+        for siret, fingerprint in fingerprints.items()
+    ])
+    db_session.commit()
+
+
+def get_removed_office_sirets(departement: str, sirets: Iterable[str]) -> List[str]:
+    """
+    Among `sirets`, previously indexed as offices of `departement` but not anymore, return those which
+    should be removed from ES. Offices which moved to another departement, where they are still indexed,
+    are left to the job of this other departement.
+    """
+    sirets = set(sirets)
+    hiring_threshold = scoring_util.get_hirings_from_score(settings.SCORE_REDUCING_MINIMUM_THRESHOLD)
+    for sirets_chunk in chunks(list(sirets), OFFICE_SIRET_CHUNK_SIZE):
+        moved_offices = Office.query.filter(
+            Office.siret.in_(sirets_chunk),
+            Office.departement != departement,
+            Office.hiring >= hiring_threshold,
+        )
+        for office in moved_offices:
+            if is_es_doc_reachable(get_office_as_es_doc(office)):
+                sirets.discard(office.siret)
+    return sorted(sirets)
+
+
+def get_office_delta_actions(offices: Iterable[Office], departement: str, previous_fingerprints: Dict[str, str],
+                             fingerprints: Dict[str, str],
+                             removed_sirets: List[str]) -> Generator[Dict[str, Any], None, None]:
+    """
+    Generate the ES bulk actions indexing the offices whose document changed since their fingerprint was saved,
+    then the actions deleting the offices which are not indexed anymore. `fingerprints` is filled with the
+    fingerprints of all reachable offices and `removed_sirets` with the sirets of the deleted offices.
+    """
+    for action in get_office_actions(offices, fingerprints):
+        if previous_fingerprints.get(action['_id']) != fingerprints[action['_id']]:
+            yield action
+
+    removed_sirets += get_removed_office_sirets(departement, previous_fingerprints.keys() - fingerprints.keys())
+    for siret in removed_sirets:
+        yield {
+            '_op_type': 'delete',
+            '_index': settings.ES_INDEX,
+            '_type': es.OFFICE_TYPE,
+            '_id': siret,
+        }
+
+
+@timeit
+def update_offices_delta_for_departement(departement: str) -> None:
+    """
+    Update the live ES index with the offices of the given departement which changed since they were indexed.
+    """
+    logger.info("STARTED delta indexing offices for departement=%s ...", departement)
+
+    previous_fingerprints: Dict[str, str] = dict(
+        db_session.query(OfficeFingerprint.siret, OfficeFingerprint.fingerprint).filter(
+            OfficeFingerprint.departement == departement))
+    fingerprints: Dict[str, str] = {}
+    removed_sirets: List[str] = []
+    offices = iter_offices_by_window(get_offices_to_index_query(departement), Streaming.WINDOW_SIZE)
+    actions = get_office_delta_actions(offices, departement, previous_fingerprints, fingerprints, removed_sirets)
+
+    # each parallel job needs to use its own ES connection for maximum performance
+    success_count, errors = bulk(es.new_elasticsearch_instance(), actions, chunk_size=ES_BULK_CHUNK_SIZE,
+                                 raise_on_error=False)
+
+    for error in errors:
+        op_type, item = error.popitem()
+        if op_type == 'delete' and item.get('status') == 404:
+            # Already removed, e.g. by remove_offices().
+            continue
+        logger.error("[DPT%s] delta indexing of office %s failed: %s", departement, item.get('_id'), item)
+        # Keep the previous fingerprint, so that the office is processed again by the next run.
+        siret = item.get('_id')
+        if siret in removed_sirets:
+            removed_sirets.remove(siret)
+        if siret in previous_fingerprints:
+            fingerprints[siret] = previous_fingerprints[siret]
+        else:
+            fingerprints.pop(siret, None)
+
+    changed_fingerprints = {
+        siret: fingerprint
+        for siret, fingerprint in fingerprints.items() if previous_fingerprints.get(siret) != fingerprint
+    }
+    save_fingerprints(departement, changed_fingerprints, removed_sirets)
+
+    completed_jobs_counter.increment()
+    logger.info(
+        "COMPLETED delta indexing offices for departement=%s: %s changes applied to %s offices"
+        " (%s of %s jobs completed)",
+        departement,
+        success_count,
+        len(fingerprints),
+        completed_jobs_counter.value,
+        len(dpt.DEPARTEMENTS),
+    )
+
+
+def update_offices_delta(disable_parallel_computing: bool = False) -> None:
+    """
+    Index in the live ES index only the offices whose document changed since the last indexing.
+    """
+    if not OfficeFingerprint.query.first():
+        raise ValueError("No office fingerprint found: the delta mode requires a full indexing (-f) run with"
+                         " --fingerprints first.")
+
+    if disable_parallel_computing:
+        for departement in dpt.DEPARTEMENTS:
+            update_offices_delta_for_departement(departement)
+    else:
+        pool = mp.Pool(processes=Workers.PROCESSES or int(1.25 * mp.cpu_count()),
+                       maxtasksperchild=Workers.MAX_TASKS_PER_CHILD)
+        pool.map(update_offices_delta_for_departement, dpt.DEPARTEMENTS)
+        pool.close()
+        pool.join()
 
 
 def profile_create_offices_for_departement(departement: str) -> None:
@@ -451,17 +1127,15 @@ def profile_create_offices_for_departement(departement: str) -> None:
     convert(profiler.getstats(), filename)  # type: ignore
 
 
-def add_individual_inexistant_office(office_to_add: OfficeAdminAdd) -> None:
+def get_office_from_office_admin_add(office_to_add: OfficeAdminAdd) -> Office:
     """
-    Add office in ElasticSearch and MySQL DB. Do not call this function
-    directly, use add_individual_office() instead.
+    Return a new `Office` (not added to the DB session) with the fields of the given `OfficeAdminAdd`.
     """
     # The `headcount` field of an `OfficeAdminAdd` instance has a `code` attribute.
     if hasattr(office_to_add.headcount, 'code'):
         headcount = office_to_add.headcount.code  # type: ignore
     else:
         headcount = office_to_add.headcount
-    # Create the new office in DB.
     new_office = Office()
     # Use `inspect` because `Office` columns are named distinctly from attributes.
     for field_name in list(inspect(Office).columns.keys()):
@@ -473,7 +1147,16 @@ def add_individual_inexistant_office(office_to_add: OfficeAdminAdd) -> None:
         if field_name == 'headcount':
             value = headcount
         setattr(new_office, field_name, value)
-    db_session.add(new_office)
+    return new_office
+
+
+def add_individual_inexistant_office(office_to_add: OfficeAdminAdd) -> None:
+    """
+    Add office in ElasticSearch and MySQL DB. Do not call this function
+    directly, use add_individual_office() instead.
+    """
+    # Create the new office in DB.
+    db_session.add(get_office_from_office_admin_add(office_to_add))
     db_session.commit()
 
     # Create the new office in ES.
@@ -495,14 +1178,74 @@ def add_individual_office(office_to_add: OfficeAdminAdd) -> None:
         logger.debug(f"Office with siret {office_to_add.siret} already exists, skip adding")
 
 
+def add_offices_by_office_admin_adds(offices_to_add: Iterable[OfficeAdminAdd]) -> Dict[str, Any]:
+    """
+    Add the given offices which do not exist yet: they are inserted in the DB with a single commit,
+    and their documents are created in ES with a single bulk request.
+
+    Return the added sirets, the skipped ones (already existing) and a {siret: error} dict of failures.
+    """
+    offices_to_add_by_siret: Dict[str, OfficeAdminAdd] = {}
+    for office_to_add in offices_to_add:
+        # Only the first one is added, the next ones would find an existing office.
+        offices_to_add_by_siret.setdefault(office_to_add.siret, office_to_add)
+    sirets = list(offices_to_add_by_siret)
+
+    # Only create a new office if it does not already exist.
+    # This guarantees that the importer data will always have precedence.
+    existing_sirets = set()
+    for sirets_chunk in chunks(sirets, OFFICE_SIRET_CHUNK_SIZE):
+        query = db_session.query(Office.siret).filter(Office.siret.in_(sirets_chunk))
+        existing_sirets.update(siret for (siret,) in query)
+    new_sirets = [siret for siret in sirets if siret not in existing_sirets]
+
+    # Create the new offices in DB.
+    failures: Dict[str, str] = {}
+    db_session.add_all([get_office_from_office_admin_add(offices_to_add_by_siret[siret]) for siret in new_sirets])
+    try:
+        db_session.commit()
+    except sa.exc.SQLAlchemyError:
+        # Find out which offices cannot be inserted.
+        db_session.rollback()
+        for siret in new_sirets:
+            db_session.add(get_office_from_office_admin_add(offices_to_add_by_siret[siret]))
+            try:
+                db_session.commit()
+            except sa.exc.SQLAlchemyError as e:
+                db_session.rollback()
+                logger.error("insertion of office %s failed in DB: %s", siret, e)
+                failures[siret] = str(e)
+
+    # Create the new offices in ES.
+    actions = ({
+        '_op_type': 'create',
+        '_index': settings.ES_INDEX,
+        '_type': es.OFFICE_TYPE,
+        '_id': siret,
+        '_source': get_office_as_es_doc(offices_to_add_by_siret[siret]),
+    } for siret in new_sirets if siret not in failures)
+    _, errors = bulk(es.Elasticsearch(), actions, chunk_size=ES_BULK_CHUNK_SIZE, raise_on_error=False)
+    for error in errors:
+        _, item = error.popitem()
+        logger.error("creation of office %s failed in ES: %s", item.get('_id'), item)
+        failures[item.get('_id')] = str(item.get('error'))
+
+    summary = {
+        'added': [siret for siret in new_sirets if siret not in failures],
+        'skipped': [siret for siret in sirets if siret in existing_sirets],
+        'failed': failures,
+    }
+    logger.info("added %s offices: %s added, %s skipped, %s failed", len(sirets), len(summary['added']),
+                len(summary['skipped']), len(failures))
+    return summary
+
+
 @timeit
-def add_offices() -> None:
+def add_offices() -> Dict[str, Any]:
     """
     Add offices (complete the data provided by the importer).
     """
-    office_to_add: OfficeAdminAdd
-    for office_to_add in db_session.query(OfficeAdminAdd).all():
-        add_individual_office(office_to_add)
+    return add_offices_by_office_admin_adds(db_session.query(OfficeAdminAdd).all())
 
 
 def remove_individual_office(siret: str) -> None:
@@ -520,8 +1263,59 @@ def remove_individual_office(siret: str) -> None:
         pdf_util.delete_file(office)
 
 
+def remove_offices_by_sirets(sirets: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Remove offices from ES with bulk delete actions, then from the DB with chunked DELETE queries.
+
+    Return the removed sirets, the missing ones (neither in ES nor in the DB) and the failed ones.
+    Offices which could not be removed from ES are kept in the DB, as remove_individual_office does.
+    """
+    sirets = list(dict.fromkeys(sirets))
+
+    actions = ({
+        '_op_type': 'delete',
+        '_index': settings.ES_INDEX,
+        '_type': es.OFFICE_TYPE,
+        '_id': siret,
+    } for siret in sirets)
+    _, errors = bulk(es.Elasticsearch(), actions, chunk_size=ES_BULK_CHUNK_SIZE, raise_on_error=False)
+    missing_in_es_sirets = set()
+    failed_sirets = set()
+    for error in errors:
+        _, item = error.popitem()
+        if item.get('status') == 404:
+            missing_in_es_sirets.add(item.get('_id'))
+        else:
+            logger.error("removal of office %s failed in ES: %s", item.get('_id'), item)
+            failed_sirets.add(item.get('_id'))
+
+    removed_in_db_sirets = set()
+    for sirets_chunk in chunks([siret for siret in sirets if siret not in failed_sirets], OFFICE_SIRET_CHUNK_SIZE):
+        offices = Office.query.filter(Office.siret.in_(sirets_chunk)).all()
+        if not offices:
+            continue
+        Office.query.filter(Office.siret.in_([office.siret for office in offices])).delete(synchronize_session=False)
+        db_session.commit()
+        for office in offices:
+            # Delete the current PDF.
+            pdf_util.delete_file(office)
+            removed_in_db_sirets.add(office.siret)
+
+    summary = {
+        'removed': [
+            siret for siret in sirets
+            if siret not in failed_sirets and (siret not in missing_in_es_sirets or siret in removed_in_db_sirets)
+        ],
+        'missing': [siret for siret in sirets if siret in missing_in_es_sirets and siret not in removed_in_db_sirets],
+        'failed': [siret for siret in sirets if siret in failed_sirets],
+    }
+    logger.info("removed %s offices: %s removed, %s missing, %s failed", len(sirets), len(summary['removed']),
+                len(summary['missing']), len(summary['failed']))
+    return summary
+
+
 @timeit
-def remove_offices() -> None:
+def remove_offices() -> Dict[str, List[str]]:
     """
     Remove offices (overload the data provided by the importer).
     """
@@ -529,8 +1323,7 @@ def remove_offices() -> None:
     # We need to unpack them explicitly.
     offices_to_remove = [siret for (siret,) in db_session.query(OfficeAdminRemove.siret).all()]
 
-    for siret in offices_to_remove:
-        remove_individual_office(siret)
+    return remove_offices_by_sirets(offices_to_remove)
 
 
 LIMIT = 100
@@ -560,115 +1353,190 @@ def to_iterator(
         firstid = key.__get__(rec, key) if rec else None
 
 
-def update_offices_by_sirets(sirets: list, office_to_update: Union[Type[OfficeAdminUpdate],
-                                                                   Type[OfficeThirdPartyUpdate]]) -> None:
+OfficeUpdateType = Union[OfficeAdminUpdate, OfficeThirdPartyUpdate]
+
+
+def apply_office_update(office: Office, office_to_update: OfficeUpdateType) -> bool:
     """
-    Update offices after office admin update
-    (overload the data provided by the importer).
+    Apply an office admin update to an office, in the DB session only (nothing is committed).
+    Return True if the office was changed.
     """
+    is_updated = False
+    # Apply changes in DB.
+    # , "email", "tel", "website"
+    if office_to_update.new_company_name and office.company_name != office_to_update.new_company_name:
+        office.company_name = office_to_update.new_company_name
+        is_updated = True
+    if office_to_update.new_office_name and office.office_name != office_to_update.new_office_name:
+        office.office_name = office_to_update.new_office_name
+        is_updated = True
+    offices_attributes = [
+        "email_alternance", "phone_alternance", "website_alternance", "hiring", "score_alternance",
+        "social_network", "contact_mode"
+    ]
+    update_attributes = [
+        "email_alternance", "phone_alternance", "website_alternance", "hiring", "score_alternance",
+        "social_network", "contact_mode"
+    ]
+    for office_attr, update_attr in list(zip(offices_attributes, update_attributes)):
+        if getattr(office, office_attr) != getattr(office_to_update, update_attr) and getattr(
+                office_to_update, update_attr) is not None:
+            setattr(office, office_attr, getattr(office_to_update, update_attr))
+            is_updated = True
+
+    if office_to_update.remove_phone:
+        if office.tel != '':
+            office.tel = ''
+            is_updated = True
+    else:
+        if office.tel != office_to_update.new_phone:
+            office.tel = office_to_update.new_phone
+            is_updated = True
+
+    for attr in ["email", "website"]:
+        if getattr(office_to_update, f"remove_{attr}"):
+            if getattr(office, attr) != '':
+                setattr(office, attr, '')
+                is_updated = True
+        else:
+            if getattr(office, attr) != getattr(office_to_update, f"new_{attr}"):
+                setattr(office, attr, getattr(office_to_update, f"new_{attr}"))
+                is_updated = True
 
-    for siret in sirets:
+    return is_updated
 
-        office: Office = Office.query.filter_by(siret=siret).first()
 
-        if office:
-            is_updated = False
-            # Apply changes in DB.
-            # , "email", "tel", "website"
-            if office_to_update.new_company_name and office.company_name != office_to_update.new_company_name:
-                office.company_name = office_to_update.new_company_name
-                is_updated = True
-            if office_to_update.new_office_name and office.office_name != office_to_update.new_office_name:
-                office.office_name = office_to_update.new_office_name
-                is_updated = True
-            offices_attributes = [
-                "email_alternance", "phone_alternance", "website_alternance", "hiring", "score_alternance",
-                "social_network", "contact_mode"
-            ]
-            update_attributes = [
-                "email_alternance", "phone_alternance", "website_alternance", "hiring", "score_alternance",
-                "social_network", "contact_mode"
-            ]
-            for office_attr, update_attr in list(zip(offices_attributes, update_attributes)):
-                if getattr(office, office_attr) != getattr(office_to_update, update_attr) and getattr(
-                        office_to_update, update_attr) is not None:
-                    setattr(office, office_attr, getattr(office_to_update, update_attr))
-                    is_updated = True
-
-            if office_to_update.remove_phone:
-                if office.tel != '':
-                    office.tel = ''
-                    is_updated = True
-            else:
-                if office.tel != office_to_update.new_phone:
-                    office.tel = office_to_update.new_phone
-                    is_updated = True
-
-            for attr in ["email", "website"]:
-                if getattr(office_to_update, f"remove_{attr}"):
-                    if getattr(office, attr) != '':
-                        setattr(office, attr, '')
-                        is_updated = True
-                else:
-                    if getattr(office, attr) != getattr(office_to_update, f"new_{attr}"):
-                        setattr(office, attr, getattr(office_to_update, f"new_{attr}"))
-                        is_updated = True
-
-            if is_updated:
-                office.save()
-
-                # Apply changes in ElasticSearch.
-                body = {
-                    'doc': {
-                        'email': office.email,
-                        'phone': office.tel,
-                        'website': office.website,
-                        "score": office.score,
-                        'flag_alternance': 1 if office.flag_alternance else 0
-                    }
-                }
-
-                scores_by_rome, boosted_romes = get_scores_by_rome_and_boosted_romes(office, office_to_update)
-                if scores_by_rome:
-                    body['doc']['scores_by_rome'] = scores_by_rome
-                    body['doc']['boosted_romes'] = boosted_romes
-
-                # The update API makes partial updates: existing `scalar` fields are overwritten,
-                # but `objects` fields are merged together.
-                # https://www.elastic.co/guide/en/elasticsearch/guide/1.x/partial-updates.html
-                # However `scores_by_rome` and `boosted_romes` need to be overwritten because they
-                # may change over time.
-                # To do this, we perform 2 requests: the first one resets `scores_by_rome` and
-                # `boosted_romes` and the second one populates them.
-                delete_body = {
-                    'doc': {
-                        'scores_by_rome': None,
-                        'boosted_romes': None,
-                        'scores_alternance_by_rome': None,
-                        'boosted_alternance_romes': None
-                    }
-                }
-
-                # Unfortunately these cannot easily be bulked :-(
-                # The reason is there is no way to tell bulk to ignore missing documents (404)
-                # for a partial update. Tried it and failed it on Oct 2017 @vermeer.
-                es.Elasticsearch().update(index=settings.ES_INDEX,
-                                          doc_type=es.OFFICE_TYPE,
-                                          id=siret,
-                                          body=delete_body,
-                                          params={'ignore': 404})
-                es.Elasticsearch().update(index=settings.ES_INDEX,
-                                          doc_type=es.OFFICE_TYPE,
-                                          id=siret,
-                                          body=body,
-                                          params={'ignore': 404})
-
-                # Delete the current PDF thus it will be regenerated at the next download attempt.
-                pdf_util.delete_file(office)
+def get_office_update_actions(office: Office, office_to_update: OfficeUpdateType) -> List[Dict[str, Any]]:
+    """
+    Return the ES bulk actions applying an office admin update to the document of an updated office.
+    """
+    body = {
+        'doc': {
+            'email': office.email,
+            'phone': office.tel,
+            'website': office.website,
+            "score": office.score,
+            'flag_alternance': 1 if office.flag_alternance else 0
+        }
+    }
+
+    scores_by_rome, boosted_romes = get_scores_by_rome_and_boosted_romes(office, office_to_update)
+    if scores_by_rome:
+        body['doc'].update(es.encode_scores('scores_by_rome', scores_by_rome))
+        body['doc']['boosted_romes'] = boosted_romes
+
+    # The update API makes partial updates: existing `scalar` fields are overwritten,
+    # but `objects` fields are merged together.
+    # https://www.elastic.co/guide/en/elasticsearch/guide/1.x/partial-updates.html
+    # However `scores_by_rome` and `boosted_romes` need to be overwritten because they
+    # may change over time.
+    # To do this, we perform 2 updates: the first one resets `scores_by_rome` and
+    # `boosted_romes` and the second one populates them. Actions of a bulk request
+    # on the same document are applied in order.
+    delete_body = {
+        'doc': {
+            'boosted_romes': None,
+            'boosted_alternance_romes': None,
+            **es.encode_scores('scores_by_rome', None),
+            **es.encode_scores('scores_alternance_by_rome', None),
+        }
+    }
+
+    return [{
+        '_op_type': 'update',
+        '_index': settings.ES_INDEX,
+        '_type': es.OFFICE_TYPE,
+        '_id': office.siret,
+        **update_body,
+    } for update_body in (delete_body, body)]
+
+
+def apply_office_updates(office_updates: Iterable[Tuple[List[str], OfficeUpdateType]]) -> Dict[str, Any]:
+    """
+    Apply office admin updates, given as (sirets, office_to_update) tuples in increasing order of priority:
+    offices are read and written with a few batched SQL queries, and their ES documents are updated
+    with a single bulk request.
+
+    Return a summary with the updated, missing (not found in ES) and failed sirets, and the duration of each phase.
+    """
+    durations: Dict[str, float] = {}
+    office_updates = list(office_updates)
+
+    start = time.time()
+    sirets = list(dict.fromkeys(siret for update_sirets, _ in office_updates for siret in update_sirets))
+    offices_by_siret: Dict[str, Office] = {}
+    for sirets_chunk in chunks(sirets, OFFICE_SIRET_CHUNK_SIZE):
+        for office in Office.query.filter(Office.siret.in_(sirets_chunk)):
+            offices_by_siret[office.siret] = office
+    durations['db read'] = time.time() - start
+
+    start = time.time()
+    # For each updated office, the most recent update which changed it.
+    updates_by_siret: Dict[str, OfficeUpdateType] = {}
+    for update_sirets, office_to_update in office_updates:
+        for siret in update_sirets:
+            office = offices_by_siret.get(siret)
+            if office and apply_office_update(office, office_to_update):
+                updates_by_siret[siret] = office_to_update
+    durations['overlay'] = time.time() - start
+
+    start = time.time()
+    db_session.commit()
+    durations['db write'] = time.time() - start
+
+    start = time.time()
+    actions = (
+        action for siret, office_to_update in updates_by_siret.items()
+        for action in get_office_update_actions(offices_by_siret[siret], office_to_update)
+    )
+    _, errors = bulk(es.Elasticsearch(), actions, chunk_size=ES_BULK_CHUNK_SIZE, raise_on_error=False)
+    missing_sirets = set()
+    failed_sirets = set()
+    for error in errors:
+        _, item = error.popitem()
+        if item.get('status') == 404:
+            # The office is not indexed, e.g. its score is too low.
+            missing_sirets.add(item.get('_id'))
+        else:
+            logger.error("update of office %s failed in ES: %s", item.get('_id'), item)
+            failed_sirets.add(item.get('_id'))
+    durations['es bulk'] = time.time() - start
+
+    start = time.time()
+    for siret in updates_by_siret:
+        # Delete the current PDF thus it will be regenerated at the next download attempt.
+        pdf_util.delete_file(offices_by_siret[siret])
+    durations['pdf'] = time.time() - start
+
+    summary = {
+        'updated': [siret for siret in updates_by_siret if siret not in missing_sirets | failed_sirets],
+        'missing': sorted(missing_sirets),
+        'failed': sorted(failed_sirets),
+        'durations': durations,
+    }
+    logger.info(
+        "applied %s office updates to %s offices: %s updated, %s missing in ES, %s failed (%s)",
+        len(office_updates),
+        len(offices_by_siret),
+        len(summary['updated']),
+        len(missing_sirets),
+        len(failed_sirets),
+        ", ".join("%s: %.2fs" % (phase, duration) for phase, duration in durations.items()),
+    )
+    return summary
+
+
+def update_offices_by_sirets(sirets: list, office_to_update: Union[Type[OfficeAdminUpdate],
+                                                                   Type[OfficeThirdPartyUpdate]]) -> Dict[str, Any]:
+    """
+    Update offices after office admin update
+    (overload the data provided by the importer).
+    """
+    return apply_office_updates([(sirets, office_to_update)])
 
 
 @timeit
-def update_offices(table: Union[Type[OfficeAdminUpdate], Type[OfficeThirdPartyUpdate]]) -> None:
+def update_offices(table: Union[Type[OfficeAdminUpdate], Type[OfficeThirdPartyUpdate]]) -> Dict[str, Any]:
     """
     Update offices (overload the data provided by the importer).
     """
@@ -677,8 +1545,10 @@ def update_offices(table: Union[Type[OfficeAdminUpdate], Type[OfficeThirdPartyUp
     # on a SIRET. As a result, it shouldn't but there may be `n` entries in `table`
     # for the same SIRET. We order the query by creation date ASC so that the most recent changes take
     # priority over any older ones.
-    for office_to_update in to_iterator(db_session.query(table), table.id):  # type: ignore
-        update_offices_by_sirets(table.as_list(office_to_update.sirets), office_to_update)
+    return apply_office_updates(
+        (table.as_list(office_to_update.sirets), office_to_update)
+        for office_to_update in to_iterator(db_session.query(table), table.id)  # type: ignore
+    )
 
 
 @timeit
@@ -798,25 +1668,64 @@ def sanity_check_rome_codes() -> None:
     longitude = city['coords']['lon']
     distance = 1000
 
+    disable_verbose_loggers()
+    office_counts = get_office_counts_by_rome(romes_from_rome_naf_mapping, latitude, longitude, distance)
+    enable_verbose_loggers()
+
     # CSV style output for easier manipulation afterwards
     logger.info("rome_id|rome_label|offices_in_france")
-    for rome_id in romes_from_rome_naf_mapping:
-        naf_code_list = mapping_util.map_romes_to_nafs([rome_id])
-        disable_verbose_loggers()
+    for rome_id in sorted(office_counts):
+        logger.info("%s|%s|%s", rome_id, rome_labels[rome_id], office_counts[rome_id])
+
+    logger.info("rome codes with less than %s offices:", SANITY_CHECK_MINIMUM_OFFICE_COUNT)
+    logger.info("rome_id|rome_label|offices_in_france")
+    for rome_id in sorted(office_counts):
+        if office_counts[rome_id] < SANITY_CHECK_MINIMUM_OFFICE_COUNT:
+            logger.warning("%s|%s|%s", rome_id, rome_labels[rome_id], office_counts[rome_id])
+
+
+def get_office_counts_by_rome(rome_codes: Iterable[str],
+                              latitude: float,
+                              longitude: float,
+                              distance: int,
+                              index: Optional[str] = None) -> Dict[str, int]:
+    """
+    Count, for each ROME code, the offices of the index that a search for this ROME code around
+    the given location would find. Offices are counted by a `filters` aggregation, in a single
+    search per chunk of ROME codes instead of a search per ROME code.
+    """
+    office_counts: Dict[str, int] = {}
+    for rome_codes_chunk in chunks(sorted(rome_codes), SANITY_CHECK_ROME_CHUNK_SIZE):
+        # The fetcher builds the filters shared by all ROME codes of the chunk.
         fetcher = HiddenMarketFetcher(
-            naf_codes=naf_code_list,
-            romes=[rome_id],
+            romes=rome_codes_chunk,
             latitude=latitude,
             longitude=longitude,
             distance=distance,
-            from_number=1,
-            to_number=10,
             hiring_type=hiring_type_util.DPAE,
         )
-        offices, _ = fetcher.get_offices()
-        enable_verbose_loggers()
-        if len(offices) < 5:
-            logger.info("%s|%s|%s", rome_id, rome_labels[rome_id], len(offices))
+        rome_filters = {}
+        for rome_code in rome_codes_chunk:
+            filters: List[Dict] = []
+            # pylint: disable=protected-access
+            fetcher._unsure_rome_is_in_scores([rome_code], hiring_type_util.DPAE, to=filters,
+                                              scores_encoding=fetcher.scores_encoding)
+            naf_codes = mapping_util.map_romes_to_nafs([rome_code])
+            fetcher._add_filter_terms('naf', naf_codes, to=filters, if_=bool(naf_codes))
+            # pylint: enable=protected-access
+            rome_filters[rome_code] = {"bool": {"must": filters}}
+
+        body = fetcher._build_elastic_search_query(  # pylint: disable=protected-access
+            omit_sort=True,
+            omit_aggretation=True,
+            omit_pagination=True,
+        )
+        body['size'] = 0
+        body['aggs'] = {"romes": {"filters": {"filters": rome_filters}}}
+        res = es.Elasticsearch().search(index=index or settings.ES_INDEX, doc_type=es.OFFICE_TYPE, body=body)
+        for rome_code, bucket in res['aggregations']['romes']['buckets'].items():
+            office_counts[rome_code] = bucket['doc_count']
+    return office_counts
 
 
 def display_performance_stats(departement: str) -> None:
@@ -838,18 +1747,41 @@ def display_performance_stats(departement: str) -> None:
     )
 
 
-def update_data(create_full: bool, create_partial: bool, disable_parallel_computing: bool) -> None:
+def update_data(create_full: bool, create_partial: bool, disable_parallel_computing: bool,
+                create_delta: bool = False, resume: bool = False) -> None:
     logger.info("[update data] Creation of ES index")
     if create_partial:
+        reset_fingerprints()
         with switch_es_index():
             create_offices_for_departement('57')
         return
 
     if create_full:
-        with switch_es_index():
-            create_offices(disable_parallel_computing)
-            create_job_codes()
-            create_locations()
+        new_index_name = get_resumable_index_name() if resume else None
+        resumed = new_index_name is not None
+        if resumed:
+            logger.info("[update data] Resuming the creation of ES index %s", new_index_name)
+        else:
+            reset_fingerprints()
+            new_index_name = es.get_new_index_name()
+            if Checkpoints.ACTIVATED:
+                start_checkpoints(new_index_name)
+        try:
+            with switch_es_index(new_index_name, create=not resumed, keep_on_error=Checkpoints.ACTIVATED):
+                create_offices(disable_parallel_computing)
+                create_job_codes()
+                create_locations()
+        except Exception:
+            if not Checkpoints.ACTIVATED:
+                # Fingerprints saved so far describe an index which was dropped.
+                reset_fingerprints()
+            raise
+        if Checkpoints.ACTIVATED:
+            clear_checkpoints(new_index_name)
+
+    if create_delta:
+        logger.info("[update data] Delta indexing of offices")
+        update_offices_delta(disable_parallel_computing)
 
     # Upon requests received from employers we can add, remove or update offices.
     # This permits us to complete or overload the data provided by the importer.
@@ -874,24 +1806,37 @@ def update_data(create_full: bool, create_partial: bool, disable_parallel_comput
 
 def update_data_profiling_wrapper(create_full: bool,
                                   create_partial: bool,
-                                  disable_parallel_computing: bool = False) -> None:
+                                  disable_parallel_computing: bool = False,
+                                  create_delta: bool = False,
+                                  resume: bool = False) -> None:
     if Profiling.ACTIVATED:
         logger.info("STARTED run with profiling")
         profiler = Profile()
-        profiler.runctx("update_data(create_full, create_partial, disable_parallel_computing)", locals(), globals())
+        profiler.runctx("update_data(create_full, create_partial, disable_parallel_computing, create_delta, resume)",
+                        locals(), globals())
         relative_filename = 'profiling_results/create_index_run.kgrind'
         filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), relative_filename)
         convert(profiler.getstats(), filename)  # type: ignore
         logger.info("COMPLETED run with profiling: exported profiling result as %s", filename)
     else:
         logger.info("STARTED run without profiling")
-        update_data(create_full, create_partial, disable_parallel_computing)
+        update_data(create_full, create_partial, disable_parallel_computing, create_delta, resume)
         logger.info("COMPLETED run without profiling")
 
 
 def run() -> None:
     parser = argparse.ArgumentParser(description="Update elasticsearch data: offices, ogr_codes and locations.")
     parser.add_argument('-f', '--full', action='store_true', help="Create full index from scratch.")
+    parser.add_argument('-d',
+                        '--delta',
+                        action='store_true',
+                        help=("Only index, in the live index, the offices whose document changed since the last"
+                              " delta indexing or full indexing run with --fingerprints, and remove those which"
+                              " should not be indexed anymore."))
+    parser.add_argument('--fingerprints',
+                        action='store_true',
+                        help=("Save a fingerprint of each office indexed by a full or partial indexing, as required"
+                              " by a later --delta run. This costs memory in each job and one write per office."))
     parser.add_argument('-a',
                         '--partial',
                         action='store_true',
@@ -902,14 +1847,76 @@ def run() -> None:
                         '--profile',
                         action='store_true',
                         help="Enable code performance profiling for later visualization with Q/KCacheGrind.")
+    parser.add_argument('-s',
+                        '--stream',
+                        action='store_true',
+                        help=("Read offices by windows and stream them to ES, so that the memory used by a job"
+                              " does not depend on the size of its departement."))
+    parser.add_argument('--window-size',
+                        type=int,
+                        default=OFFICE_WINDOW_SIZE,
+                        help="Number of offices read from the DB at once in streaming mode (default: %(default)s).")
+    parser.add_argument('-b',
+                        '--parallel-bulk',
+                        action='store_true',
+                        help="Send bulk requests to ES from several threads in each job.")
+    parser.add_argument('--bulk-threads',
+                        type=int,
+                        default=ES_BULK_THREAD_COUNT,
+                        help="Number of threads sending bulk requests in parallel bulk mode (default: %(default)s).")
+    parser.add_argument('--bulk-chunk-size',
+                        type=int,
+                        default=ES_BULK_CHUNK_SIZE,
+                        help="Maximum number of actions per bulk request in parallel bulk mode (default: %(default)s).")
+    parser.add_argument('--bulk-chunk-bytes',
+                        type=int,
+                        default=ES_BULK_MAX_CHUNK_BYTES,
+                        help="Maximum size of a bulk request in bytes, in parallel bulk mode (default: %(default)s).")
+    parser.add_argument('--processes',
+                        type=int,
+                        help="Number of processes running departement jobs in parallel (default: 1.25 x CPUs).")
+    parser.add_argument('--worker-max-tasks',
+                        type=int,
+                        default=1,
+                        help=("Number of departement jobs run by a process before it is replaced by a new one,"
+                              " 0 to reuse processes for all jobs (default: %(default)s)."))
+    parser.add_argument('-c',
+                        '--checkpoints',
+                        action='store_true',
+                        help=("Record each departement indexed by a full indexing, and keep the new index if the"
+                              " indexing fails, so that it can be resumed."))
+    parser.add_argument('-r',
+                        '--resume',
+                        action='store_true',
+                        help=("Resume the last interrupted full indexing run with --checkpoints: departements"
+                              " already indexed with the expected number of offices are skipped."))
     args = parser.parse_args()
 
     if args.full and args.partial:
         raise ValueError('Cannot create both partial and full index at the same time')
+    if args.delta and (args.full or args.partial):
+        raise ValueError('Cannot run a delta indexing along with a full or partial index creation')
+    if args.resume and not args.full:
+        raise ValueError('Only a full index creation can be resumed')
     if args.profile:
         Profiling.ACTIVATED = True
-
-    update_data_profiling_wrapper(args.full, args.partial)
+    if args.fingerprints:
+        Fingerprints.ACTIVATED = True
+    if args.checkpoints or args.resume:
+        Checkpoints.ACTIVATED = True
+    Workers.PROCESSES = args.processes
+    Workers.MAX_TASKS_PER_CHILD = args.worker_max_tasks or None
+    if args.stream:
+        Streaming.ACTIVATED = True
+        Streaming.WINDOW_SIZE = args.window_size
+    if args.parallel_bulk:
+        ParallelBulk.ACTIVATED = True
+        ParallelBulk.THREAD_COUNT = args.bulk_threads
+        ParallelBulk.CHUNK_SIZE = args.bulk_chunk_size
+        ParallelBulk.MAX_CHUNK_BYTES = args.bulk_chunk_bytes
+        ParallelBulk.MAX_PENDING_CHUNKS = 2 * args.bulk_threads
+
+    update_data_profiling_wrapper(args.full, args.partial, create_delta=args.delta, resume=args.resume)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,205 @@
+"""
+Migrate an index to another encoding of per-ROME office scores (see `es.SCORES_ENCODINGS`),
+and compare the encodings of several indexes.
+
+The migration copies all documents of the source index into a new index created with the
+requested encoding. The alias is only switched to the new index with `--switch-alias`: the
+`ES_SCORES_ENCODING` setting of the frontends must be changed at the same time.
+
+The report compares, for each given index: its size, the memory it uses on the ES heap and
+the latency of single and multi ROME searches built by `HiddenMarketFetcher`.
+
+Usage:
+
+    python -m labonneboite.scripts.migrate_scores_encoding migrate --encoding nested
+    python -m labonneboite.scripts.migrate_scores_encoding report labonneboite-20221001 labonneboite-20221002
+"""
+import argparse
+import logging
+import statistics
+import time
+
+from elasticsearch.helpers import bulk, scan
+
+from labonneboite.common import es, hiring_type_util
+from labonneboite.common.search import HiddenMarketFetcher
+from labonneboite.conf import settings
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+ES_BULK_CHUNK_SIZE = 5000
+
+# Searches of the latency report: (label, rome codes), around Paris.
+LATITUDE = 48.8566
+LONGITUDE = 2.3522
+REPORT_SEARCHES = [
+    ('single rome', ['D1106']),
+    ('single rome', ['M1607']),
+    ('multi rome', ['D1106', 'D1101', 'D1102', 'D1103', 'D1104']),
+    ('multi rome', ['M1607', 'M1602', 'M1203', 'K2204', 'N1103']),
+]
+REPORT_DISTANCES = [10, 100]
+
+
+def get_index_scores_encoding(index):
+    """
+    Guess the scores encoding of an existing index from its office mapping.
+    """
+    mappings = es.Elasticsearch().indices.get_mapping(index=index, doc_type=es.OFFICE_TYPE)
+    properties = list(mappings.values())[0]['mappings'][es.OFFICE_TYPE]['properties']
+    if any(field_name in properties for field_name in es.NESTED_SCORE_FIELD_NAMES.values()):
+        return es.SCORES_ENCODING_NESTED
+    return es.SCORES_ENCODING_OBJECT
+
+
+def count_mapped_fields(properties):
+    count = 0
+    for field in properties.values():
+        count += 1
+        count += count_mapped_fields(field.get('properties', {}))
+    return count
+
+
+def reencode_office(source, scores_encoding):
+    """
+    Return a copy of an office document source with its scores encoded for the given encoding.
+    """
+    source = {
+        field_name: value for field_name, value in source.items()
+        if field_name not in es.NESTED_SCORE_FIELD_NAMES.values()
+    }
+    for field_name in es.NESTED_SCORE_FIELD_NAMES:
+        if source.get(field_name) is not None:
+            source.update(es.encode_scores(field_name, source[field_name], scores_encoding))
+    return source
+
+
+def get_migration_actions(source_index, new_index, scores_encoding):
+    for hit in scan(es.Elasticsearch(), index=source_index, query={'query': {'match_all': {}}}):
+        source = hit['_source']
+        if hit['_type'] == es.OFFICE_TYPE:
+            if hit['_id'] == es.fake_office()['siret']:
+                # Already indexed by es.create_index.
+                continue
+            source = reencode_office(source, scores_encoding)
+        yield {
+            '_op_type': 'index',
+            '_index': new_index,
+            '_type': hit['_type'],
+            '_id': hit['_id'],
+            '_source': source,
+        }
+
+
+def migrate(scores_encoding, source_index=None, switch_alias=False):
+    """
+    Copy the source index (by default, the one the alias points to) into a new index using
+    the given scores encoding, and return the name of the new index.
+    """
+    source_index = source_index or settings.ES_INDEX
+    new_index = es.get_new_index_name()
+    logger.info("copying %s into %s with %s scores encoding...", source_index, new_index, scores_encoding)
+
+    start = time.time()
+    es.create_index(new_index, scores_encoding=scores_encoding)
+    success, _ = bulk(
+        es.Elasticsearch(),
+        get_migration_actions(source_index, new_index, scores_encoding),
+        chunk_size=ES_BULK_CHUNK_SIZE,
+    )
+    es.Elasticsearch().indices.refresh(index=new_index)
+    logger.info("copied %s documents in %.1fs", success, time.time() - start)
+
+    if switch_alias:
+        old_indexes = list(es.Elasticsearch().indices.get_alias(name=settings.ES_INDEX).keys())
+        actions = [{'remove': {'index': index, 'alias': settings.ES_INDEX}} for index in old_indexes]
+        actions.append({'add': {'index': new_index, 'alias': settings.ES_INDEX}})
+        es.Elasticsearch().indices.update_aliases(body={'actions': actions})
+        logger.info("alias %s now points to %s", settings.ES_INDEX, new_index)
+
+    return new_index
+
+
+def get_index_stats(index):
+    """
+    Size and heap usage of the index primaries. The count of Lucene documents includes nested documents.
+    """
+    stats = es.Elasticsearch().indices.stats(index=index)['indices'][index]['primaries']
+    mappings = es.Elasticsearch().indices.get_mapping(index=index, doc_type=es.OFFICE_TYPE)
+    properties = list(mappings.values())[0]['mappings'][es.OFFICE_TYPE]['properties']
+    office_count = es.Elasticsearch().count(index=index, doc_type=es.OFFICE_TYPE)['count']
+    return {
+        'offices': office_count,
+        'lucene documents': stats['docs']['count'],
+        'mapped office fields': count_mapped_fields(properties),
+        'store size (MB)': stats['store']['size_in_bytes'] / 1024 / 1024,
+        'segments memory (MB)': stats['segments']['memory_in_bytes'] / 1024 / 1024,
+        'fielddata memory (MB)': stats['fielddata']['memory_size_in_bytes'] / 1024 / 1024,
+        'filter cache memory (MB)': stats['filter_cache']['memory_size_in_bytes'] / 1024 / 1024,
+    }
+
+
+def get_search_latencies(index, repeat):
+    """
+    Return a {search label: [durations]} dict of the durations (in ms, as reported by ES) of report searches.
+    """
+    scores_encoding = get_index_scores_encoding(index)
+    latencies = {}
+    for label, romes in REPORT_SEARCHES:
+        for distance in REPORT_DISTANCES:
+            fetcher = HiddenMarketFetcher(
+                longitude=LONGITUDE,
+                latitude=LATITUDE,
+                romes=romes,
+                distance=distance,
+                hiring_type=hiring_type_util.DPAE,
+                scores_encoding=scores_encoding,
+            )
+            query = fetcher._build_elastic_search_query()  # pylint: disable=protected-access
+            key = '%s, %skm' % (label, distance)
+            for _ in range(repeat):
+                res = es.Elasticsearch().search(index=index, doc_type=es.OFFICE_TYPE, body=query)
+                latencies.setdefault(key, []).append(res['took'])
+    return latencies
+
+
+def report(indexes, repeat):
+    columns = [(index, get_index_scores_encoding(index)) for index in indexes]
+    stats = [get_index_stats(index) for index in indexes]
+    latencies = [get_search_latencies(index, repeat) for index in indexes]
+
+    print("%-32s" % "" + "".join("%28s" % index for index, _ in columns))
+    print("%-32s" % "scores encoding" + "".join("%28s" % encoding for _, encoding in columns))
+    for name in stats[0]:
+        print("%-32s" % name + "".join("%28.1f" % index_stats[name] for index_stats in stats))
+    for name in latencies[0]:
+        print("%-32s" % ("%s (median/max ms)" % name) + "".join(
+            "%28s" % ("%s / %s" % (statistics.median(index_latencies[name]), max(index_latencies[name])))
+            for index_latencies in latencies
+        ))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Migrate or compare encodings of per-ROME office scores.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help="Copy an index into a new index with another encoding.")
+    migrate_parser.add_argument('--encoding', choices=es.SCORES_ENCODINGS, required=True)
+    migrate_parser.add_argument('--source-index', help="Index to copy (default: the %s alias)." % settings.ES_INDEX)
+    migrate_parser.add_argument('--switch-alias', action='store_true',
+                                help="Make the %s alias point to the new index." % settings.ES_INDEX)
+
+    report_parser = subparsers.add_parser('report', help="Compare size, heap usage and latency of indexes.")
+    report_parser.add_argument('indexes', nargs='+')
+    report_parser.add_argument('--repeat', type=int, default=20, help="Number of runs of each search.")
+
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        migrate(args.encoding, source_index=args.source_index, switch_alias=args.switch_alias)
+    else:
+        report(args.indexes, args.repeat)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,21 @@
+import sqlite3
+import unittest
+
+from labonneboite.common.database import InstrumentedQueuePool
+
+
+class InstrumentedQueuePoolTest(unittest.TestCase):
+
+    def test_overflow_checkouts(self):
+        pool = InstrumentedQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=2)
+
+        base_connection = pool.connect()
+        overflow_connection = pool.connect()
+        base_connection.close()
+        # Served by the base pool, while an overflow connection is open.
+        pool.connect()
+        overflow_connection.close()
+
+        stats = pool.get_stats()
+        self.assertEqual(3, stats['checkouts'])
+        self.assertEqual(1, stats['overflow_checkouts'])
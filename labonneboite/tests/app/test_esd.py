@@ -0,0 +1,101 @@
+import time
+import unittest
+from unittest import mock
+
+from labonneboite.common import esd, hiring_type_util
+from labonneboite.common.offers import VisibleMarketFetcher
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_calls_are_spaced(self):
+        rate_limiter = esd.RateLimiter(calls_per_second=50)
+        start = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 4 * 0.02)
+
+    def test_deadline_exceeded(self):
+        rate_limiter = esd.RateLimiter(calls_per_second=1)
+        rate_limiter.wait()
+        with self.assertRaises(esd.DeadlineExceeded):
+            rate_limiter.wait(deadline=time.monotonic() + 0.1)
+
+
+@mock.patch.object(esd.EsdToken, 'get_token', return_value='token')
+class GetResponseTest(unittest.TestCase):
+
+    def test_no_attempt_after_deadline(self, _):
+        with mock.patch.object(esd, '_get_response') as mock_get_response:
+            response = esd.get_response('url', {}, deadline=time.monotonic() - 1)
+        mock_get_response.assert_not_called()
+        self.assertEqual({'resultats': []}, response)
+
+    def test_retry_on_too_many_requests(self, _):
+        with mock.patch.object(esd, '_get_response', side_effect=[esd.TooManyRequests, {'resultats': []}]), \
+                mock.patch.object(esd, 'ESD_OFFERS_THROTTLE_IN_SECONDS', 0):
+            response = esd.get_response('url', {}, deadline=time.monotonic() + 5)
+        self.assertEqual({'resultats': []}, response)
+
+
+class VisibleMarketFetcherTest(unittest.TestCase):
+
+    @staticmethod
+    def fake_get_response(_url, params, **_kwargs):
+        # The first batch answers last, to check that offers keep the order of the romes.
+        time.sleep(0.05 if 'A1101' in params['codeROME'] else 0)
+        return {'resultats': [{'romeCode': rome} for rome in params['codeROME'].split(',')]}
+
+    def test_concurrent_fetch_same_as_serial(self):
+        romes = ['A1101', 'D1101', 'D1102', 'D1103', 'D1104', 'D1105', 'D1106']
+        fetcher = VisibleMarketFetcher(
+            romes=romes, commune_id='57463', distance=10, hiring_type=hiring_type_util.ALTERNANCE, page_size=10,
+        )
+        with mock.patch.object(esd, 'get_response', side_effect=self.fake_get_response) as mock_get_response:
+            serial_offers = fetcher.get_offers_for_romes(romes, concurrent=False)
+            concurrent_offers = fetcher.get_offers_for_romes(romes, concurrent=True)
+
+        self.assertEqual(6, mock_get_response.call_count)
+        self.assertEqual(romes, [offer['romeCode'] for offer in serial_offers])
+        self.assertEqual(serial_offers, concurrent_offers)
+        # Concurrent calls share a session and a deadline.
+        self.assertIsNotNone(mock_get_response.call_args[1]['session'])
+        self.assertIsNotNone(mock_get_response.call_args[1]['deadline'])
+
+    def test_batch_exceeding_deadline_returns_no_offers(self):
+        romes = ['A1101', 'D1101', 'D1102', 'D1103', 'D1104', 'D1105', 'D1106']
+        fetcher = VisibleMarketFetcher(
+            romes=romes, commune_id='57463', distance=10, hiring_type=hiring_type_util.ALTERNANCE, page_size=10,
+        )
+
+        def fake_get_response(params, **_kwargs):
+            # The first batch is throttled until the deadline is exceeded.
+            if 'A1101' in params['codeROME']:
+                raise esd.TooManyRequests
+            return {'resultats': [{'romeCode': rome} for rome in params['codeROME'].split(',')]}
+
+        with mock.patch.object(esd.EsdToken, 'get_token', return_value='token'), \
+                mock.patch.object(esd, '_get_response', side_effect=fake_get_response), \
+                mock.patch.object(esd, 'ESD_OFFERS_DEADLINE_IN_SECONDS', 0.1), \
+                mock.patch.object(esd, 'ESD_OFFERS_THROTTLE_IN_SECONDS', 0.2), \
+                mock.patch.object(esd, 'RATE_LIMITER', esd.RateLimiter(calls_per_second=1000)):
+            offers = fetcher.get_offers_for_romes(romes, concurrent=True)
+
+        self.assertEqual(['D1103', 'D1104', 'D1105', 'D1106'], [offer['romeCode'] for offer in offers])
+
+    def test_batch_timing_out_returns_no_offers(self):
+        romes = ['A1101', 'D1101', 'D1102', 'D1103', 'D1104', 'D1105', 'D1106']
+        fetcher = VisibleMarketFetcher(
+            romes=romes, commune_id='57463', distance=10, hiring_type=hiring_type_util.ALTERNANCE, page_size=10,
+        )
+
+        def fake_get_response(params, **_kwargs):
+            if 'A1101' in params['codeROME']:
+                raise esd.ReadTimeout
+            return {'resultats': [{'romeCode': rome} for rome in params['codeROME'].split(',')]}
+
+        with mock.patch.object(esd.EsdToken, 'get_token', return_value='token'), \
+                mock.patch.object(esd, '_get_response', side_effect=fake_get_response):
+            offers = fetcher.get_offers_for_romes(romes, concurrent=True)
+
+        self.assertEqual(['D1103', 'D1104', 'D1105', 'D1106'], [offer['romeCode'] for offer in offers])
@@ -57,3 +57,40 @@ class GeocodingTest(TestCase):
         saint_julien_les_metz = geocoding.get_city_by_zipcode("57070", "saint-julien-les-metz")
         self.assertEqual(vantoux['commune_id'], '57693')
         self.assertEqual(saint_julien_les_metz['commune_id'], '57616')
+
+    def test_get_all_cities_from_departement(self):
+        cities = geocoding.get_all_cities_from_departement("57")
+        expected_cities = [city for city in geocoding.get_cities() if city['commune_id'].startswith("57")]
+        self.assertEqual(sorted(city['commune_id'] for city in expected_cities),
+                         sorted(city['commune_id'] for city in cities))
+        self.assertIn("57463", [city['commune_id'] for city in cities])  # Metz
+        self.assertEqual(geocoding.get_all_cities_from_departement("AAAAA"), [])
+
+    def test_get_nearest_city(self):
+        metz = geocoding.get_city_by_commune_id("57463")
+        city = geocoding.get_nearest_city(metz['coords']['lat'], metz['coords']['lon'])
+        self.assertEqual(city['commune_id'], "57463")
+
+        # Same result as a full scan of all cities.
+        latitude, longitude = 49.0, 6.0
+        expected_city = min(
+            geocoding.get_cities(),
+            key=lambda c: geocoding.spatial.haversine_distance(latitude, longitude, c['coords']['lat'], c['coords'][
+                'lon']),
+        )
+        self.assertEqual(geocoding.get_nearest_city(latitude, longitude)['commune_id'], expected_city['commune_id'])
+
+    def test_get_cities_within_radius(self):
+        metz = geocoding.get_city_by_commune_id("57463")
+        results = geocoding.get_cities_within_radius(metz['coords']['lat'], metz['coords']['lon'], 5)
+        distances = [distance for distance, _ in results]
+        commune_ids = [city['commune_id'] for _, city in results]
+        self.assertEqual(commune_ids[0], "57463")
+        self.assertIn("57480", commune_ids)  # Montigny-lès-Metz
+        self.assertEqual(distances, sorted(distances))
+        self.assertTrue(all(distance <= 5 for distance in distances))
+
+    def test_get_distance_between_commune_id_and_coordinates(self):
+        # Metz to Nancy is about 47 km as the crow flies.
+        distance = geocoding.get_distance_between_commune_id_and_coordinates("57463", 48.6921, 6.1844)
+        self.assertAlmostEqual(distance, 47, delta=3)
@@ -0,0 +1,60 @@
+import unittest
+
+from labonneboite.common import job_label_index
+from labonneboite.common.job_label_index import JobLabelIndex
+
+
+def make_document(ogr_code, ogr_description, rome_code, rome_description):
+    return {
+        'ogr_code': ogr_code,
+        'ogr_description': ogr_description,
+        'rome_code': rome_code,
+        'rome_description': rome_description,
+    }
+
+
+class JobLabelIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = JobLabelIndex([
+            make_document('11564', 'Boucher / Bouchère', 'D1101', 'Boucherie'),
+            make_document('11573', 'Boucher-charcutier / Bouchère-charcutière', 'D1101', 'Boucherie'),
+            make_document('20665', 'Vendeur / Vendeuse en boucherie', 'D1106', 'Vente en alimentation'),
+            make_document('11573', "Chef d'équipe de l'usine", 'H2101', 'Abattage et découpe des viandes'),
+            make_document('38035', 'Développeur / Développeuse informatique', 'M1805',
+                          'Études et développement informatique'),
+        ])
+
+    def test_analyze(self):
+        self.assertEqual(
+            ['chef', 'equipe', 'usine'],
+            job_label_index.analyze("Chef d'équipe de l'usine"),
+        )
+
+    def test_count_occurrences(self):
+        self.assertEqual(2, job_label_index.count_occurrences('aa', 'aaa'))
+        self.assertEqual(0, job_label_index.count_occurrences('ab', 'aaa'))
+
+    def test_search_by_rome(self):
+        results = self.index.search_by_rome('boucher')
+        self.assertEqual(['D1101', 'D1106'], [document['rome_code'] for _, document in results])
+        # Only the best OGR of each ROME is kept.
+        self.assertEqual('Boucher / Bouchère', results[0][1]['ogr_description'])
+        self.assertGreater(results[0][0], results[1][0])
+
+    def test_search_is_accent_insensitive(self):
+        results = self.index.search_by_rome('equipe')
+        self.assertEqual(['H2101'], [document['rome_code'] for _, document in results])
+
+    def test_search_matches_parts_of_words(self):
+        results = self.index.search_by_rome('veloppe')
+        self.assertEqual(['M1805'], [document['rome_code'] for _, document in results])
+
+    def test_search_more_matched_words_first(self):
+        results = self.index.search_by_rome('vendeur boucher')
+        self.assertEqual('D1106', results[0][1]['rome_code'])
+
+    def test_search_no_match(self):
+        self.assertEqual([], self.index.search_by_rome('x'))
+        self.assertEqual([], self.index.search_by_rome('plombier'))
+        self.assertEqual([], self.index.search_by_rome('   '))
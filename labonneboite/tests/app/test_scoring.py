@@ -1,6 +1,6 @@
 import unittest
 
-from labonneboite.common import scoring
+from labonneboite.common import mapping, scoring
 
 
 class ScoringTest(unittest.TestCase):
@@ -35,3 +35,28 @@ class ScoringTest(unittest.TestCase):
         self.assertEqual(scoring.get_stars_from_score(scoring.get_score_from_stars(2.5)), 2.5)
         self.assertEqual(scoring.get_stars_from_score(scoring.get_score_from_stars(2)), 2.5)
         self.assertEqual(scoring.get_stars_from_score(scoring.get_score_from_stars(1)), 2.5)
+
+    def test_rome_naf_matrix_scores(self):
+        matrix = scoring.get_rome_naf_matrix()
+        naf_codes = sorted(mapping.MANUAL_NAF_ROME_MAPPING)[:50]
+        for hiring in [0, 0.15, 1, 2.5, 7, 30, 123.5, 10000]:
+            for naf_code in naf_codes:
+                expected = {
+                    rome_code: scoring.get_score_adjusted_to_rome_code_and_naf_code(
+                        rome_code=rome_code, naf_code=naf_code, hiring=hiring)
+                    for rome_code in mapping.MANUAL_NAF_ROME_MAPPING[naf_code]
+                }
+                self.assertEqual(expected, matrix.get_scores_for_naf(naf_code, hiring))
+
+    def test_scores_from_hirings(self):
+        hirings = [-3.5, -0.05, 0, 0.05, 0.15, 0.25, 0.35, 1.45, 2.95, 3, 3.05, 3.5, 4.5, 49.5, 99.99, 499.5, 500,
+                   501, 1e6]
+        self.assertEqual(
+            [scoring.get_score_from_hirings(value) for value in hirings],
+            scoring.get_scores_from_hirings(hirings).tolist(),
+        )
+
+    def test_rome_naf_matrix_unknown_naf(self):
+        matrix = scoring.get_rome_naf_matrix()
+        self.assertEqual({}, matrix.get_scores_for_naf('0000Z', 10))
+        self.assertEqual(0.0, matrix.get_affinity('A1101', '0000Z'))
@@ -73,3 +73,104 @@ class TestHiddenMarketFetcher(unittest.TestCase):
                     self.fail(f'Invalid props in {self.test_dir}/{name}{PROPS_SUFFIX} : {e}')
                 result = fetcher._build_elastic_search_query()
                 self.assertDictEqual(expected_result, result, f"in subTest({name})\n{json.dumps(result)}")
+
+    @staticmethod
+    def _es_response(total: int) -> dict:
+        return {'hits': {'total': total, 'hits': []}}
+
+    def _get_fetcher(self, **kwargs) -> HiddenMarketFetcher:
+        props = dict(longitude=1, latitude=2, romes=['D1101'], distance=10)
+        props.update(kwargs)
+        return HiddenMarketFetcher(**props)
+
+    def test_get_offices_single_round_trip(self):
+        fetcher = self._get_fetcher()
+        with patch.object(fetcher, '_get_offices_from_es', return_value=self._es_response(42)) as search_mock, \
+                patch.object(fetcher, '_count_offices_from_es') as count_mock:
+            offices, aggregations = fetcher.get_offices(single_round_trip=True)
+        self.assertEqual(1, search_mock.call_count)
+        count_mock.assert_not_called()
+        self.assertEqual(42, fetcher.office_count)
+        self.assertEqual([], offices)
+        self.assertEqual({}, aggregations)
+
+    def test_get_offices_two_round_trips(self):
+        fetcher = self._get_fetcher()
+        with patch.object(fetcher, '_get_offices_from_es', return_value=self._es_response(42)) as search_mock, \
+                patch.object(fetcher, '_count_offices_from_es', return_value=42) as count_mock:
+            fetcher.get_offices(single_round_trip=False)
+        self.assertEqual(1, search_mock.call_count)
+        self.assertEqual(1, count_mock.call_count)
+        self.assertEqual(42, fetcher.office_count)
+
+    def test_get_offices_single_round_trip_out_of_range_page(self):
+        fetcher = self._get_fetcher(from_number=101, to_number=110)
+        with patch.object(fetcher, '_get_offices_from_es', return_value=self._es_response(5)) as search_mock:
+            fetcher.get_offices(single_round_trip=True)
+        # The first page has to be fetched again, just like in the two round trips mode.
+        self.assertEqual(2, search_mock.call_count)
+        self.assertEqual(0, search_mock.call_args[0][0]['from'])
+        self.assertEqual(1, fetcher.from_number)
+        self.assertEqual(6, fetcher.to_number)
+
+    def test_suggestions_msearch(self):
+        fetcher = self._get_fetcher()
+        alternative_romes = set(search.ROME_MOBILITIES['D1101']) - {'D1101'}
+        # One response per alternative rome, then one per distance (30, 50 and 3000 km).
+        responses = [self._es_response(3) for _ in alternative_romes]
+        responses += [self._es_response(1), self._es_response(1), self._es_response(7)]
+        with patch.object(HiddenMarketFetcher, '_msearch_offices_from_es', return_value=responses) as msearch_mock, \
+                patch.object(HiddenMarketFetcher, '_count_offices_from_es') as count_mock:
+            fetcher._compute_suggestions(batched=True)
+
+        self.assertEqual(1, msearch_mock.call_count)
+        count_mock.assert_not_called()
+        body = msearch_mock.call_args[0][0]
+        self.assertEqual(2 * len(responses), len(body))
+        self.assertEqual({rome: 3 for rome in alternative_romes}, fetcher.alternative_rome_codes)
+        self.assertEqual(
+            [(30, ('30 km', 1)), (3000, ('France entière', 7))],
+            list(fetcher.alternative_distances.items()),
+        )
+
+    def test_suggestions_serial(self):
+        fetcher = self._get_fetcher()
+        with patch.object(HiddenMarketFetcher, '_msearch_offices_from_es') as msearch_mock, \
+                patch.object(HiddenMarketFetcher, '_count_offices_from_es', return_value=2):
+            fetcher._compute_suggestions(batched=False)
+
+        msearch_mock.assert_not_called()
+        self.assertEqual([(30, ('30 km', 2))], list(fetcher.alternative_distances.items()))
+
+    def test_filter_aggregations_single_query(self):
+        fetcher = self._get_fetcher(naf_codes=['4711C'], aggregate_by=search.FILTERS)
+        es_response = {
+            'hits': {'total': 0, 'hits': []},
+            'aggregations': {
+                'base': {'doc_count': 3},
+                'naf': {'doc_count': 5, 'naf': {'buckets': [{'key': '4711C', 'doc_count': 3},
+                                                            {'key': '4711D', 'doc_count': 2}]}},
+                'headcount': {'doc_count': 3, 'headcount': {'buckets': [{'key': 1, 'doc_count': 2},
+                                                                        {'key': 32, 'doc_count': 1}]}},
+                'distance': {'doc_count': 8, 'distance': {'buckets': [{'key': '*-10.0', 'doc_count': 3},
+                                                                      {'key': '*-3000.0', 'doc_count': 8}]}},
+                'dpae': {'doc_count': 3},
+                'alternance': {'doc_count': 1},
+            },
+        }
+        with patch.object(fetcher, '_get_offices_from_es', return_value=es_response) as search_mock:
+            facets = fetcher.get_filter_aggregations()
+
+        self.assertEqual(1, search_mock.call_count)
+        query = search_mock.call_args[0][0]
+        self.assertEqual(0, query['size'])
+        # The naf filter must only apply to the facets other than naf.
+        naf_filter = {'terms': {'naf': ['4711C']}}
+        self.assertNotIn(naf_filter, query['query']['filtered']['filter']['bool']['must'])
+        self.assertIn(naf_filter, query['aggs']['headcount']['filter']['bool']['must'])
+        self.assertNotIn(naf_filter, query['aggs']['naf']['filter'].get('bool', {}).get('must', []))
+
+        self.assertEqual(['4711C', '4711D'], [naf['code'] for naf in facets['naf']])
+        self.assertEqual({'small': 2, 'big': 1}, facets['headcount'])
+        self.assertEqual({'less_10_km': 3, 'france': 8}, facets['distance'])
+        self.assertEqual({'alternance': 1, 'dpae': 3}, facets['contract'])
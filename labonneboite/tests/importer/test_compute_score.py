@@ -0,0 +1,53 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from labonneboite.importer import compute_score
+
+
+class ExtractCacheTest(unittest.TestCase):
+    """
+    Test ExtractCache.
+    """
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.source_signature = {'etablissements_raw': {'count': 2, 'checksum': '1234'}}
+        for patch in [
+                mock.patch.object(compute_score.ExtractCache, 'FOLDER', folder.name),
+                mock.patch.object(compute_score, 'get_source_signature', side_effect=lambda _: self.source_signature),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.df = pd.DataFrame({'siret': ['78548035101646', '78548035101647'], 'hiring': [3, 5]})
+
+    def get_cache(self):
+        return compute_score.ExtractCache('57', datetime.date(2020, 1, 1))
+
+    def test_miss_then_hit(self):
+        load = mock.Mock(return_value=self.df)
+
+        pd.testing.assert_frame_equal(self.df, self.get_cache().get('etab', load))
+        pd.testing.assert_frame_equal(self.df, self.get_cache().get('etab', load))
+
+        load.assert_called_once_with()
+
+    def test_stale_signature(self):
+        self.get_cache().write('etab', self.df)
+        self.assertIsNotNone(self.get_cache().read('etab'))
+
+        # An office was updated in place: the row count is the same, but not the checksum.
+        self.source_signature = {'etablissements_raw': {'count': 2, 'checksum': '5678'}}
+        self.assertIsNone(self.get_cache().read('etab'))
+
+        updated_df = self.df.assign(hiring=[4, 5])
+        pd.testing.assert_frame_equal(updated_df, self.get_cache().get('etab', lambda: updated_df))
+        pd.testing.assert_frame_equal(updated_df, self.get_cache().read('etab'))
+
+    def test_compact_dataframes_are_cached_separately(self):
+        self.get_cache().write('etab', self.df)
+        self.assertIsNone(compute_score.ExtractCache('57', datetime.date(2020, 1, 1), compact=True).read('etab'))
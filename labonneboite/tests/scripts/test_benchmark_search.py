@@ -0,0 +1,16 @@
+from labonneboite.scripts import benchmark_search
+from labonneboite.tests.test_base import AppTest
+
+
+class BenchmarkSearchTest(AppTest):
+
+    def test_run_scenarios(self):
+        offices = benchmark_search.make_offices(5)
+        for name, scenario in benchmark_search.SCENARIOS.items():
+            recorder = benchmark_search.run_scenario(offices, scenario, repeat=2, page_size=5)
+            self.assertEqual(3, len(recorder.durations['total']), name)
+            self.assertEqual(2, len(recorder.durations['es stub']), name)
+            self.assertIn('_format_offices_in_office_results', recorder.allocations, name)
+            self.assertIn('build_result', recorder.allocations, name)
+
+        self.assertIn('_compute_suggestions', recorder.durations)
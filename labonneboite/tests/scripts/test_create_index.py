@@ -1,4 +1,7 @@
 import datetime
+import os
+import tempfile
+import time
 from unittest import mock
 
 from flask import url_for
@@ -6,7 +9,7 @@ from social_flask_sqlalchemy.models import UserSocialAuth
 
 from labonneboite.common import mapping as mapping_util
 from labonneboite.common.models import Office, OfficeAdminAdd, OfficeAdminRemove, OfficeAdminUpdate
-from labonneboite.common.models import OfficeAdminExtraGeoLocation, User
+from labonneboite.common.models import OfficeAdminExtraGeoLocation, OfficeFingerprint, User
 from labonneboite.common.database import db_session
 from labonneboite.conf import settings
 from labonneboite.common import es
@@ -253,6 +256,78 @@ class VariousModesTest(CreateIndexBaseTest):
         )
 
 
+class CheckpointsTest(CreateIndexBaseTest):
+    """
+    Test resumable full indexing.
+    """
+
+    def setUp(self):
+        super().setUp()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        for patch in [
+                mock.patch.object(script.Checkpoints, 'ACTIVATED', True),
+                mock.patch.object(script.Checkpoints, 'FOLDER', folder.name),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_get_departements_to_index(self):
+        script.save_checkpoint(settings.ES_INDEX, '57', 1)
+        # Wrong count: this departement must be indexed again.
+        script.save_checkpoint(settings.ES_INDEX, '44', 2)
+
+        self.assertEqual({'57': 1, '44': 2}, script.load_checkpoints(settings.ES_INDEX))
+        departements = script.get_departements_to_index(settings.ES_INDEX)
+        self.assertNotIn('57', departements)
+        self.assertIn('44', departements)
+        self.assertEqual(len(script.dpt.DEPARTEMENTS) - 1, len(departements))
+
+    def test_resume_full_indexing(self):
+        with mock.patch.object(script, 'create_job_codes', side_effect=Exception("crash")):
+            with self.assertRaises(Exception):
+                script.update_data(create_full=True, create_partial=False, disable_parallel_computing=True)
+
+        # The new index was kept, with the checkpoints of all departements.
+        index_name = script.get_resumable_index_name()
+        self.assertIsNotNone(index_name)
+        self.assertNotIn(index_name, self.es.indices.get_alias(name=settings.ES_INDEX))
+        self.assertEqual(1, script.load_checkpoints(index_name)['57'])
+        self.assertEqual(len(script.dpt.DEPARTEMENTS), len(script.load_checkpoints(index_name)))
+
+        # The resumed run fails again, after the job codes were indexed.
+        with mock.patch.object(script, 'create_offices_for_departement') as create_offices_for_departement, \
+                mock.patch.object(script, 'create_locations', side_effect=Exception("crash")):
+            with self.assertRaises(Exception):
+                script.update_data(create_full=True, create_partial=False, disable_parallel_computing=True,
+                                   resume=True)
+        create_offices_for_departement.assert_not_called()
+        self.assertEqual(index_name, script.get_resumable_index_name())
+        self.es.indices.flush(index=index_name)
+        ogr_count = self.count_documents(index_name, es.OGR_TYPE)
+        self.assertGreater(ogr_count, 0)
+
+        with mock.patch.object(script, 'create_offices_for_departement') as create_offices_for_departement:
+            script.update_data(create_full=True, create_partial=False, disable_parallel_computing=True,
+                               resume=True)
+        create_offices_for_departement.assert_not_called()
+
+        # The resumed index is now live and the checkpoints are cleared.
+        self.assertEqual([index_name], list(self.es.indices.get_alias(name=settings.ES_INDEX).keys()))
+        self.assertIsNone(script.get_resumable_index_name())
+        self.assertFalse(os.path.exists(script.get_checkpoints_folder(index_name)))
+        res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office1.siret)
+        self.assertEqual(res['_source']['email'], self.office1.email)
+
+        # Job codes indexed twice were not duplicated.
+        self.es.indices.flush(index=index_name)
+        self.assertEqual(ogr_count, self.count_documents(index_name, es.OGR_TYPE))
+        self.assertEqual(len(script.geocoding.get_cities()), self.count_documents(index_name, es.LOCATION_TYPE))
+
+    def count_documents(self, index_name, doc_type):
+        return self.es.count(index=index_name, doc_type=doc_type, body={'query': {'match_all': {}}})['count']
+
+
 class UtilsTest(CreateIndexBaseTest):
     """
     Test utility functions.
@@ -299,6 +374,192 @@ class UtilsTest(CreateIndexBaseTest):
         }
         self.assertDictEqual(doc, expected_doc)
 
+    def test_iter_offices_by_window(self):
+        query = db_session.query(Office)
+        offices = list(script.iter_offices_by_window(query, window_size=1))
+        self.assertEqual([self.office1.siret, self.office2.siret], [office.siret for office in offices])
+
+    def test_create_offices_streaming(self):
+        script.es.drop_and_create_index()
+        with mock.patch.object(script.Streaming, 'ACTIVATED', True), \
+                mock.patch.object(script.Streaming, 'WINDOW_SIZE', 1):
+            script.create_offices(disable_parallel_computing=True)
+        self.es.indices.flush(index=settings.ES_INDEX)
+
+        # We should have 3 offices in ES (2 + the fake office).
+        count = self.es.count(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, body={'query': {'match_all': {}}})
+        self.assertEqual(count['count'], 2 + 1)
+        res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office1.siret)
+        self.assertEqual(res['_source'], script.get_office_as_es_doc(self.office1))
+
+    def test_create_offices_parallel_bulk(self):
+        script.es.drop_and_create_index()
+        with mock.patch.object(script.ParallelBulk, 'ACTIVATED', True), \
+                mock.patch.object(script.ParallelBulk, 'CHUNK_SIZE', 1):
+            script.create_offices(disable_parallel_computing=True)
+        self.es.indices.flush(index=settings.ES_INDEX)
+
+        count = self.es.count(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, body={'query': {'match_all': {}}})
+        self.assertEqual(count['count'], 2 + 1)
+        res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office2.siret)
+        self.assertEqual(res['_source'], script.get_office_as_es_doc(self.office2))
+
+    def test_chunk_bulk_actions(self):
+        actions = [{'_op_type': 'index', '_id': i, '_source': {'name': 'x' * 10}} for i in range(5)]
+        serializer = self.es.transport.serializer
+        chunks = list(script.chunk_bulk_actions(actions, serializer, chunk_size=2, max_chunk_bytes=10**6))
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        # A single action larger than max_chunk_bytes still gets its own chunk.
+        chunks = list(script.chunk_bulk_actions(actions, serializer, chunk_size=10, max_chunk_bytes=1))
+        self.assertEqual([1] * 5, [len(chunk) for chunk in chunks])
+
+    def test_send_bulk_chunk_retries_rejected_actions(self):
+        chunk = [('{"index": {"_id": 1}}', '{}'), ('{"index": {"_id": 2}}', '{}')]
+        client = mock.Mock()
+        client.bulk.side_effect = [
+            {'items': [
+                {'index': {'status': 201}},
+                {'index': {'status': 429, 'error': 'EsRejectedExecutionException'}},
+            ]},
+            {'items': [{'index': {'status': 201}}]},
+        ]
+        with mock.patch.object(script, 'ES_BULK_RETRY_DELAY_IN_SECONDS', 0):
+            success_count, errors, _ = script.send_bulk_chunk(client, chunk)
+
+        self.assertEqual((2, []), (success_count, errors))
+        self.assertEqual(2, client.bulk.call_count)
+        # Only the rejected action is sent again.
+        self.assertEqual('{"index": {"_id": 2}}\n{}\n', client.bulk.call_args[1]['body'])
+
+    def test_parallel_bulk_raises_on_failed_actions(self):
+        actions = [{'_op_type': 'index', '_id': i, '_source': {'name': 'x'}} for i in range(2)]
+        client = mock.Mock()
+        client.transport.serializer = self.es.transport.serializer
+        client.bulk.return_value = {
+            'items': [{'index': {'status': 201}}, {'index': {'status': 400, 'error': 'MapperParsingException'}}],
+        }
+        with mock.patch.object(script.es, 'new_elasticsearch_instance', return_value=client), \
+                self.assertRaises(script.BulkIndexError) as context:
+            script.parallel_bulk_actions(actions, thread_count=1, chunk_size=10)
+
+        # The failed action is not retried.
+        self.assertEqual(1, client.bulk.call_count)
+        self.assertEqual([{'status': 400, 'error': 'MapperParsingException'}], context.exception.errors)
+
+    def test_get_office_counts_by_rome(self):
+        office_counts = script.get_office_counts_by_rome(['D1106', 'A1101'], self.office1.y, self.office1.x, 3000)
+        self.assertEqual({'D1106': 2, 'A1101': 0}, office_counts)
+
+        with mock.patch.object(script, 'SANITY_CHECK_ROME_CHUNK_SIZE', 1):
+            self.assertEqual(
+                office_counts,
+                script.get_office_counts_by_rome(['D1106', 'A1101'], self.office1.y, self.office1.x, 3000),
+            )
+
+    def test_job_telemetry(self):
+        telemetry = script.JobTelemetry('57')
+        offices = telemetry.timed(range(3), 'db read')
+        docs = list(telemetry.timed((office * 2 for office in offices), 'doc build'))
+        telemetry.stop(len(docs), nested_reads=True)
+
+        self.assertEqual([0, 2, 4], docs)
+        self.assertEqual(3, telemetry.doc_count)
+        self.assertEqual(set(script.JobTelemetry.PHASES), set(telemetry.durations))
+        for duration in telemetry.durations.values():
+            self.assertGreaterEqual(duration, 0)
+        self.assertAlmostEqual(telemetry.duration, sum(telemetry.durations.values()))
+        self.assertGreater(telemetry.peak_rss_mb, 0)
+
+    def test_job_telemetry_reads_before_doc_build(self):
+        def slow_offices():
+            for office in range(3):
+                time.sleep(0.05)
+                yield office
+
+        telemetry = script.JobTelemetry('57')
+        offices = list(telemetry.timed(slow_offices(), 'db read'))
+        docs = list(telemetry.timed((office * 2 for office in offices), 'doc build'))
+        telemetry.stop(len(docs), nested_reads=False)
+
+        self.assertGreaterEqual(telemetry.durations['db read'], 0.15)
+        self.assertLess(telemetry.durations['doc build'], 0.05)
+        self.assertLess(telemetry.durations['bulk send'], 0.05)
+        self.assertAlmostEqual(telemetry.duration, sum(telemetry.durations.values()))
+
+    def test_create_offices_for_departement_telemetry(self):
+        script.es.drop_and_create_index()
+        telemetry = script.create_offices_for_departement('57')
+        self.assertEqual('57', telemetry.departement)
+        self.assertEqual(1, telemetry.doc_count)
+        self.assertGreater(telemetry.docs_per_second, 0)
+
+
+class DeltaIndexingTest(CreateIndexBaseTest):
+    """
+    Test update_offices_delta().
+    """
+
+    def setUp(self):
+        patch = mock.patch.object(script.Fingerprints, 'ACTIVATED', True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        super().setUp()
+
+    def get_fingerprints(self):
+        return {fingerprint.siret: fingerprint.fingerprint for fingerprint in OfficeFingerprint.query.all()}
+
+    def test_fingerprints_saved_by_full_indexing(self):
+        fingerprints = self.get_fingerprints()
+        self.assertEqual({self.office1.siret, self.office2.siret}, set(fingerprints))
+        expected_fingerprint = script.get_es_doc_fingerprint(script.get_office_as_es_doc(self.office1))
+        self.assertEqual(expected_fingerprint, fingerprints[self.office1.siret])
+
+    def test_fingerprints_not_saved_by_default(self):
+        script.reset_fingerprints()
+        with mock.patch.object(script.Fingerprints, 'ACTIVATED', False):
+            script.create_offices_for_departement('57')
+        self.assertEqual({}, self.get_fingerprints())
+
+    def test_removed_office_sirets(self):
+        # office1 moved to another departement, where it is still indexed: its job will update it.
+        with mock.patch.object(script.st, 'increment_office_count') as increment_office_count:
+            removed_sirets = script.get_removed_office_sirets('44', [self.office1.siret, '00000000000000'])
+        self.assertEqual(['00000000000000'], removed_sirets)
+        increment_office_count.assert_not_called()
+
+    def test_only_changed_offices_are_indexed(self):
+        self.office1.email = 'new@match.com'
+        self.office1.save()
+
+        fingerprints = {}
+        actions = list(script.get_office_delta_actions(
+            [self.office1, self.office2], '57', self.get_fingerprints(), fingerprints, [],
+        ))
+
+        self.assertEqual([self.office1.siret], [action['_id'] for action in actions])
+        self.assertEqual({self.office1.siret, self.office2.siret}, set(fingerprints))
+
+    def test_update_offices_delta(self):
+        self.office1.email = 'new@match.com'
+        self.office1.save()
+        self.office2.delete()
+
+        script.update_offices_delta(disable_parallel_computing=True)
+        self.es.indices.flush(index=settings.ES_INDEX)
+
+        res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office1.siret)
+        self.assertEqual(res['_source']['email'], 'new@match.com')
+        self.assertFalse(self.es.exists(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office2.siret))
+
+        fingerprints = self.get_fingerprints()
+        self.assertEqual([self.office1.siret], list(fingerprints))
+        self.assertEqual(script.get_es_doc_fingerprint(res['_source']), fingerprints[self.office1.siret])
+
+    def test_delta_requires_a_full_indexing(self):
+        script.reset_fingerprints()
+        with self.assertRaises(ValueError):
+            script.update_offices_delta(disable_parallel_computing=True)
+
 
 class AddOfficesTest(CreateIndexBaseTest):
     """
@@ -343,6 +604,43 @@ class AddOfficesTest(CreateIndexBaseTest):
         self.assertEqual(res['_source']['siret'], office.siret)
         self.assertEqual(res['_source']['score'], office.score)
 
+    def test_add_offices_summary(self):
+        """
+        Test `add_offices` with new offices, an existing one and an ES failure.
+        """
+        for siret in ["01625043300220", "01625043300221", "01625043300222", self.office1.siret]:
+            OfficeAdminAdd(
+                siret=siret,
+                company_name="CHAUSSURES CENDRY",
+                office_name="GEP",
+                naf="4772A",
+                street_number="11",
+                street_name="RUE FABERT",
+                zipcode="57000",
+                city_code="57463",
+                flag_alternance=0,
+                flag_junior=0,
+                flag_senior=0,
+                departement="57",
+                headcount='31',
+                hiring=100,
+                x=6.17528,
+                y=49.1187,
+                reason="Demande de mise en avant",
+            ).save()
+        # A document already exists in ES for this siret: it cannot be created.
+        self.es.index(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id="01625043300222", body={})
+
+        summary = script.add_offices()
+
+        self.assertEqual(["01625043300220", "01625043300221"], summary['added'])
+        self.assertEqual([self.office1.siret], summary['skipped'])
+        self.assertEqual(["01625043300222"], list(summary['failed']))
+        for siret in summary['added']:
+            res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=siret)
+            self.assertEqual(siret, res['_source']['siret'])
+        self.assertEqual(self.office1.company_name, Office.get(self.office1.siret).company_name)
+
 
 class RemoveOfficesTest(CreateIndexBaseTest):
     """
@@ -383,6 +681,25 @@ class RemoveOfficesTest(CreateIndexBaseTest):
         count = self.es.count(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, body={'query': {'match_all': {}}})
         self.assertEqual(count['count'], 1)
 
+    def test_remove_offices_summary(self):
+        """
+        Test `remove_offices` with an office which is neither in ES nor in the DB.
+        """
+        for siret in [self.office1.siret, '01234567891234']:
+            OfficeAdminRemove(siret=siret, name="Test company", reason="N/A", initiative=False).save()
+
+        summary = script.remove_offices()
+        self.es.indices.flush(index=settings.ES_INDEX)
+
+        self.assertEqual({
+            'removed': [self.office1.siret],
+            'missing': ['01234567891234'],
+            'failed': [],
+        }, summary)
+        self.assertEqual([self.office2.siret], [office.siret for office in Office.query.all()])
+        self.assertFalse(self.es.exists(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office1.siret))
+        self.assertTrue(self.es.exists(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office2.siret))
+
 
 class UpdateOfficesTest(CreateIndexBaseTest):
     """
@@ -949,6 +1266,36 @@ class UpdateOfficesTest(CreateIndexBaseTest):
         # Check contact mode
         self.assertEqual("Come with his driver license", office.contact_mode)
 
+    def test_update_offices_summary(self):
+        """
+        Test `update_offices` with several updates of several offices, one of them missing in ES.
+        """
+        OfficeAdminUpdate(
+            sirets='\n'.join([self.office1.siret, self.office2.siret]),
+            name=self.office1.company_name,
+            new_email="old@pole-emploi.fr",
+        ).save()
+        # More recent update: it takes priority.
+        OfficeAdminUpdate(
+            sirets=self.office1.siret,
+            name=self.office1.company_name,
+            new_email="new@pole-emploi.fr",
+        ).save()
+        self.es.delete(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office2.siret)
+
+        summary = script.update_offices(OfficeAdminUpdate)
+
+        self.assertEqual([self.office1.siret], summary['updated'])
+        self.assertEqual([self.office2.siret], summary['missing'])
+        self.assertEqual([], summary['failed'])
+        self.assertEqual(['db read', 'overlay', 'db write', 'es bulk', 'pdf'], list(summary['durations']))
+
+        self.assertEqual("new@pole-emploi.fr", Office.get(self.office1.siret).email)
+        self.assertEqual("old@pole-emploi.fr", Office.get(self.office2.siret).email)
+        res = self.es.get(index=settings.ES_INDEX, doc_type=es.OFFICE_TYPE, id=self.office1.siret)
+        self.assertEqual("new@pole-emploi.fr", res['_source']['email'])
+        self.assertIn('scores_by_rome', res['_source'])
+
     def test_minimum_score_for_rome(self):
         """
         Test `get_score_minimum_for_rome` to get a score threshold that a company must have at least
@@ -0,0 +1,65 @@
+from labonneboite.common import es, hiring_type_util, sorting
+from labonneboite.common.search import HiddenMarketFetcher
+from labonneboite.conf import settings
+from labonneboite.scripts import migrate_scores_encoding as script
+from labonneboite.tests.scripts.test_create_index import CreateIndexBaseTest
+
+
+class MigrateScoresEncodingTest(CreateIndexBaseTest):
+
+    def search(self, romes, scores_encoding):
+        fetcher = HiddenMarketFetcher(
+            romes=romes,
+            latitude=self.office1.y,
+            longitude=self.office1.x,
+            distance=3000,
+            sort=sorting.SORT_FILTER_SCORE,
+            hiring_type=hiring_type_util.DPAE,
+            scores_encoding=scores_encoding,
+        )
+        offices, _ = fetcher.get_offices()
+        return [office.siret for office in offices]
+
+    def test_encode_scores(self):
+        self.assertEqual(
+            {'scores_by_rome': {'D1106': 90}},
+            es.encode_scores('scores_by_rome', {'D1106': 90}, es.SCORES_ENCODING_OBJECT),
+        )
+        self.assertEqual(
+            {
+                'scores_by_rome': {'D1106': 90, 'D1101': 60},
+                'rome_scores': [{'rome': 'D1101', 'score': 60}, {'rome': 'D1106', 'score': 90}],
+            },
+            es.encode_scores('scores_by_rome', {'D1106': 90, 'D1101': 60}, es.SCORES_ENCODING_NESTED),
+        )
+        with self.assertRaises(ValueError):
+            es.encode_scores('scores_by_rome', {}, 'unknown')
+
+    def test_reencode_office(self):
+        source = {'siret': '1', 'scores_by_rome': {'D1106': 90}, 'rome_scores': [{'rome': 'D1106', 'score': 90}]}
+        self.assertEqual(
+            {'siret': '1', 'scores_by_rome': {'D1106': 90}},
+            script.reencode_office(source, es.SCORES_ENCODING_OBJECT),
+        )
+        self.assertEqual(source, script.reencode_office(source, es.SCORES_ENCODING_NESTED))
+
+    def test_migrate(self):
+        old_indexes = list(self.es.indices.get_alias(name=settings.ES_INDEX).keys())
+        self.assertEqual(es.SCORES_ENCODING_OBJECT, script.get_index_scores_encoding(old_indexes[0]))
+        expected_single_rome = self.search(['D1106'], es.SCORES_ENCODING_OBJECT)
+        expected_multi_rome = self.search(['D1106', 'D1101', 'D1214'], es.SCORES_ENCODING_OBJECT)
+        self.assertEqual([self.office1.siret, self.office2.siret], expected_single_rome)
+
+        new_index = script.migrate(es.SCORES_ENCODING_NESTED, switch_alias=True)
+        try:
+            self.assertEqual([new_index], list(self.es.indices.get_alias(name=settings.ES_INDEX).keys()))
+            self.assertEqual(es.SCORES_ENCODING_NESTED, script.get_index_scores_encoding(new_index))
+            count = self.es.count(index=new_index, doc_type=es.OFFICE_TYPE)
+            self.assertEqual(2 + 1, count['count'])
+
+            self.assertEqual(expected_single_rome, self.search(['D1106'], es.SCORES_ENCODING_NESTED))
+            self.assertEqual(expected_multi_rome, self.search(['D1106', 'D1101', 'D1214'], es.SCORES_ENCODING_NESTED))
+            self.assertEqual([], self.search(['A1101'], es.SCORES_ENCODING_NESTED))
+        finally:
+            for index in old_indexes:
+                es.drop_index(index)
@@ -1,3 +1,6 @@
+import json
+
+from labonneboite.common.database import engine
 from labonneboite.tests.test_base import AppTest
 
 
@@ -19,3 +22,19 @@ class HealthTest(AppTest):
         rv = self.app.get("/health/uwsgi")
         self.assertEqual(rv.status_code, 200)
         self.assertEqual(rv.data, b'yes')
+
+    def test_health_db_pool(self):
+        self.app.get("/health/db")
+        rv = self.app.get("/health/db/pool")
+        self.assertEqual(rv.status_code, 200)
+        stats = json.loads(rv.data.decode())
+        self.assertGreaterEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['timeouts'], 0)
+        self.assertIn('wait_time_max', stats)
+
+    def test_teardown_keeps_pooled_connections(self):
+        self.app.get("/health/db")
+        self.app.get("/health/db")
+        # The connection of the first request was given back to the pool and reused by the second one.
+        self.assertGreaterEqual(engine.pool.checkedin(), 1)
+        self.assertGreaterEqual(engine.pool.checkouts, 2)
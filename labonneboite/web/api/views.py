@@ -251,31 +251,41 @@ def company_filter_list():
     # Add aggregations
     fetcher.aggregate_by = FILTERS
 
-    _, aggregations = fetcher.get_offices(add_suggestions=False)
-
-    if 'contract' in aggregations:
-        raise ValueError("Error, contract aggregation should only be computed at a later step.")
-
     result = {}
-    if fetcher.aggregate_by:
-        result['filters'] = aggregations
-
-        # If a filter or more are selected, the aggregations returned by fetcher.get_offices()
-        # will be filtered too... To avoid that, we are doing additionnal ES calls (one by filter activated).
-        if 'naf_codes' in request.args and 'naf' in fetcher.aggregate_by:
-            result['filters']['naf'] = fetcher.get_naf_aggregations()
-        if 'headcount' in request.args and 'headcount' in fetcher.aggregate_by:
-            result['filters']['headcount'] = fetcher.get_headcount_aggregations()
-        if 'distance' in fetcher.aggregate_by and fetcher.distance != DISTANCE_FILTER_MAX:
-            result['filters']['distance'] = fetcher.get_distance_aggregations()
-        if 'hiring_type' in fetcher.aggregate_by:
-            result['filters']['contract'] = fetcher.get_contract_aggregations()
+    if settings.API_FILTER_SINGLE_QUERY:
+        result['filters'] = fetcher.get_filter_aggregations()
+    else:
+        result['filters'] = get_filter_aggregations_one_search_per_facet(fetcher)
 
     result.update(get_result(fetcher, commune_id=None, departments=None, add_url=False, add_count=False))
 
     return jsonify(result)
 
 
+def get_filter_aggregations_one_search_per_facet(fetcher):
+    """
+    Former way of computing the /filter/ facets, kept for comparison with
+    HiddenMarketFetcher.get_filter_aggregations(): one ES search per facet.
+    """
+    _, aggregations = fetcher.get_offices(add_suggestions=False)
+
+    if 'contract' in aggregations:
+        raise ValueError("Error, contract aggregation should only be computed at a later step.")
+
+    # If a filter or more are selected, the aggregations returned by fetcher.get_offices()
+    # will be filtered too... To avoid that, we are doing additionnal ES calls (one by filter activated).
+    if 'naf_codes' in request.args and 'naf' in fetcher.aggregate_by:
+        aggregations['naf'] = fetcher.get_naf_aggregations()
+    if 'headcount' in request.args and 'headcount' in fetcher.aggregate_by:
+        aggregations['headcount'] = fetcher.get_headcount_aggregations()
+    if 'distance' in fetcher.aggregate_by and fetcher.distance != DISTANCE_FILTER_MAX:
+        aggregations['distance'] = fetcher.get_distance_aggregations()
+    if 'hiring_type' in fetcher.aggregate_by:
+        aggregations['contract'] = fetcher.get_contract_aggregations()
+
+    return aggregations
+
+
 def response_400(e):
     message = 'Invalid request argument: {}'.format(e.args[0])
     return message, 400
@@ -19,7 +19,7 @@ from social_flask_sqlalchemy.models import init_social
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from labonneboite.conf import settings
-from labonneboite.common import pro
+from labonneboite.common import autocomplete, pro
 from labonneboite.common.database import db_session, engine  # This is how we talk to the database.
 from labonneboite.common.env import ENV_DEVELOPMENT, get_current_env
 from labonneboite.common.models import Office, User
@@ -207,8 +207,11 @@ def register_teardown_appcontext(flask_app):
     """
 
     def shutdown_session(exception=None):
+        # Give the connection back to the pool.
         db_session.remove()
-        engine.dispose()
+        if settings.DB_DISPOSE_ENGINE_ON_TEARDOWN:
+            # Close all pooled connections: each request then opens a new one.
+            engine.dispose()
 
     flask_app.teardown_appcontext(shutdown_session)
 
@@ -238,9 +241,12 @@ def create_app():
     register_before_requests(flask_app)
     register_context_processors(flask_app)
     register_teardown_appcontext(flask_app)
-    register_teardown_appcontext(flask_app)
     register_templates_functions(flask_app)
 
+    if settings.AUTOCOMPLETE_JOB_LABELS_LOCAL_INDEX:
+        # Build the job labels index now rather than during the first autocomplete request.
+        autocomplete.get_job_label_index()
+
     # Assets.
     assets = Environment(app=flask_app)
     js = Bundle(
@@ -1,6 +1,7 @@
 from flask import Blueprint
-from flask import make_response
+from flask import jsonify, make_response
 
+from labonneboite.common.database import get_pool_stats
 from labonneboite.web.health import util as health_util
 
 
@@ -30,6 +31,14 @@ def health_db():
     return health_response(health_util.is_db_alive())
 
 
+@healthBlueprint.route('/db/pool')
+def health_db_pool():
+    """
+    Counters of the database connection pool of the current worker: checkouts, wait times, overflow.
+    """
+    return jsonify(get_pool_stats())
+
+
 @healthBlueprint.route('/es')
 def health_es():
     """